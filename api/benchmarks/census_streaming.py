@@ -0,0 +1,132 @@
+"""
+Compare the JSON and streamed (ndjson/arrow) census responses on the mock
+sqlite database
+
+    python api/benchmarks/census_streaming.py --scale 20 --repeat 5
+
+Each format is run in its own process so that the peak RSS (ru_maxrss) of
+one does not hide the other. --scale copies the mock census that many times
+into a temporary database to show how each path grows with hospital size.
+"""
+import argparse
+import json
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+FORMATS = ("json", "ndjson", "arrow")
+
+
+def _scaled_mock_db(source: Path, scale: int, directory: str) -> Path:
+    path = Path(directory) / "census.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("ATTACH DATABASE ? AS source", (str(source),))
+        conn.execute("CREATE TABLE census AS SELECT * FROM source.census")
+        for _ in range(scale - 1):
+            conn.execute("INSERT INTO census SELECT * FROM source.census")
+    return path
+
+
+def _peak_rss_mb() -> float:
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _first_chunk_seconds(response_format: str) -> float | None:
+    """
+    Time until the first chunk of a streamed body is ready; the TestClient
+    buffers whole responses so this is read from the route's generator
+    """
+    from api import wards
+    from api.census.router import _iter_mock_census
+    from api.streaming import iter_arrow, iter_ndjson
+    from models.census import CensusRow
+
+    if response_format == "json":
+        return None
+
+    start = time.perf_counter()
+    rows = _iter_mock_census(list(wards.ALL), [])
+    chunks = (
+        iter_ndjson(rows)
+        if response_format == "ndjson"
+        else iter_arrow(rows, CensusRow)
+    )
+    next(chunks)
+    elapsed = time.perf_counter() - start
+    chunks.close()
+    return elapsed
+
+
+def run_format(response_format: str, scale: int, repeat: int) -> dict:
+    from fastapi.testclient import TestClient
+
+    from api import wards
+    from api.census import router as census_router
+    from api.main import app
+
+    client = TestClient(app)
+    params = {"departments": list(wards.ALL), "format": response_format}
+
+    with tempfile.TemporaryDirectory() as directory:
+        if scale > 1:
+            census_router.MOCK_DB = _scaled_mock_db(
+                census_router.MOCK_DB, scale, directory
+            )
+
+        rss_before = _peak_rss_mb()
+        latencies, size = [], 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = client.get("/mock/census/", params=params)
+            latencies.append(time.perf_counter() - start)
+            size = len(response.content)
+        rss_increase = _peak_rss_mb() - rss_before
+
+        first_chunk = _first_chunk_seconds(response_format)
+
+    latency = statistics.median(latencies)
+    return {
+        "format": response_format,
+        "ttfb_ms": 1000 * (latency if first_chunk is None else first_chunk),
+        "latency_ms": 1000 * latency,
+        "bytes": size,
+        "peak_rss_increase_mb": rss_increase,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--format", choices=FORMATS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.format:
+        print(json.dumps(run_format(args.format, args.scale, args.repeat)))
+        return
+
+    print(f"{'format':8} {'ttfb ms':>9} {'total ms':>9} {'MB sent':>8} {'+RSS MB':>8}")
+    for response_format in FORMATS:
+        output = subprocess.run(
+            [sys.executable, __file__, "--format", response_format]
+            + ["--scale", str(args.scale), "--repeat", str(args.repeat)],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{result['format']:8} {result['ttfb_ms']:9.1f} "
+            f"{result['latency_ms']:9.1f} {result['bytes'] / 1e6:8.1f} "
+            f"{result['peak_rss_increase_mb']:8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
-import json
-import time
+import asyncio
+import math
+import httpx
 import requests
 from functools import lru_cache
-from typing import Any, cast
+from typing import Any, Awaitable, Callable, cast
 
 from api.logger import logger, logger_timeit
 from api.config import Settings, get_settings
+from api.revalidate import LoopClient
 
 
 def _admin_auth_headers(token: str) -> dict[str, str]:
@@ -28,257 +30,85 @@ def _simple_auth_headers(token: str) -> dict[str, str]:
     }
 
 
-def _request(url: str, auth_token: str) -> requests.Response:
-    return requests.get(
-        url=url,
-        headers=_admin_auth_headers(auth_token),
-    )
+class BaserowException(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
 
+    def __repr__(self) -> str:
+        return self.message
 
-@logger_timeit()
-def _get_user_auth_token(settings: Settings) -> dict[str, str]:
-    """
 
-    Uses username/password authentication to get a user access token that
-    give admin privileges; permits a 1 minute pause if fails on first attempt;
-    this is necessary when the API is started at the same time
-    as the baserow application service
+class BaserowFieldNotFound(BaserowException):
+    """A filter referred to a field id that the table no longer has"""
 
-    Args:
-        settings: read from the .env file; specifically needs a
-            valid baserow username (email address) and password
 
-    Returns:
-        {access_token, refresh_token)
-    """
-    logger.info("Authenticating as admin via username/password")
-    msg = """
-    This typically happens on docker compose up.
-    We need to wait for the base row container to be ready before asking for
-    the user authentication token so we poll the baserow container a fixed
-    number of times at fixed intervals and only fail if no token is available
-    12 x 5 seconds (1 minute)
-    """
-    logger.debug(msg)
+# baserow error codes returned when a filter__field_{id} is unknown
+_STALE_FIELD_ERRORS = ("ERROR_FILTER_FIELD_NOT_FOUND", "ERROR_FIELD_DOES_NOT_EXIST")
 
-    @logger_timeit()
-    def _request_token() -> Any:
-        # access tokens valid for 10m
-        # refresh tokens valid for 168h
-        return requests.post(
-            f"{settings.baserow_url}/api/user/token-auth/",
-            headers={"Content-Type": "application/json"},
-            data=json.dumps(
-                {
-                    "email": settings.baserow_email,
-                    "password": settings.baserow_password.get_secret_value(),
-                }
-            ),
-        )
-
-    max_attempts, attempt = 12, 0
-    while attempt < max_attempts:
-        response = _request_token()
-        if response.status_code == 502:
-            logger.warning(
-                f"Bad gateway on attempt {attempt}: check baserow "
-                f"again in 5 seconds"
-            )
-            time.sleep(5)
-            attempt += 1
-            continue
-        else:
-            break
-
-    # noinspection PyUnboundLocalVariable
-    if response.status_code == 200:
-        access_token = cast(str, response.json()["access_token"])
-        refresh_token = cast(str, response.json()["refresh_token"])
-    else:
-        logger.error("Failed to authenticate as admin")
-        raise BaserowException(
-            f"unexpected response {response.status_code}: "
-            f""
-            f"{str(response.content)}"
-        )
-
-    baserow_tokens = {"access_token": access_token, "refresh_token": refresh_token}
-    return baserow_tokens
+# (field name, baserow filter type, value) e.g. ("closed", "boolean", True)
+Filters = list[tuple[str, str, Any]]
 
+# The most rows baserow accepts in one batch request
+BATCH_SIZE = 200
 
-def _refresh_user_auth_token(settings: Settings) -> str:
-    # access tokens valid for 10m
-    # refresh tokens valid for 168h
-    logger.info("Refreshing user authentication")
-    refresh_token = _get_user_auth_token(settings)["refresh_token"]
-    response = requests.post(
-        f"{settings.baserow_url}/api/user/token-refresh/",
-        headers={"Content-Type": "application/json"},
-        data=json.dumps({"refresh_token": refresh_token}),
-    )
 
+def _raise_for_status(response: requests.Response | httpx.Response) -> None:
     if response.status_code == 200:
-        logger.success("Refreshed access token")
-        access_token = cast(str, response.json()["access_token"])
-    else:
-        msg = (
-            "ERROR: unable to refresh access token unexpected response {"
-            "response.status_code}: {str(response.content)}"
-        )
-        logger.error(msg)
-        raise BaserowException(msg)
-    return access_token
-
-
-@logger_timeit()
-def _get_database_token(settings: Settings, auth_token: str, group_id: int) -> str:
-    response = requests.get(
-        url=f"{settings.baserow_url}/api/database/tokens/",
-        headers=_admin_auth_headers(auth_token),
-    )
-    if response.status_code != 200:
-        msg = f"Error {response.status_code}: unable to list database tokens"
-        logger.error(msg)
-        raise BaserowException(msg)
-    token_list = [token for token in response.json() if token.get("group") == group_id]
-    tokens = iter(token_list)
-
-    try:
-        token = next(tokens).get("key", "")
-        logger.info("Using existing database read/write token")
-        logger.info("Assumes that all tokens are equal with full permissions")
-    except StopIteration:
-        logger.info("Generating database read/write token")
-        response = requests.post(
-            url=f"{settings.baserow_url}/api/database/tokens/",
-            headers=_admin_auth_headers(auth_token),
-            json=dict(
-                name=settings.baserow_username,
-                group=group_id,
-            ),
-        )
+        return
 
-        if response.status_code == 200:
-            token = response.json().get("key", "")
-        else:
-            msg = f"Error {response.status_code}: unable to generate database token"
-            logger.error(msg)
-            raise BaserowException(msg)
-    return token  # type: ignore
-
-
-@logger_timeit()
-def _get_group_id(settings: Settings, auth_token: str) -> int:
-    logger.info("Getting default group_id.")
-    response = requests.get(
-        f"{settings.baserow_url}/api/groups/",
-        headers=_admin_auth_headers(auth_token),
-    )
-    if response.status_code != 200:
-        msg = f"unexpected response {response.status_code}: {str(response.content)}"
-        logger.error(msg)
-        raise BaserowException(msg)
-
-    data = response.json()
-    group = data[0]
-    group_name = group["name"]
-    group_id = group["id"]
-    logger.info(f"Using group '{group_name} with id {group_id}.")
-    return cast(int, group_id)
-
-
-@logger_timeit()
-def _get_application_id(settings: Settings, auth_token: str) -> int:
-    def _request(auth_token: str) -> Any:
-        return requests.get(
-            f"{settings.baserow_url}/api/applications/",
-            headers=_admin_auth_headers(auth_token),
-        )
-
-    response = _request(auth_token)
-
-    if response.status_code == 401:
-        logger.warning("Authentication error: will attempt to refresh")
-        auth_token = _refresh_user_auth_token(settings)
-        response = _request(auth_token)
-        if response.status_code != 200:
-            logger.error("Failed trying to refresh access token")
-            raise BaserowException(
-                f"unexpected response {response.status_code}: "
-                f"{str(response.content)}"
-            )
-
-    if response.status_code != 200:
-        raise BaserowException(
-            f"unexpected response {response.status_code}: "
-            f""
-            f"{str(response.content)}"
-        )
-
-    return next(
-        (
-            cast(int, row["id"])
-            for row in response.json()
-            if row["name"] == settings.baserow_application_name
-        )
-    )
+    message = f"unexpected response {response.status_code}: {str(response.content)}"
+    if response.status_code in (400, 404):
+        try:
+            error = response.json().get("error")
+        except ValueError:
+            error = None
+        if error in _STALE_FIELD_ERRORS:
+            raise BaserowFieldNotFound(message)
+    raise BaserowException(message)
 
 
-@logger_timeit()
-def _get_table_dict(settings: Settings, auth_token: str, application_id: int) -> dict:
-    """Return a dictionary of table ids, names, and a sub dict of fields and
-    ids"""
-
-    tables_url = (
-        f"{settings.baserow_url}/api/database/tables/database" f"/{application_id}/"
-    )
-    response = _request(tables_url, auth_token)
-
-    if response.status_code == 401:
-        logger.warning("Authentication error: will attempt to refresh")
-        auth_token = _refresh_user_auth_token(settings)
-        response = _request(tables_url, auth_token)
-        if response.status_code != 200:
-            logger.error("Failed trying to refresh access token")
-            raise BaserowException(
-                f"unexpected response {response.status_code}: "
-                f"{str(response.content)}"
-            )
-
-    if response.status_code != 200:
-        raise BaserowException(
-            f"unexpected response {response.status_code}: {str(response.content)}"
-        )
-
-    # table ids
-    table_dict = {}
-    for d in response.json():
-        tid, name = d.get("id"), d.get("name")
-        fields_url = f"{settings.baserow_url}/api/database/fields/table/{tid}/"
-        response = _request(fields_url, auth_token)
+class SchemaRegistry:
+    """
+    Field name to field id maps for each table
 
-        if response.status_code != 200:
-            logger.error(f"Failed to fetch fields for table {name}")
-            raise BaserowException(f"{str(response.content)}")
+    Seeded from the tables dictionary built when baserow is bootstrapped so
+    looking up a field id costs no HTTP round trip. A table is only fetched
+    again once invalidated e.g. when baserow reports that a field we filtered
+    on no longer exists because it was renamed or recreated.
+    """
 
-        fields = {row["name"]: row["id"] for row in response.json()}
+    def __init__(self, tables_dict: dict) -> None:
+        self.tables_dict = tables_dict
+        self._fields: dict[str, dict[str, int]] = {
+            name: dict(table["fields"])
+            for name, table in tables_dict.items()
+            if "fields" in table
+        }
 
-        table_dict[name] = dict(
-            id=tid,
-            name=name,
-            fields=fields,
-        )
+    def table_id(self, table_name: str) -> int | None:
+        return cast(int | None, self.tables_dict.get(table_name, {}).get("id"))
 
-    return table_dict
+    def get(self, table_name: str) -> dict[str, int] | None:
+        return self._fields.get(table_name)
 
+    def set(self, table_name: str, fields: dict[str, int]) -> None:
+        self._fields[table_name] = fields
+        self.tables_dict.setdefault(table_name, {})["fields"] = fields
 
-class BaserowException(Exception):
-    def __init__(self, message: str):
-        super().__init__(message)
-        self.message = message
+    def invalidate(self, table_name: str | None = None) -> None:
+        if table_name is None:
+            self._fields.clear()
+        else:
+            self._fields.pop(table_name, None)
 
-    def __repr__(self) -> str:
-        return self.message
+    def filter_params(self, table_name: str, filters: Filters) -> dict:
+        """Raises KeyError if the table or a field is not (yet) known"""
+        fields = self._fields[table_name] if filters else {}
+        return {
+            f"filter__field_{fields[name]}__{filter_type}": value
+            for name, filter_type, value in filters
+        }
 
 
 class BaserowDB:
@@ -292,44 +122,47 @@ class BaserowDB:
         settings: Settings,
         database_token: str,
         tables_dict: dict,
+        schema: SchemaRegistry | None = None,
     ) -> None:
         self.baserow_url = settings.baserow_url
         self.database_token = database_token
-        self.tables_dict = tables_dict
+        self.schema = schema or SchemaRegistry(tables_dict)
+
+    @property
+    def tables_dict(self) -> dict:
+        return self.schema.tables_dict
 
     @logger_timeit()
     def get_fields(self, table_name: str) -> dict[str, int]:
+        if (fields := self.schema.get(table_name)) is not None:
+            return fields
+
         auth_token = self.database_token
-        table_id = self.tables_dict.get(table_name, {}).get("id")
+        table_id = self.schema.table_id(table_name)
 
         url = f"{self.baserow_url}/api/database/fields/table/{table_id}/"
         response = requests.get(url, headers=_simple_auth_headers(auth_token))
+        _raise_for_status(response)
 
-        if response.status_code != 200:
-            raise BaserowException(
-                f"unexpected response {response.status_code}: "
-                f"{str(response.content)}"
-            )
-
-        return {row["name"]: row["id"] for row in response.json()}
-
-    @logger_timeit()
-    def get_rows(
-        self,
-        table_name: str,
-        params: dict,
-    ) -> list[dict]:
-        """
-        Baserow only returns 200 rows at the most. This function pages
-        through an
-        endpoint until all rows are returned.
-        """
-        # auth_token = self._get_user_auth_token()["access_token"]
+        fields = {row["name"]: row["id"] for row in response.json()}
+        self.schema.set(table_name, fields)
+        return fields
+
+    def _filter_params(self, table_name: str, filters: Filters) -> dict:
+        try:
+            return self.schema.filter_params(table_name, filters)
+        except KeyError:
+            # a table or field we have not seen since bootstrap
+            self.schema.invalidate(table_name)
+            self.get_fields(table_name)
+            return self.schema.filter_params(table_name, filters)
+
+    def _get_rows(self, table_name: str, params: dict) -> list[dict]:
         auth_token = self.database_token
-        table_id = self.tables_dict.get(table_name, {}).get("id")
+        table_id = self.schema.table_id(table_name)
         rows_url = f"{self.baserow_url}/api/database/rows/table/{table_id}/"
 
-        params["page"] = 0
+        params = {**params, "page": 0}
 
         rows = []
         while True:
@@ -337,12 +170,7 @@ class BaserowDB:
             response = requests.get(
                 rows_url, headers=_simple_auth_headers(auth_token), params=params
             )
-
-            if response.status_code != 200:
-                raise BaserowException(
-                    f"unexpected response {response.status_code}: "
-                    f"{str(response.content)}"
-                )
+            _raise_for_status(response)
 
             data = response.json()
             rows.extend(data["results"])
@@ -352,6 +180,36 @@ class BaserowDB:
 
         return rows
 
+    @logger_timeit()
+    def get_rows(
+        self,
+        table_name: str,
+        params: dict,
+        filters: Filters | None = None,
+    ) -> list[dict]:
+        """
+        Baserow only returns 200 rows at the most. This function pages
+        through an
+        endpoint until all rows are returned.
+
+        Filters are given by field name and looked up in the schema registry;
+        if baserow no longer knows a field id we refresh the table's fields
+        and try once more.
+        """
+        filters = filters or []
+        try:
+            return self._get_rows(
+                table_name, {**params, **self._filter_params(table_name, filters)}
+            )
+        except BaserowFieldNotFound:
+            if not filters:
+                raise
+            logger.warning(f"Stale field ids for {table_name}: refreshing")
+            self.schema.invalidate(table_name)
+            return self._get_rows(
+                table_name, {**params, **self._filter_params(table_name, filters)}
+            )
+
     @logger_timeit()
     def post_row(
         self,
@@ -360,7 +218,7 @@ class BaserowDB:
         payload: dict,
     ) -> Any:
         auth_token = self.database_token
-        table_id = self.tables_dict.get(table_name, {}).get("id")
+        table_id = self.schema.table_id(table_name)
         url = f"{self.baserow_url}/api/database/rows/table/{table_id}/"
 
         response = requests.post(
@@ -377,26 +235,429 @@ class BaserowDB:
         return response.json()
 
 
-@lru_cache()
-def get_baserow_db() -> BaserowDB:
-    logger.info("Baserow module initiation")
-    settings = get_settings()
+class AsyncBaserowDB:
+    """
+    Async version of BaserowDB for use from `async def` routes
+
+    A single keep-alive client is shared between requests so that pages are
+    not each paying for a new TCP/TLS connection, and once the first page has
+    told us the row count the remaining pages are requested concurrently
+    (bounded by settings.baserow_concurrency).
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        database_token: str,
+        tables_dict: dict,
+        schema: SchemaRegistry | None = None,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> None:
+        self.baserow_url = settings.baserow_url
+        self.database_token = database_token
+        self.schema = schema or SchemaRegistry(tables_dict)
+        self.concurrency = settings.baserow_concurrency
+        self.timeout = settings.baserow_timeout
+        self._transport = transport
+        self._semaphore: asyncio.Semaphore | None = None
+        self._pool = LoopClient(self._make_client)
+
+    def _make_client(self) -> httpx.AsyncClient:
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return httpx.AsyncClient(
+            base_url=self.baserow_url,
+            headers=_simple_auth_headers(self.database_token),
+            limits=httpx.Limits(
+                max_connections=self.concurrency,
+                max_keepalive_connections=self.concurrency,
+            ),
+            timeout=self.timeout,
+            transport=self._transport,
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The pooled client of the running event loop (see LoopClient)"""
+        return self._pool.client
+
+    @property
+    def tables_dict(self) -> dict:
+        return self.schema.tables_dict
+
+    async def aclose(self) -> None:
+        await self._pool.aclose()
+
+    async def _get_page(self, rows_url: str, params: dict, page: int) -> dict:
+        client = self.client
+        assert self._semaphore is not None
+        async with self._semaphore:
+            response = await client.get(rows_url, params={**params, "page": page})
+
+        _raise_for_status(response)
+        return cast(dict, response.json())
+
+    @logger_timeit()
+    async def get_fields(self, table_name: str) -> dict[str, int]:
+        if (fields := self.schema.get(table_name)) is not None:
+            return fields
+
+        table_id = self.schema.table_id(table_name)
+        response = await self.client.get(f"/api/database/fields/table/{table_id}/")
+        _raise_for_status(response)
+
+        fields = {row["name"]: row["id"] for row in response.json()}
+        self.schema.set(table_name, fields)
+        return fields
+
+    async def _filter_params(self, table_name: str, filters: Filters) -> dict:
+        try:
+            return self.schema.filter_params(table_name, filters)
+        except KeyError:
+            # a table or field we have not seen since bootstrap
+            self.schema.invalidate(table_name)
+            await self.get_fields(table_name)
+            return self.schema.filter_params(table_name, filters)
 
-    logger.info("Generating admin token")
-    admin_token = _get_user_auth_token(settings)["access_token"]
+    @logger_timeit()
+    async def get_rows(
+        self,
+        table_name: str,
+        params: dict,
+        filters: Filters | None = None,
+    ) -> list[dict]:
+        """
+        As BaserowDB.get_rows (including refreshing stale field ids) but
+        fetching pages concurrently
+        """
+        filters = filters or []
+        try:
+            return await self._get_rows(
+                table_name,
+                {**params, **(await self._filter_params(table_name, filters))},
+            )
+        except BaserowFieldNotFound:
+            if not filters:
+                raise
+            logger.warning(f"Stale field ids for {table_name}: refreshing")
+            self.schema.invalidate(table_name)
+            return await self._get_rows(
+                table_name,
+                {**params, **(await self._filter_params(table_name, filters))},
+            )
+
+    @logger_timeit()
+    async def patch_row(self, table_name: str, row_id: int, payload: dict) -> dict:
+        table_id = self.schema.table_id(table_name)
+        response = await self.client.patch(
+            f"/api/database/rows/table/{table_id}/{row_id}/",
+            params={"user_field_names": "true"},
+            json=payload,
+        )
+        _raise_for_status(response)
+        return cast(dict, response.json())
+
+    async def _send_batch(self, method: str, batch_url: str, items: list) -> list:
+        client = self.client
+        assert self._semaphore is not None
+        async with self._semaphore:
+            response = await client.request(
+                method,
+                batch_url,
+                params={"user_field_names": "true"},
+                json={"items": items},
+            )
+
+        _raise_for_status(response)
+        return cast(list, response.json()["items"])
+
+    async def _batches(self, method: str, table_name: str, items: list) -> list[dict]:
+        table_id = self.schema.table_id(table_name)
+        batch_url = f"/api/database/rows/table/{table_id}/batch/"
+        batches = await asyncio.gather(
+            *(
+                self._send_batch(method, batch_url, items[start : start + BATCH_SIZE])
+                for start in range(0, len(items), BATCH_SIZE)
+            )
+        )
+        return [row for batch in batches for row in batch]
+
+    @logger_timeit()
+    async def patch_rows(self, table_name: str, items: list[dict]) -> list[dict]:
+        """
+        Updates many rows (each item has the row id and the fields to change)
+        through the batch endpoint, BATCH_SIZE rows a request
+        """
+        return await self._batches("PATCH", table_name, items)
+
+    @logger_timeit()
+    async def post_rows(self, table_name: str, items: list[dict]) -> list[dict]:
+        """Creates many rows through the batch endpoint"""
+        return await self._batches("POST", table_name, items)
+
+    async def _get_rows(self, table_name: str, params: dict) -> list[dict]:
+        """
+        Baserow only returns 200 rows at the most. The first page tells us
+        how many rows there are in total so the rest are fetched at once.
+        """
+        table_id = self.schema.table_id(table_name)
+        rows_url = f"/api/database/rows/table/{table_id}/"
+        params = {k: v for k, v in params.items() if k != "page"}
+
+        first = await self._get_page(rows_url, params, 1)
+        rows: list[dict] = list(first["results"])
+        if not first["next"]:
+            return rows
+
+        # baserow defaults to 100 rows a page if size is not given
+        size = int(params.get("size", 100))
+        n_pages = math.ceil(first["count"] / size)
+        pages = await asyncio.gather(
+            *(self._get_page(rows_url, params, page) for page in range(2, n_pages + 1))
+        )
+        for page in pages:
+            rows.extend(page["results"])
+
+        return rows
+
+
+class BaserowSession:
+    """
+    Owns the baserow credentials that BaserowDB/AsyncBaserowDB need
+
+    Bootstrapping (admin login, group, database token, application and the
+    field map of every table) is started from the FastAPI lifespan so that
+    no request pays for it, retrying with backoff whilst baserow comes up.
+    The admin access token is then refreshed in the background before it
+    expires.
+    """
+
+    # access tokens valid for 10m, refresh tokens valid for 168h
+    access_token_lifetime = 10 * 60
+    refresh_margin = 2 * 60
+    max_backoff = 30.0
+
+    def __init__(
+        self,
+        settings: Settings,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> None:
+        self.settings = settings
+        self._transport = transport
+        self._task: asyncio.Task | None = None
+        self._bootstrapped: asyncio.Future | None = None
+
+        self.access_token = ""
+        self.refresh_token = ""
+        self.database: BaserowDB | None = None
+        self.async_database: AsyncBaserowDB | None = None
+
+    async def start(self) -> None:
+        """Start bootstrapping in the background (if not already)"""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._bootstrapped = loop.create_future()
+            self._task = asyncio.create_task(self._run())
+
+    async def ready(self) -> None:
+        """Wait for bootstrapping; starts it if the lifespan did not"""
+        await self.start()
+        assert self._bootstrapped is not None
+        await asyncio.shield(self._bootstrapped)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        if self.async_database is not None:
+            await self.async_database.aclose()
+
+    async def _run(self) -> None:
+        assert self._bootstrapped is not None
+        async with httpx.AsyncClient(
+            base_url=self.settings.baserow_url,
+            timeout=self.settings.baserow_timeout,
+            transport=self._transport,
+        ) as client:
+            try:
+                await self._retry(self._bootstrap, client)
+            except Exception as e:
+                # handed to whoever waits in ready() (and already logged by
+                # _retry) rather than raised again in a task nobody awaits;
+                # the next start() tries again
+                self._bootstrapped.set_exception(e)
+                return
+            self._bootstrapped.set_result(None)
+
+            while True:
+                await asyncio.sleep(self.access_token_lifetime - self.refresh_margin)
+                try:
+                    await self._retry(self._refresh_access_token, client)
+                except Exception:
+                    # keep the session (and the database token, which does
+                    # not expire) and try again at the next interval
+                    logger.exception("Failed to refresh the baserow access token")
+
+    async def _retry(
+        self,
+        step: Callable[[httpx.AsyncClient], Awaitable[None]],
+        client: httpx.AsyncClient,
+    ) -> None:
+        attempts = self.settings.baserow_retries
+        for attempt in range(1, attempts + 1):
+            try:
+                return await step(client)
+            except (httpx.HTTPError, BaserowException) as e:
+                if attempt == attempts:
+                    logger.error(f"Baserow {step.__name__} failed: {e!r}")
+                    raise
+                backoff = min(2.0 ** (attempt - 1), self.max_backoff)
+                logger.warning(
+                    f"Baserow {step.__name__} attempt {attempt} failed ({e!r}): "
+                    f"retrying in {backoff:.0f}s"
+                )
+                await asyncio.sleep(backoff)
+
+    async def _request(
+        self, client: httpx.AsyncClient, method: str, url: str, **kwargs: Any
+    ) -> Any:
+        response = await client.request(
+            method, url, headers=_admin_auth_headers(self.access_token), **kwargs
+        )
+        if response.status_code != 200:
+            raise BaserowException(
+                f"unexpected response {response.status_code} from {url}: "
+                f"{str(response.content)}"
+            )
+        return response.json()
+
+    @logger_timeit()
+    async def _login(self, client: httpx.AsyncClient) -> None:
+        logger.info("Authenticating as admin via username/password")
+        data = await self._request(
+            client,
+            "POST",
+            "/api/user/token-auth/",
+            json={
+                "email": self.settings.baserow_email,
+                "password": self.settings.baserow_password.get_secret_value(),
+            },
+        )
+        self.access_token = data["access_token"]
+        self.refresh_token = data["refresh_token"]
+
+    @logger_timeit()
+    async def _refresh_access_token(self, client: httpx.AsyncClient) -> None:
+        logger.info("Refreshing user authentication")
+        try:
+            data = await self._request(
+                client,
+                "POST",
+                "/api/user/token-refresh/",
+                json={"refresh_token": self.refresh_token},
+            )
+        except BaserowException:
+            logger.warning("Unable to refresh access token: logging in again")
+            await self._login(client)
+            return
+        self.access_token = data["access_token"]
+        logger.success("Refreshed access token")
+
+    async def _get_group_id(self, client: httpx.AsyncClient) -> int:
+        logger.info("Getting default group_id.")
+        group = (await self._request(client, "GET", "/api/groups/"))[0]
+        logger.info(f"Using group '{group['name']} with id {group['id']}.")
+        return cast(int, group["id"])
+
+    async def _get_database_token(
+        self, client: httpx.AsyncClient, group_id: int
+    ) -> str:
+        tokens = await self._request(client, "GET", "/api/database/tokens/")
+        for token in tokens:
+            if token.get("group") == group_id:
+                logger.info("Using existing database read/write token")
+                logger.info("Assumes that all tokens are equal with full permissions")
+                return cast(str, token.get("key", ""))
+
+        logger.info("Generating database read/write token")
+        token = await self._request(
+            client,
+            "POST",
+            "/api/database/tokens/",
+            json=dict(name=self.settings.baserow_username, group=group_id),
+        )
+        return cast(str, token.get("key", ""))
+
+    async def _get_application_id(self, client: httpx.AsyncClient) -> int:
+        name = self.settings.baserow_application_name
+        applications = await self._request(client, "GET", "/api/applications/")
+        for row in applications:
+            if row["name"] == name:
+                return cast(int, row["id"])
+        raise BaserowException(f"application {name} not found")
+
+    async def _get_table_dict(
+        self, client: httpx.AsyncClient, application_id: int
+    ) -> dict:
+        """Return a dictionary of table ids, names, and a sub dict of fields and
+        ids"""
+        tables = await self._request(
+            client, "GET", f"/api/database/tables/database/{application_id}/"
+        )
+        fields = await asyncio.gather(
+            *(
+                self._request(client, "GET", f"/api/database/fields/table/{t['id']}/")
+                for t in tables
+            )
+        )
+        return {
+            table["name"]: dict(
+                id=table["id"],
+                name=table["name"],
+                fields={row["name"]: row["id"] for row in table_fields},
+            )
+            for table, table_fields in zip(tables, fields)
+        }
+
+    @logger_timeit(level="INFO")
+    async def _bootstrap(self, client: httpx.AsyncClient) -> None:
+        logger.info("Baserow module initiation")
+        await self._login(client)
+        group_id, application_id = await asyncio.gather(
+            self._get_group_id(client), self._get_application_id(client)
+        )
+        database_token, tables_dict = await asyncio.gather(
+            self._get_database_token(client, group_id),
+            self._get_table_dict(client, application_id),
+        )
+
+        # shared so that invalidating a table's fields applies to both
+        schema = SchemaRegistry(tables_dict)
+        self.database = BaserowDB(
+            settings=self.settings,
+            database_token=database_token,
+            tables_dict=tables_dict,
+            schema=schema,
+        )
+        self.async_database = AsyncBaserowDB(
+            settings=self.settings,
+            database_token=database_token,
+            tables_dict=tables_dict,
+            schema=schema,
+            transport=self._transport,
+        )
+
+
+@lru_cache()
+def get_baserow_session() -> BaserowSession:
+    return BaserowSession(get_settings())
 
-    logger.info("Getting database token")
-    group_id = _get_group_id(settings, admin_token)
-    database_token = _get_database_token(settings, admin_token, group_id)
 
-    logger.info("Getting application ID")
-    application_id = _get_application_id(settings, admin_token)
+async def get_baserow_db() -> BaserowDB:
+    session = get_baserow_session()
+    await session.ready()
+    return session.database  # type: ignore
 
-    logger.info("Getting tables dictionary")
-    tables_dict = _get_table_dict(settings, admin_token, application_id)
 
-    return BaserowDB(
-        settings=settings,
-        database_token=database_token,
-        tables_dict=tables_dict,
-    )
+async def get_async_baserow_db() -> AsyncBaserowDB:
+    session = get_baserow_session()
+    await session.ready()
+    return session.async_database  # type: ignore
@@ -0,0 +1,114 @@
+"""
+Immutable, indexed collections of baserow rows
+
+Rows are parsed once when the catalogue is built and every filter is then
+answered from dictionary lookups rather than scanning the rows. The same
+catalogues back both the mock routes (built once from the default json
+files) and the live routes (built on each snapshot refresh).
+"""
+import json
+from collections import defaultdict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, ClassVar, Collection, Iterable, Mapping
+
+from pydantic import BaseModel
+
+from api.wards import CAMPUSES, MISSING_DEPARTMENT_LOCATIONS
+from models.beds import Bed, Department, Room
+
+
+class Catalogue:
+    model: ClassVar[type[BaseModel]]
+    index_fields: ClassVar[tuple[str, ...]]
+
+    def __init__(self, rows: Iterable[dict]) -> None:
+        self.rows: tuple[dict, ...] = tuple(rows)
+        self.models: tuple[BaseModel, ...] = tuple(
+            self.model.parse_obj(row) for row in self.rows
+        )
+
+        indexes: dict[str, dict[Any, list[int]]] = {
+            field: defaultdict(list) for field in self.index_fields
+        }
+        for i, row in enumerate(self.rows):
+            for field in self.index_fields:
+                indexes[field][row.get(field)].append(i)
+
+        self.indexes: Mapping[str, Mapping[Any, tuple[int, ...]]] = {
+            field: {value: tuple(positions) for value, positions in index.items()}
+            for field, index in indexes.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _positions(self, filters: dict[str, Collection]) -> Iterable[int]:
+        """
+        Positions (in the original order) of rows matching any of the values
+        of any of the fields; no values at all matches every row
+        """
+        if not any(filters.values()):
+            return range(len(self.rows))
+
+        matches = [
+            self.indexes[field].get(value, ())
+            for field, values in filters.items()
+            for value in values
+        ]
+        if len(matches) == 1:
+            return matches[0]
+        return sorted(set().union(*matches))
+
+    def select(self, **filters: Collection) -> list[BaseModel]:
+        return [self.models[i] for i in self._positions(filters)]
+
+    def select_rows(self, **filters: Collection) -> list[dict]:
+        return [self.rows[i] for i in self._positions(filters)]
+
+    @classmethod
+    def from_json(cls, path: Path) -> "Catalogue":
+        with open(path, "r") as f:
+            return cls(json.load(f))
+
+
+class DepartmentCatalogue(Catalogue):
+    model = Department
+    index_fields = ("department",)
+
+
+class RoomCatalogue(Catalogue):
+    model = Room
+    index_fields = ("department", "hl7_room")
+
+
+class BedCatalogue(Catalogue):
+    """
+    Beds may also be selected by campus (see wards.CAMPUSES) which includes
+    the locations known to be missing their department
+    """
+
+    model = Bed
+    index_fields = ("department", "location_string", "hl7_room", "closed")
+
+    def __init__(self, rows: Iterable[dict]) -> None:
+        super().__init__(rows)
+
+        by_department = self.indexes["department"]
+        by_location = self.indexes["location_string"]
+        campuses: dict[str, tuple[int, ...]] = {}
+        for campus, departments in CAMPUSES.items():
+            positions: set[int] = set()
+            for department in departments:
+                positions.update(by_department.get(department, ()))
+                for location in MISSING_DEPARTMENT_LOCATIONS.get(department, ()):
+                    positions.update(by_location.get(location, ()))
+            campuses[campus] = tuple(sorted(positions))
+
+        self.indexes = {**self.indexes, "campus": campuses}
+
+
+@lru_cache()
+def get_mock_catalogue(catalogue_type: type[Catalogue], filename: str) -> Catalogue:
+    """Catalogue of one of the *_defaults.json files, loaded only once"""
+    return catalogue_type.from_json(Path(__file__).parent / filename)
@@ -0,0 +1,263 @@
+"""
+Write-behind queue for discharge statuses
+
+Posting a status used to wait on baserow inside the user's click. Statuses
+are now written to a small sqlite database (so they survive a restart) and
+acknowledged straight away; a background task sends whatever is pending to
+baserow in batches every flush_interval seconds. Only the latest status of
+each CSN is kept so a user changing their mind a few times before the next
+flush costs one row in baserow. Until it is flushed a pending status is
+merged into what get_discharge_status returns.
+
+DischargeIndex keeps the latest status of each CSN, loaded from baserow
+(plus the queue) and updated as statuses are posted, so that clients are
+sent one row per patient and, given the cursor of their last poll, only
+what has changed since.
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from api.baserow import (
+    BATCH_SIZE,
+    AsyncBaserowDB,
+    BaserowDB,
+    get_async_baserow_db,
+)
+from api.config import get_settings
+from api.logger import logger
+from models.beds import DischargeStatus
+
+TABLE = "discharge_statuses"
+
+# noinspection SqlResolve
+_SCHEMA = """CREATE TABLE IF NOT EXISTS pending (
+    csn INTEGER PRIMARY KEY,
+    status TEXT NOT NULL,
+    modified_at TEXT NOT NULL
+)"""
+
+
+class DischargeQueue:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # a connection per call as routes run in a thread pool
+        return sqlite3.connect(self.path, timeout=10)
+
+    def put(self, csn: int, status: str) -> DischargeStatus:
+        """Queue a status, replacing any still pending for the CSN"""
+        discharge_status = DischargeStatus(
+            csn=csn, status=status, modified_at=datetime.now(timezone.utc)
+        )
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO pending VALUES (?, ?, ?)",
+                (csn, status, discharge_status.modified_at.isoformat()),
+            )
+        return discharge_status
+
+    def pending(self) -> list[DischargeStatus]:
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT csn, status, modified_at FROM pending ORDER BY modified_at"
+            ).fetchall()
+        return [
+            DischargeStatus(csn=csn, status=status, modified_at=modified_at)
+            for csn, status, modified_at in rows
+        ]
+
+    def _remove(self, flushed: list[DischargeStatus]) -> None:
+        # a status queued for the CSN whilst flushing is kept for next time
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "DELETE FROM pending WHERE csn = ? AND modified_at = ?",
+                [(s.csn, s.modified_at.isoformat()) for s in flushed],
+            )
+
+    async def flush(self, baserow: AsyncBaserowDB) -> int:
+        """
+        Send the pending statuses to baserow, returning how many were sent;
+        each batch leaves the queue as soon as baserow has it so a batch
+        failing does not have those before it posted again
+        """
+        pending = await asyncio.to_thread(self.pending)
+        for start in range(0, len(pending), BATCH_SIZE):
+            batch = pending[start : start + BATCH_SIZE]
+            await baserow.post_rows(
+                TABLE,
+                [
+                    {
+                        "csn": s.csn,
+                        "status": s.status,
+                        "modified_at": s.modified_at.isoformat(),
+                    }
+                    for s in batch
+                ],
+            )
+            await asyncio.to_thread(self._remove, batch)
+        if pending:
+            logger.info(f"Flushed {len(pending)} discharge statuses to baserow")
+        return len(pending)
+
+
+def _utc(modified_at: datetime) -> datetime:
+    # baserow and the queue store UTC but not always with the offset
+    if modified_at.tzinfo is None:
+        return modified_at.replace(tzinfo=timezone.utc)
+    return modified_at
+
+
+class DischargeIndex:
+    def __init__(self, queue: DischargeQueue, ttl: float, horizon_hours: int) -> None:
+        self.queue = queue
+        # seconds before the index is rebuilt from baserow (in case a status
+        # was changed there directly)
+        self.ttl = ttl
+        self.horizon_hours = horizon_hours
+        self._latest: dict[int, DischargeStatus] = {}
+        self._loaded_at: float | None = None
+        self._lock = threading.Lock()
+
+    def _read(self, baserow: BaserowDB, hours: float) -> dict[int, DischargeStatus]:
+        """The latest status of each CSN changed in the last hours"""
+        horizon = datetime.utcnow() - timedelta(hours=hours)
+        params = {
+            "size": 200,  # The maximum size of a page.
+            "user_field_names": "true",
+        }
+        rows = baserow.get_rows(
+            TABLE,
+            params,
+            filters=[("modified_at", "date_after", horizon.isoformat())],
+        )
+        statuses = [DischargeStatus.parse_obj(row) for row in rows]
+
+        latest: dict[int, DischargeStatus] = {}
+        for discharge_status in statuses + self.queue.pending():
+            _keep_latest(latest, discharge_status)
+        return latest
+
+    def _load(self, baserow: BaserowDB) -> None:
+        self._latest = self._read(baserow, self.horizon_hours)
+        self._loaded_at = time.monotonic()
+
+    def update(self, discharge_status: DischargeStatus) -> None:
+        with self._lock:
+            _keep_latest(self._latest, discharge_status)
+
+    def latest(
+        self,
+        baserow: BaserowDB,
+        since: datetime | None = None,
+        delta_hours: int | None = None,
+    ) -> list[DischargeStatus]:
+        """
+        The latest status of each CSN changed after since (or in the last
+        delta_hours) ordered by when they were changed; asking further back
+        than the index holds reads baserow for just this call
+        """
+        if delta_hours is not None and delta_hours > self.horizon_hours:
+            statuses = list(self._read(baserow, delta_hours).values())
+        else:
+            with self._lock:
+                if (
+                    self._loaded_at is None
+                    or time.monotonic() - self._loaded_at > self.ttl
+                ):
+                    self._load(baserow)
+                statuses = list(self._latest.values())
+
+        cutoffs = [_utc(since)] if since is not None else []
+        if delta_hours is not None:
+            cutoffs.append(datetime.now(timezone.utc) - timedelta(hours=delta_hours))
+        cutoff = max(cutoffs, default=None)
+        return sorted(
+            (s for s in statuses if cutoff is None or s.modified_at > cutoff),
+            key=lambda s: s.modified_at,
+        )
+
+
+def _keep_latest(
+    latest: dict[int, DischargeStatus], discharge_status: DischargeStatus
+) -> None:
+    discharge_status.modified_at = _utc(discharge_status.modified_at)
+    current = latest.get(discharge_status.csn)
+    if current is None or discharge_status.modified_at >= current.modified_at:
+        latest[discharge_status.csn] = discharge_status
+
+
+class DischargeFlusher:
+    """Flushes a discharge queue every interval seconds from the event loop"""
+
+    def __init__(
+        self,
+        queue: DischargeQueue,
+        baserow: Callable[[], Awaitable[AsyncBaserowDB]],
+        interval: float,
+    ) -> None:
+        self.queue = queue
+        self.baserow = baserow
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        # one last go; anything left is sent after the next start
+        try:
+            await asyncio.wait_for(self._flush(), timeout=self.interval)
+        except asyncio.TimeoutError:
+            logger.warning("Gave up flushing discharge statuses on shutdown")
+
+    async def _flush(self) -> None:
+        try:
+            await self.queue.flush(await self.baserow())
+        except Exception:
+            # left in the queue to be tried again
+            logger.exception("Failed to flush discharge statuses")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._flush()
+
+
+@lru_cache()
+def get_discharge_queue() -> DischargeQueue:
+    return DischargeQueue(get_settings().discharge_queue_path)
+
+
+@lru_cache()
+def get_discharge_flusher() -> DischargeFlusher:
+    return DischargeFlusher(
+        get_discharge_queue(),
+        get_async_baserow_db,
+        interval=get_settings().discharge_flush_interval,
+    )
+
+
+@lru_cache()
+def get_discharge_index() -> DischargeIndex:
+    settings = get_settings()
+    return DischargeIndex(
+        get_discharge_queue(),
+        ttl=settings.baserow_cache_ttl,
+        horizon_hours=settings.discharge_status_horizon_hours,
+    )
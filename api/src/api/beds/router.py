@@ -1,16 +1,30 @@
-import json
 from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends, Query
-from pathlib import Path
+from fastapi import APIRouter, Depends, Query, Request, Response
 
 from api.logger import logger, logger_timeit
-from api.baserow import BaserowDB, get_baserow_db
-from api.config import Settings, get_settings
-from api.wards import (
-    CAMPUSES,
-    MISSING_DEPARTMENT_LOCATIONS,
+from api.baserow import (
+    AsyncBaserowDB,
+    BaserowDB,
+    get_async_baserow_db,
+    get_baserow_db,
+)
+from api.beds.discharges import (
+    DischargeIndex,
+    DischargeQueue,
+    get_discharge_index,
+    get_discharge_queue,
+)
+from api.beds.catalogue import (
+    BedCatalogue,
+    DepartmentCatalogue,
+    RoomCatalogue,
+    get_mock_catalogue,
 )
-from models.beds import Bed, Department, DischargeStatus, Room
+from api.beds.snapshot import Snapshot, TableSnapshots, get_table_snapshots
+from api.config import Settings, get_settings
+from api.streaming import ResponseFormat, stream_rows
+from api.wards import CAMPUSES
+from models.beds import Bed, BedUpdate, Department, DischargeStatus, Room
 
 router = APIRouter(
     prefix="/baserow",
@@ -21,185 +35,150 @@ mock_router = APIRouter(
 )
 
 
+def _known_campuses(campuses: list[str]) -> list[str]:
+    # NB: unknown campuses are ignored, and asking for no known campus at
+    # all returns every bed
+    return [campus for campus in campuses if campus in CAMPUSES]
+
+
+def _not_modified(
+    snapshot: Snapshot, request: Request, response: Response
+) -> Response | None:
+    """
+    Tags the response with the ETag of the snapshot it is made from, or
+    returns the 304 to send instead if the client already holds that version
+    """
+    etag = f'"{snapshot.etag}"'
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match == "*" or etag in (t.strip() for t in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return None
+
+
 @mock_router.get("/departments", response_model=list[Department])
 def get_mock_departments() -> list[Department]:
-    with open(Path(__file__).parent / "department_defaults.json", "r") as f:
-        rows = json.load(f)
-    return [Department.parse_obj(row) for row in rows]
+    catalogue = get_mock_catalogue(DepartmentCatalogue, "department_defaults.json")
+    return list(catalogue.models)  # type: ignore
 
 
 @router.get("/departments", response_model=list[Department])
 @logger_timeit()
-def get_departments(baserow: BaserowDB = Depends(get_baserow_db)) -> list[Department]:
-    params = {
-        "size": 200,  # The maximum size of a page.
-        "user_field_names": "true",
-    }
-
-    rows = baserow.get_rows("departments", params)
-
-    # drop baserow id and order fields
-    for row in rows:
-        # row.pop("id")
-        row.pop("order")
-
-    return [Department.parse_obj(row) for row in rows]
+async def get_departments(
+    request: Request,
+    response: Response,
+    baserow: AsyncBaserowDB = Depends(get_async_baserow_db),
+    snapshots: TableSnapshots = Depends(get_table_snapshots),
+) -> list[Department] | Response:
+    snapshot = await snapshots.get("departments", baserow)
+    if not_modified := _not_modified(snapshot, request, response):
+        return not_modified
+    return list(snapshot.catalogue.models)  # type: ignore
 
 
 @mock_router.get("/rooms", response_model=list[Room])
 def get_mock_rooms() -> list[Room]:
-    with open(Path(__file__).parent / "room_defaults.json", "r") as f:
-        rows = json.load(f)
-    return [Room.parse_obj(row) for row in rows]
+    catalogue = get_mock_catalogue(RoomCatalogue, "room_defaults.json")
+    return list(catalogue.models)  # type: ignore
 
 
 @router.get("/rooms", response_model=list[Room])
 @logger_timeit()
-def get_rooms(baserow: BaserowDB = Depends(get_baserow_db)) -> list[Room]:
-    params = {
-        "size": 200,  # The maximum size of a page.
-        "user_field_names": "true",
-    }
-
-    rows = baserow.get_rows("rooms", params)
-
-    # drop baserow id and order fields
-    for row in rows:
-        # row.pop("id")
-        row.pop("order")
-
-    return [Room.parse_obj(row) for row in rows]
+async def get_rooms(
+    request: Request,
+    response: Response,
+    baserow: AsyncBaserowDB = Depends(get_async_baserow_db),
+    snapshots: TableSnapshots = Depends(get_table_snapshots),
+) -> list[Room] | Response:
+    snapshot = await snapshots.get("rooms", baserow)
+    if not_modified := _not_modified(snapshot, request, response):
+        return not_modified
+    return list(snapshot.catalogue.models)  # type: ignore
 
 
 @mock_router.get("/beds", response_model=list[Bed])
 def get_mock_beds(
     departments: list[str] = Query(default=[]),
     locations: list[str] = Query(default=[]),
-) -> list[Bed]:
-    with open(Path(__file__).parent / "bed_defaults.json", "r") as f:
-        rows = json.load(f)
-
-    if len(departments):
-        rows = [row for row in rows if row.get("department") in departments]
-    if len(locations):
-        rows = [row for row in rows if row.get("location_string") in locations]
-
-    return [Bed.parse_obj(row) for row in rows]
+    format: ResponseFormat = ResponseFormat.json,
+) -> list[Bed] | Response:
+    catalogue = get_mock_catalogue(BedCatalogue, "bed_defaults.json")
+    beds = catalogue.select(department=departments, location_string=locations)
+    if format != ResponseFormat.json:
+        return stream_rows(beds, Bed, format)
+    return beds  # type: ignore
 
 
 @router.get("/beds", response_model=list[Bed])
 @logger_timeit()
-def get_beds(
+async def get_beds(
+    request: Request,
+    response: Response,
     departments: list[str] = Query(default=[]),
     locations: list[str] = Query(default=[]),
-    baserow: BaserowDB = Depends(get_baserow_db),
-) -> list[Bed]:
-    field_ids = baserow.tables_dict.get("beds").get("fields")  # type: ignore
-    params = {
-        "size": 200,  # The maximum size of a page.
-        "user_field_names": "true",
-    }
-
-    if len(departments) or len(locations):
-        rows = []
-        for department in departments:
-            department_field_id = field_ids["department"]
-            params[f"filter__field_{department_field_id}__equal"] = department
-            rows.extend(baserow.get_rows("beds", params))
-            params.pop(f"filter__field_{department_field_id}__equal")
-
-        for location in locations:
-            location_string_field_id = field_ids["location_string"]
-            params[f"filter__field_{location_string_field_id}__equal"] = location
-            rows.extend(baserow.get_rows("beds", params))
-            params.pop(f"filter__field_{location_string_field_id}__equal")
-
-    else:
-        # get everything
-        rows = baserow.get_rows("beds", params)
-
-    # drop baserow id and order fields
-    for row in rows:
-        # preserve bed id to use in patching
-        # row.pop("id")
-        row.pop("order")
-
-    logger.info(f"Returning {len(rows)} beds")
-    return [Bed.parse_obj(row) for row in rows]
+    baserow: AsyncBaserowDB = Depends(get_async_baserow_db),
+    snapshots: TableSnapshots = Depends(get_table_snapshots),
+    format: ResponseFormat = ResponseFormat.json,
+) -> list[Bed] | Response:
+    snapshot = await snapshots.get("beds", baserow)
+    if not_modified := _not_modified(snapshot, request, response):
+        return not_modified
+    beds = snapshot.catalogue.select(department=departments, location_string=locations)
+    logger.info(f"Returning {len(beds)} beds")
+    if format != ResponseFormat.json:
+        streamed = stream_rows(beds, Bed, format)
+        streamed.headers["ETag"] = response.headers["ETag"]
+        return streamed
+    return beds  # type: ignore
+
+
+@mock_router.patch("/beds/batch")
+def patch_mock_beds(updates: list[BedUpdate]) -> list[dict]:
+    return [update.dict() for update in updates]
+
+
+@router.patch("/beds/batch")
+@logger_timeit()
+async def patch_beds(
+    updates: list[BedUpdate],
+    baserow: AsyncBaserowDB = Depends(get_async_baserow_db),
+    snapshots: TableSnapshots = Depends(get_table_snapshots),
+) -> list[dict]:
+    """
+    Updates many beds (e.g. closing a whole bay) in as few requests to
+    baserow as possible, returning the updated rows
+    """
+    try:
+        rows: list[dict] = await baserow.patch_rows(
+            "beds", [update.dict() for update in updates]
+        )
+        return rows
+    finally:
+        # some batches may have been written even if another failed
+        snapshots.invalidate("beds")
 
 
 @mock_router.get("/campus", response_model=list[Bed])
 def get_mock_campus(
     campuses: list[str] = Query(default=[]),
 ) -> list[Bed]:
-    departments: list = []
-    for campus in campuses:
-        departments.extend(CAMPUSES.get(campus, []))
-
-    locations: list = []
-    for department in departments:
-        if missing_locations := MISSING_DEPARTMENT_LOCATIONS.get(department):
-            locations.extend(missing_locations)
-
-    with open(Path(__file__).parent / "bed_defaults.json", "r") as f:
-        rows = json.load(f)
-
-    all_rows = []
-    if len(departments):
-        drows = [row for row in rows if row.get("department") in departments]
-        all_rows.extend(drows)
-    if len(locations):
-        lrows = [row for row in rows if row.get("location_string") in locations]
-        all_rows.extend(lrows)
-
-    return [Bed.parse_obj(row) for row in all_rows]
+    catalogue = get_mock_catalogue(BedCatalogue, "bed_defaults.json")
+    return catalogue.select(campus=_known_campuses(campuses))  # type: ignore
 
 
 @router.get("/campus", response_model=list[Bed])
 @logger_timeit()
-def get_campus(
+async def get_campus(
+    request: Request,
+    response: Response,
     campuses: list[str] = Query(default=[]),
-    baserow: BaserowDB = Depends(get_baserow_db),
-) -> list[Bed]:
-    departments: list = []
-    for campus in campuses:
-        departments.extend(CAMPUSES.get(campus, []))
-
-    locations: list = []
-    for department in departments:
-        if missing_locations := MISSING_DEPARTMENT_LOCATIONS.get(department):
-            locations.extend(missing_locations)
-
-    field_ids = baserow.tables_dict.get("beds").get("fields")  # type: ignore
-    params = {
-        "size": 200,  # The maximum size of a page.
-        "user_field_names": "true",
-    }
-
-    if len(departments) or len(locations):
-        rows = []
-        for department in departments:
-            department_field_id = field_ids["department"]
-            params[f"filter__field_{department_field_id}__equal"] = department
-            rows.extend(baserow.get_rows("beds", params))
-            params.pop(f"filter__field_{department_field_id}__equal")
-
-        for location in locations:
-            location_string_field_id = field_ids["location_string"]
-            params[f"filter__field_{location_string_field_id}__equal"] = location
-            rows.extend(baserow.get_rows("beds", params))
-            params.pop(f"filter__field_{location_string_field_id}__equal")
-
-    else:
-        # get everything
-        rows = baserow.get_rows("beds", params)
-
-    # drop baserow id and order fields
-    for row in rows:
-        # row.pop("id")
-        row.pop("order")
-
-    return [Bed.parse_obj(row) for row in rows]
+    baserow: AsyncBaserowDB = Depends(get_async_baserow_db),
+    snapshots: TableSnapshots = Depends(get_table_snapshots),
+) -> list[Bed] | Response:
+    snapshot = await snapshots.get("beds", baserow)
+    if not_modified := _not_modified(snapshot, request, response):
+        return not_modified
+    return snapshot.catalogue.select(campus=_known_campuses(campuses))  # type: ignore
 
 
 @mock_router.get("/closed/", response_model=list[Bed])
@@ -212,19 +191,24 @@ def get_mock_closed_beds() -> list[Bed]:
 
 @router.get("/closed/", response_model=list[Bed])
 @logger_timeit()
-def get_closed_beds(baserow: BaserowDB = Depends(get_baserow_db)) -> list[Bed]:
-    field_ids = baserow.tables_dict.get("beds").get("fields")  # type: ignore
-
-    closed_field_id = field_ids["closed"]
-
-    params = {
-        "size": 200,  # The maximum size of a page.
-        "user_field_names": "true",
-        f"filter__field_{closed_field_id}__boolean": True,
-    }
-
-    rows = baserow.get_rows("beds", params)
-    return [Bed.parse_obj(row) for row in rows]
+async def get_closed_beds(
+    request: Request,
+    response: Response,
+    baserow: AsyncBaserowDB = Depends(get_async_baserow_db),
+    snapshots: TableSnapshots = Depends(get_table_snapshots),
+) -> list[Bed] | Response:
+    snapshot = await snapshots.get("beds", baserow)
+    if not_modified := _not_modified(snapshot, request, response):
+        return not_modified
+    return snapshot.catalogue.select(closed=[True])  # type: ignore
+
+
+@router.get("/cache/")
+def get_cache_stats(
+    snapshots: TableSnapshots = Depends(get_table_snapshots),
+) -> dict[str, dict]:
+    """Hit/miss counts and refresh timings of the reference table snapshots"""
+    return snapshots.stats()
 
 
 @mock_router.post("/discharge_status/", response_model=DischargeStatus)
@@ -246,30 +230,42 @@ def post_mock_discharge_status(
 @router.post("/discharge_status/", response_model=DischargeStatus)
 @logger_timeit()
 def post_discharge_status(
-    csn: int, status: str, baserow: BaserowDB = Depends(get_baserow_db)
+    csn: int,
+    status: str,
+    queue: DischargeQueue = Depends(get_discharge_queue),
+    index: DischargeIndex = Depends(get_discharge_index),
 ) -> DischargeStatus:
-    params = {"user_field_names": True}
+    """Queues the status to be sent to baserow (see api.beds.discharges)"""
+    discharge_status = queue.put(csn, status)
+    index.update(discharge_status)
+    return discharge_status
 
-    payload = {
-        "csn": csn,
-        "status": status,
-        "modified_at": datetime.utcnow().isoformat(),
-    }
 
-    result = baserow.post_row(
-        "discharge_statuses",
-        params=params,
-        payload=payload,
-    )
+@mock_router.get("/discharge_status/latest/", response_model=list[DischargeStatus])
+def get_mock_latest_discharge_status(
+    delta_hours: int = 72, since: datetime | None = None
+) -> list[DischargeStatus]:
+    return get_mock_discharge_status(delta_hours)
 
-    output = DischargeStatus.parse_obj(result)  # type: DischargeStatus
-    return output
+
+@router.get("/discharge_status/latest/", response_model=list[DischargeStatus])
+@logger_timeit()
+def get_latest_discharge_status(
+    delta_hours: int = 72,
+    since: datetime | None = None,
+    baserow: BaserowDB = Depends(get_baserow_db),
+    index: DischargeIndex = Depends(get_discharge_index),
+) -> list[DischargeStatus]:
+    """
+    The latest status of each CSN changed in the last delta_hours; pass the
+    modified_at of the last status received as since to get only changes
+    """
+    return index.latest(baserow, since=since, delta_hours=delta_hours)
 
 
 @mock_router.get("/discharge_status/", response_model=list[DischargeStatus])
 def get_mock_discharge_status(
     delta_hours: int = 72,
-    baserow: BaserowDB = Depends(get_baserow_db),
 ) -> list[DischargeStatus]:
     rows = [
         DischargeStatus(
@@ -293,19 +289,22 @@ def get_mock_discharge_status(
 @router.get("/discharge_status/", response_model=list[DischargeStatus])
 @logger_timeit()
 def get_discharge_status(
-    delta_hours: int = 72, baserow: BaserowDB = Depends(get_baserow_db)
+    delta_hours: int = 72,
+    baserow: BaserowDB = Depends(get_baserow_db),
+    queue: DischargeQueue = Depends(get_discharge_queue),
 ) -> list[DischargeStatus]:
-    _table_dict = baserow.tables_dict.get("discharge_statuses")
-
-    modified_at_field_id = _table_dict.get("fields").get("modified_at")  # type: ignore
     horizon = (datetime.utcnow() - timedelta(hours=float(delta_hours))).isoformat()
 
     params = {
         "size": 200,
         # The maximum size of a page.
         "user_field_names": "true",
-        f"filter__field_{modified_at_field_id}__date_after": horizon,
     }
 
-    rows = baserow.get_rows(_table_dict.get("name"), params)  # type: ignore
-    return [DischargeStatus.parse_obj(row) for row in rows]
+    rows = baserow.get_rows(
+        "discharge_statuses",
+        params,
+        filters=[("modified_at", "date_after", horizon)],
+    )
+    # statuses not yet sent to baserow come last (as the latest for their CSN)
+    return [DischargeStatus.parse_obj(row) for row in rows] + queue.pending()
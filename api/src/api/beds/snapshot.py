@@ -0,0 +1,120 @@
+"""
+In-process snapshots of the baserow reference tables (departments, rooms
+and beds)
+
+These change a few times a day but are read on nearly every page load so
+we hold a catalogue (a parsed copy with indexes on the fields we filter by;
+see api.beds.catalogue) of each table in an api.revalidate.StaleCache: a
+snapshot older than the TTL is still served while a new one is loaded in
+the background; write paths call invalidate() so that the next read waits
+for fresh data instead.
+
+Each snapshot carries a digest of its rows, used by the routes as an ETag
+so that a client asking again for a table that has not changed is sent a
+304 rather than the rows.
+"""
+import hashlib
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+
+import orjson
+
+from api.baserow import AsyncBaserowDB
+from api.beds.catalogue import (
+    BedCatalogue,
+    Catalogue,
+    DepartmentCatalogue,
+    RoomCatalogue,
+)
+from api.config import get_settings
+from api.logger import logger
+from api.revalidate import CacheStats, StaleCache
+
+TABLES: dict[str, type[Catalogue]] = {
+    "departments": DepartmentCatalogue,
+    "rooms": RoomCatalogue,
+    "beds": BedCatalogue,
+}
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    table: str
+    version: int
+    loaded_at: float
+    # digest of the rows; the same in every process serving the same rows
+    etag: str
+    catalogue: Catalogue
+
+
+@dataclass
+class SnapshotStats:
+    refreshes: int = 0
+    last_refresh_ms: float | None = None
+    total_refresh_ms: float = 0.0
+
+
+class TableSnapshots:
+    def __init__(
+        self,
+        ttl: float,
+        tables: dict[str, type[Catalogue]] = TABLES,
+    ) -> None:
+        self.tables = tables
+        self._cache: StaleCache[str, Snapshot] = StaleCache("snapshot", ttl)
+        self._versions: dict[str, int] = defaultdict(int)
+        self._stats: dict[str, SnapshotStats] = {t: SnapshotStats() for t in tables}
+
+    async def get(self, table: str, baserow: AsyncBaserowDB) -> Snapshot:
+        return await self._cache.get(table, lambda: self._load(table, baserow))
+
+    def invalidate(self, table: str) -> None:
+        """Drop a table so the next read waits for a fresh copy"""
+        self._cache.invalidate(table)
+
+    def stats(self) -> dict[str, dict]:
+        cached = self._cache.stats()
+        return {
+            table: {
+                **cached.get(table, asdict(CacheStats())),
+                **asdict(stats),
+                "version": self._versions[table],
+                "rows": len(s.catalogue) if (s := self._cache.peek(table)) else None,
+            }
+            for table, stats in self._stats.items()
+        }
+
+    async def _load(self, table: str, baserow: AsyncBaserowDB) -> Snapshot:
+        stats = self._stats[table]
+        start = time.perf_counter()
+
+        params = {
+            "size": 200,  # The maximum size of a page.
+            "user_field_names": "true",
+        }
+        rows = await baserow.get_rows(table, params)
+
+        self._versions[table] += 1
+        snapshot = Snapshot(
+            table=table,
+            version=self._versions[table],
+            loaded_at=time.monotonic(),
+            etag=hashlib.blake2b(orjson.dumps(rows), digest_size=16).hexdigest(),
+            catalogue=self.tables[table](rows),
+        )
+
+        elapsed_ms = 1000 * (time.perf_counter() - start)
+        stats.refreshes += 1
+        stats.last_refresh_ms = elapsed_ms
+        stats.total_refresh_ms += elapsed_ms
+        logger.info(
+            f"Refreshed {table} snapshot ({len(rows)} rows) in {elapsed_ms:.1f}ms"
+        )
+        return snapshot
+
+
+@lru_cache()
+def get_table_snapshots() -> TableSnapshots:
+    return TableSnapshots(ttl=get_settings().baserow_cache_ttl)
@@ -0,0 +1,39 @@
+-- 2026-10-18
+-- locations whose census row may have changed since a high water mark
+
+-- pass in
+-- since : timestamp; the stored_from of the last change already seen
+
+-- a bed's row changes when a visit to it is admitted/discharged/corrected
+-- (the visit leaving bed A for bed B closes the row for A and opens one for
+-- B) or when the patient currently in it gets a new planned move
+
+WITH
+
+changed AS (
+	SELECT
+		 lv.location_id
+		,lv.stored_from
+	FROM star.location_visit lv
+	WHERE lv.stored_from > :since
+
+	UNION ALL
+
+	SELECT
+		 lv.location_id
+		,pm.stored_from
+	FROM star.planned_movement pm
+	INNER JOIN star.location_visit lv
+		ON lv.hospital_visit_id = pm.hospital_visit_id
+		AND lv.discharge_datetime IS NULL
+	WHERE pm.stored_from > :since
+)
+
+SELECT
+	 lo.location_string
+	,MAX(changed.stored_from) stored_from
+FROM changed
+INNER JOIN star.location lo ON lo.location_id = changed.location_id
+GROUP BY lo.location_string
+
+;
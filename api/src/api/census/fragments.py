@@ -0,0 +1,120 @@
+"""
+Census rows cached a department at a time
+
+/census/, /census/campus/ and /census/departments/ ask for heavily
+overlapping sets of departments (the ICUs are part of a campus and every
+campus is part of wards.ALL). Rather than caching each request the rows
+returned by live.sql are split by department (and by hand added location)
+so that any request can be put together from the fragments already held,
+with only the departments missing or older than the ttl fetched again.
+
+Rows are kept as they come back from the database so that they can be
+turned into either CensusRow models or a DataFrame.
+"""
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Sequence
+
+from api.wards import MISSING_LOCATION_DEPARTMENTS
+
+
+@dataclass
+class FragmentStats:
+    # departments and locations answered from the cache
+    hits: int = 0
+    # departments and locations that had to be fetched
+    misses: int = 0
+
+
+def _row_department(row: Any) -> str | None:
+    return row.department or MISSING_LOCATION_DEPARTMENTS.get(row.location_string)
+
+
+class CensusFragments:
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self.columns: list[str] = []
+        # department -> (fetched at, rows)
+        self._departments: dict[str, tuple[float, list[Any]]] = {}
+        # location string -> (fetched at, row)
+        self._locations: dict[str, tuple[float, Any]] = {}
+        self._stats = FragmentStats()
+
+    def _fresh(self, fetched_at: float, now: float) -> bool:
+        return now - fetched_at < self.ttl
+
+    def missing(
+        self, departments: Sequence[str], locations: Sequence[str]
+    ) -> tuple[list[str], list[str]]:
+        """The departments and locations that need fetching"""
+        now = time.monotonic()
+        missing_departments = sorted(
+            department
+            for department in set(departments)
+            if department not in self._departments
+            or not self._fresh(self._departments[department][0], now)
+        )
+        missing_locations = sorted(
+            location
+            for location in set(locations)
+            if location not in self._locations
+            or not self._fresh(self._locations[location][0], now)
+        )
+
+        requested = len(set(departments)) + len(set(locations))
+        misses = len(missing_departments) + len(missing_locations)
+        self._stats.hits += requested - misses
+        self._stats.misses += misses
+        return missing_departments, missing_locations
+
+    def store(
+        self,
+        departments: Sequence[str],
+        locations: Sequence[str],
+        columns: list[str],
+        rows: Sequence[Any],
+        fetched_at: float,
+    ) -> None:
+        """Keeps the rows fetched for these departments and locations"""
+        self.columns = columns
+        by_department: dict[str, list[Any]] = {
+            department: [] for department in departments
+        }
+        by_location: dict[str, Any] = {}
+        for row in rows:
+            # the hand added locations of a department have no department
+            # in star so are matched up here
+            department = _row_department(row)
+            if department in by_department:
+                by_department[department].append(row)
+            by_location[row.location_string] = row
+
+        for department, department_rows in by_department.items():
+            self._departments[department] = (fetched_at, department_rows)
+        for location in locations:
+            # any string can be asked for so only real locations are kept,
+            # which bounds the cache by the number of beds
+            if location in by_location:
+                self._locations[location] = (fetched_at, by_location[location])
+
+    def assemble(self, departments: Sequence[str], locations: Sequence[str]) -> list:
+        """
+        The rows for these departments and locations as live.sql would
+        return them (one per location ordered by location string)
+        """
+        rows: dict[str, Any] = {}
+        for department in departments:
+            _, department_rows = self._departments.get(department, (0, []))
+            for row in department_rows:
+                rows[row.location_string] = row
+        for location in locations:
+            if location in self._locations:
+                rows[location] = self._locations[location][1]
+        return [rows[location] for location in sorted(rows)]
+
+    def stats(self) -> dict:
+        return {
+            **asdict(self._stats),
+            "departments": len(self._departments),
+            "locations": len(self._locations),
+        }
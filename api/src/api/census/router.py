@@ -1,14 +1,27 @@
+import asyncio
+import time
+
+import orjson
 import pandas as pd
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, Response
+from functools import lru_cache
+from operator import attrgetter
 from pathlib import Path
-from sqlalchemy import bindparam, create_engine, text
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 from sqlalchemy.orm import Session
-from typing import Any
+from typing import Any, AsyncIterator, Iterator, Sequence
 
 from api.utils import Timer
 from api import wards
-from api.census.wrangle import aggregate_by_department
-from api.db import get_star_session
+from api.census.fragments import CensusFragments
+from api.census.snapshot import CensusSnapshot, get_census_snapshot
+from api.census.wrangle import aggregate_by_department, typed_frame
+from api.config import Settings, get_settings
+from api.db import get_star_async_engine
+from api.queries import SQLQuery, get_query
+from api.singleflight import SingleFlight
+from api.streaming import ResponseFormat, stream_rows
 from api.wards import (
     CAMPUSES,
     MISSING_DEPARTMENT_LOCATIONS,
@@ -20,10 +33,20 @@ router = APIRouter(prefix="/census")
 
 mock_router = APIRouter(prefix="/census")
 
+MOCK_DB = Path(__file__).parent / "mock.db"
+LIVE_SQL = Path(__file__).parent / "live.sql"
 
-def _fetch_census(
-    session: Session, query: Any, departments: list[str], locations: list[str]
-) -> list[CensusRow]:
+# noinspection SqlResolve
+MOCK_QUERY = SQLQuery(
+    "census_mock",
+    """SELECT *
+    FROM census
+    WHERE department IN :departments
+    OR location_string IN :locations""",
+)
+
+
+def _census_params(departments: list[str], locations: list[str]) -> dict:
     all_locations = locations.copy()
 
     # Some departments have locations (beds) that are missing. This adds them
@@ -32,88 +55,280 @@ def _fetch_census(
         if missing_locations := MISSING_DEPARTMENT_LOCATIONS.get(department):
             all_locations.extend(missing_locations)
 
-    census_rows: list[CensusRow] = []
+    return {"departments": departments, "locations": all_locations}
 
-    result = session.execute(
-        query, {"departments": departments, "locations": all_locations}
+
+def _iter_census(
+    session: Session, query: SQLQuery, departments: list[str], locations: list[str]
+) -> Iterator[CensusRow]:
+    # server side cursor (where supported) so rows arrive as they are read
+    result = query.execute(
+        session, _census_params(departments, locations), stream_results=True
     )
-    for row in result:
-        census_row = CensusRow.parse_obj(row)
+    return map(_census_row, result)
+
+
+def _census_row(row: Any) -> CensusRow:
+    census_row = CensusRow.parse_obj(row)
+
+    # Add erroneously missing departments.
+    if not census_row.department:
+        census_row.department = MISSING_LOCATION_DEPARTMENTS.get(
+            census_row.location_string
+        )
+
+    return census_row
+
+
+def _fetch_census(
+    session: Session, query: SQLQuery, departments: list[str], locations: list[str]
+) -> list[CensusRow]:
+    return list(_iter_census(session, query, departments, locations))
+
+
+async def _aiter_census(
+    engine: AsyncEngine,
+    query: SQLQuery,
+    departments: list[str],
+    locations: list[str],
+) -> AsyncIterator[CensusRow]:
+    """
+    Census rows as they are read from a server side cursor; the session is
+    opened here as it must stay open until the last row is sent
+    """
+    async with AsyncSession(engine) as session:
+        result = await query.stream_async(
+            session, _census_params(departments, locations)
+        )
+        async for row in result:
+            yield _census_row(row)
+
+
+def _read_census_frame(
+    session: Session, query: SQLQuery, departments: list[str], locations: list[str]
+) -> pd.DataFrame:
+    """
+    The census as a DataFrame typed by the CensusRow schema without building
+    a model for every row
+    """
+    result = query.execute(session, _census_params(departments, locations))
+    return _census_frame(result.all(), list(result.keys()))
+
+
+def _census_frame(rows: Sequence[Any], columns: list[str]) -> pd.DataFrame:
+    df = typed_frame(rows, columns, CensusRow)
+
+    # Add erroneously missing departments.
+    missing = df["department"].isna() | (df["department"] == "")
+    df["department"] = df["department"].mask(
+        missing, df["location_string"].map(MISSING_LOCATION_DEPARTMENTS)
+    )
+    return df
+
+
+def _models_frame(census_rows: Sequence[CensusRow]) -> pd.DataFrame:
+    """
+    The census models (e.g. of the snapshot) as a DataFrame typed just as
+    _census_frame types raw rows
+    """
+    columns = list(CensusRow.__fields__)
+    return typed_frame(list(map(attrgetter(*columns), census_rows)), columns, CensusRow)
+
+
+def _departments_response(census_df: pd.DataFrame, validate: bool) -> Response:
+    """
+    Aggregates a census and serialises it straight from the columns; with
+    validate set each department is also checked against CensusDepartment
+    """
+    departments_df = aggregate_by_department(census_df)
+    columns = list(CensusDepartment.__fields__)
+    values = [
+        departments_df[column].dt.to_pydatetime().tolist()
+        if column == "modified_at"
+        else departments_df[column].tolist()
+        for column in columns
+    ]
+    records = [dict(zip(columns, row)) for row in zip(*values)]
+
+    if validate:
+        records = [CensusDepartment.parse_obj(record).dict() for record in records]
+    return Response(orjson.dumps(records), media_type="application/json")
+
+
+def _census_key(departments: list[str], locations: list[str]) -> tuple:
+    """Requests for the same beds in any order or with repeats are the same"""
+    return tuple(sorted(set(departments))), tuple(sorted(set(locations)))
 
-        # Add erroneously missing departments.
-        if not census_row.department:
-            census_row.department = MISSING_LOCATION_DEPARTMENTS.get(
-                census_row.location_string
+
+async def _cached_census(
+    flights: SingleFlight,
+    fragments: CensusFragments,
+    engine: AsyncEngine,
+    query: SQLQuery,
+    departments: list[str],
+    locations: list[str],
+) -> list[Any]:
+    """
+    Raw census rows put together from the cached fragments, fetching only
+    the departments and locations missing from the cache. Concurrent
+    requests missing the same ones share one query, which runs in its own
+    session so it outlives any one request.
+    """
+    missing_departments, missing_locations = fragments.missing(departments, locations)
+    if missing_departments or missing_locations:
+
+        async def fetch() -> None:
+            fetched_at = time.monotonic()
+            async with AsyncSession(engine) as session:
+                result = await query.execute_async(
+                    session, _census_params(missing_departments, missing_locations)
+                )
+                rows = result.all()
+            fragments.store(
+                missing_departments,
+                missing_locations,
+                list(result.keys()),
+                rows,
+                fetched_at,
             )
 
-        census_rows.append(census_row)
+        await flights.do(
+            ("fragments", *_census_key(missing_departments, missing_locations)),
+            fetch,
+        )
+    return fragments.assemble(departments, locations)
 
-    return census_rows
 
+async def _shared_census(
+    flights: SingleFlight,
+    fragments: CensusFragments,
+    engine: AsyncEngine,
+    query: SQLQuery,
+    departments: list[str],
+    locations: list[str],
+) -> list[CensusRow]:
+    rows = await _cached_census(
+        flights, fragments, engine, query, departments, locations
+    )
+    return [_census_row(row) for row in rows]
 
-# noinspection SqlResolve
-def _fetch_mock_census(departments: list[str], locations: list[str]) -> list[CensusRow]:
-    engine = create_engine(f"sqlite:///{Path(__file__).parent}/mock.db", future=True)
-
-    query = text(
-        """SELECT *
-        FROM census
-        WHERE department IN :departments
-        OR location_string IN :locations"""
-    ).bindparams(  # type: ignore
-        bindparam("departments", expanding=True),
-        bindparam("locations", expanding=True),
+
+async def _shared_census_frame(
+    flights: SingleFlight,
+    fragments: CensusFragments,
+    engine: AsyncEngine,
+    query: SQLQuery,
+    departments: list[str],
+    locations: list[str],
+) -> pd.DataFrame:
+    """As _shared_census but as a DataFrame"""
+    rows = await _cached_census(
+        flights, fragments, engine, query, departments, locations
     )
+    return _census_frame(rows, fragments.columns)
+
+
+@lru_cache()
+def get_census_flights() -> SingleFlight:
+    return SingleFlight()
+
+
+@lru_cache()
+def get_census_fragments() -> CensusFragments:
+    return CensusFragments(ttl=get_settings().census_fragment_ttl)
+
+
+def _snapshot_or_none(
+    settings: Settings = Depends(get_settings),
+) -> CensusSnapshot | None:
+    """The census snapshot if it is enabled and has finished loading"""
+    if not settings.census_snapshot:
+        return None
+    snapshot = get_census_snapshot()
+    return snapshot if snapshot.ready else None
+
+
+def _iter_mock_census(
+    departments: list[str], locations: list[str]
+) -> Iterator[CensusRow]:
+    engine = create_engine(f"sqlite:///{MOCK_DB}", future=True)
 
     with Session(engine) as session:
-        return _fetch_census(session, query, departments, locations)
+        yield from _iter_census(session, MOCK_QUERY, departments, locations)
 
 
-@mock_router.get("/departments/", response_model=list[CensusDepartment])
-def get_mock_departments() -> list[CensusDepartment]:
-    census_rows = _fetch_mock_census(list(wards.ALL), [])
-    census_df = pd.DataFrame((row.dict() for row in census_rows))
-    departments_df = aggregate_by_department(census_df)
+def _fetch_mock_census(departments: list[str], locations: list[str]) -> list[CensusRow]:
+    return list(_iter_mock_census(departments, locations))
 
-    return [
-        CensusDepartment.parse_obj(row)
-        for row in departments_df.to_dict(orient="records")
-    ]
+
+@mock_router.get("/departments/", response_model=list[CensusDepartment])
+def get_mock_departments(settings: Settings = Depends(get_settings)) -> Response:
+    engine = create_engine(f"sqlite:///{MOCK_DB}", future=True)
+    with Session(engine) as session:
+        census_df = _read_census_frame(session, MOCK_QUERY, list(wards.ALL), [])
+    return _departments_response(census_df, settings.validate_responses)
 
 
 @router.get("/departments/", response_model=list[CensusDepartment])
 @Timer(text="Get census/departments route: Elapsed time: {:.4f}")
-def get_departments(
-    session: Session = Depends(get_star_session),
-) -> list[CensusDepartment]:
-    query = text((Path(__file__).parent / "live.sql").read_text())
-    census_rows = _fetch_census(session, query, list(wards.ALL), [])
-    census_df = pd.DataFrame((row.dict() for row in census_rows))
-    departments_df = aggregate_by_department(census_df)
-
-    return [
-        CensusDepartment.parse_obj(row)
-        for row in departments_df.to_dict(orient="records")
-    ]
+async def get_departments(
+    engine: AsyncEngine = Depends(get_star_async_engine),
+    flights: SingleFlight = Depends(get_census_flights),
+    fragments: CensusFragments = Depends(get_census_fragments),
+    snapshot: CensusSnapshot | None = Depends(_snapshot_or_none),
+    settings: Settings = Depends(get_settings),
+) -> Response:
+    if snapshot is not None and snapshot.covers(list(wards.ALL), []):
+        census_df = _models_frame(snapshot.select(list(wards.ALL), []))
+    else:
+        query = get_query(LIVE_SQL)
+        census_df = await _shared_census_frame(
+            flights, fragments, engine, query, list(wards.ALL), []
+        )
+    # aggregating is CPU bound so keep it off the event loop
+    return await asyncio.to_thread(
+        _departments_response, census_df, settings.validate_responses
+    )
 
 
 @mock_router.get("/", response_model=list[CensusRow])
 def get_mock_census(
     departments: list[str] = Query(default=[]),
     locations: list[str] = Query(default=[]),
-) -> list[CensusRow]:
+    format: ResponseFormat = ResponseFormat.json,
+) -> list[CensusRow] | Response:
+    if format != ResponseFormat.json:
+        census_rows = _iter_mock_census(departments, locations)
+        return stream_rows(census_rows, CensusRow, format)
     return _fetch_mock_census(departments, locations)
 
 
 @router.get("/", response_model=list[CensusRow])
 @Timer(text="Get census/ route: Elapsed time: {:.4f}")
-def get_census(
-    session: Session = Depends(get_star_session),
+async def get_census(
+    engine: AsyncEngine = Depends(get_star_async_engine),
+    flights: SingleFlight = Depends(get_census_flights),
+    fragments: CensusFragments = Depends(get_census_fragments),
+    snapshot: CensusSnapshot | None = Depends(_snapshot_or_none),
     departments: list[str] = Query(default=[]),
     locations: list[str] = Query(default=[]),
-) -> list[CensusRow]:
-    query = text((Path(__file__).parent / "live.sql").read_text())
-    return _fetch_census(session, query, departments, locations)
+    format: ResponseFormat = ResponseFormat.json,
+) -> list[CensusRow] | Response:
+    if snapshot is not None and snapshot.covers(departments, locations):
+        census_rows = snapshot.select(departments, locations)
+        if format != ResponseFormat.json:
+            return stream_rows(census_rows, CensusRow, format)
+        return census_rows
+
+    query = get_query(LIVE_SQL)
+    if format != ResponseFormat.json:
+        # streamed straight from the cursor so not shared with other requests
+        return stream_rows(
+            _aiter_census(engine, query, departments, locations), CensusRow, format
+        )
+    return await _shared_census(
+        flights, fragments, engine, query, departments, locations
+    )
 
 
 @mock_router.get("/campus/", response_model=list[CensusRow])
@@ -130,14 +345,29 @@ def get_mock_census_by_campus(
 
 @router.get("/campus/", response_model=list[CensusRow])
 @Timer(text="Get census/campus route: Elapsed time: {:.4f}")
-def get_census_by_campus(
-    session: Session = Depends(get_star_session),
+async def get_census_by_campus(
+    engine: AsyncEngine = Depends(get_star_async_engine),
+    flights: SingleFlight = Depends(get_census_flights),
+    fragments: CensusFragments = Depends(get_census_fragments),
+    snapshot: CensusSnapshot | None = Depends(_snapshot_or_none),
     campuses: list[str] = Query(default=[]),
 ) -> list[CensusRow]:
-    query = text((Path(__file__).parent / "live.sql").read_text())
     locations: list = []
     departments: list = []
     for campus in campuses:
         departments.extend(CAMPUSES.get(campus, []))
 
-    return _fetch_census(session, query, departments, locations)
+    if snapshot is not None and snapshot.covers(departments, locations):
+        return snapshot.select(departments, locations)
+    query = get_query(LIVE_SQL)
+    return await _shared_census(
+        flights, fragments, engine, query, departments, locations
+    )
+
+
+@router.get("/stats/")
+def get_census_stats(
+    flights: SingleFlight = Depends(get_census_flights),
+    fragments: CensusFragments = Depends(get_census_fragments),
+) -> dict[str, dict]:
+    return {"flights": flights.stats(), "fragments": fragments.stats()}
@@ -0,0 +1,245 @@
+"""
+A materialised copy of the bed level census kept up to date incrementally
+
+live.sql takes around 20s because it rebuilds the census for every bed in
+every ward. Between two runs only a handful of beds actually change (an
+admission, a discharge, a new planned move) so the snapshot is loaded in
+full once and then refreshed by asking a change feed which locations have
+had location_visit/planned_movement rows stored since the last high water
+mark and re-running the census query for just those locations.
+
+All the census routes are answered from the snapshot when
+settings.census_snapshot is set, but for departments (or locations) the
+snapshot does not hold, which are fetched live.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Iterable, Protocol
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from api import wards
+from api.config import get_settings
+from api.db import get_star_engine
+from api.logger import logger
+from api.queries import get_query
+from api.wards import MISSING_DEPARTMENT_LOCATIONS
+from models.census import CensusRow
+
+# (departments, locations) -> census rows
+CensusFetcher = Callable[[list[str], list[str]], list[CensusRow]]
+
+
+class ChangeFeed(Protocol):
+    def high_water_mark(self) -> datetime | None:
+        """The latest change in the source right now"""
+
+    def changes(self, since: datetime | None) -> tuple[set[str], datetime | None]:
+        """
+        Locations with changes stored after since, along with the new high
+        water mark
+        """
+
+
+class StarChangeFeed:
+    """Changes to star.location_visit and star.planned_movement"""
+
+    def __init__(self, engine: Engine) -> None:
+        self.engine = engine
+
+    def high_water_mark(self) -> datetime | None:
+        # noinspection SqlResolve
+        query = text(
+            """SELECT GREATEST(
+                (SELECT MAX(stored_from) FROM star.location_visit),
+                (SELECT MAX(stored_from) FROM star.planned_movement)
+            )"""
+        )
+        with Session(self.engine) as session:
+            return session.execute(query).scalar()
+
+    def changes(self, since: datetime | None) -> tuple[set[str], datetime | None]:
+        if since is None:
+            raise ValueError("A full load is needed before asking for changes")
+        with Session(self.engine) as session:
+            query = get_query(Path(__file__).parent / "changes.sql")
+            rows = query.execute(session, {"since": since}).all()
+        return (
+            {row.location_string for row in rows},
+            max((row.stored_from for row in rows), default=since),
+        )
+
+
+class CensusSnapshot:
+    def __init__(
+        self,
+        fetch: CensusFetcher,
+        feed: ChangeFeed,
+        departments: Iterable[str] = wards.ALL,
+        full_refresh_interval: float = 3600,
+    ) -> None:
+        self.fetch = fetch
+        self.feed = feed
+        self.departments = set(departments)
+        # changes the feed cannot see (e.g. demographics) are picked up by
+        # rebuilding from scratch every so often
+        self.full_refresh_interval = full_refresh_interval
+
+        self.high_water_mark: datetime | None = None
+        self.as_of: datetime | None = None
+        self._rows: dict[str, CensusRow] = {}
+        self._by_department: dict[str, list[str]] = {}
+        self._loaded_at: float | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._loaded_at is not None
+
+    def refresh(self) -> int:
+        """Bring the snapshot up to date, returning the number of rows fetched"""
+        if (
+            self._loaded_at is None
+            or time.monotonic() - self._loaded_at > self.full_refresh_interval
+        ):
+            return self._full_refresh()
+        return self._incremental_refresh()
+
+    def _full_refresh(self) -> int:
+        # read the mark first so changes made during the (slow) load are
+        # fetched again next time rather than lost
+        high_water_mark = self.feed.high_water_mark()
+        census_rows = self.fetch(sorted(self.departments), [])
+        rows = {row.location_string: row for row in census_rows}
+
+        with self._lock:
+            self._rows = rows
+            self._loaded_at = time.monotonic()
+            self._publish(high_water_mark)
+        logger.info(f"Loaded census snapshot ({len(rows)} rows)")
+        return len(census_rows)
+
+    def _incremental_refresh(self) -> int:
+        changed, high_water_mark = self.feed.changes(self.high_water_mark)
+        census_rows = self.fetch([], sorted(changed)) if changed else []
+
+        with self._lock:
+            for row in census_rows:
+                # locations are fetched regardless of department so skip any
+                # that do not belong in the snapshot
+                if (
+                    row.location_string in self._rows
+                    or row.department in self.departments
+                ):
+                    self._rows[row.location_string] = row
+            self._publish(high_water_mark)
+        if changed:
+            logger.info(f"Refreshed {len(changed)} locations in the census snapshot")
+        return len(census_rows)
+
+    def _publish(self, high_water_mark: datetime | None) -> None:
+        self.high_water_mark = high_water_mark
+        self.as_of = datetime.now(timezone.utc)
+
+        # the whole snapshot is correct as of this refresh; new rows as
+        # readers may still hold those of the last one
+        rows = {
+            location_string: row.copy(update={"modified_at": self.as_of})
+            for location_string, row in sorted(self._rows.items())
+        }
+        by_department: dict[str, list[str]] = {}
+        for location_string, row in rows.items():
+            by_department.setdefault(row.department, []).append(location_string)
+        self._rows = rows
+        self._by_department = by_department
+
+    def covers(self, departments: list[str], locations: list[str]) -> bool:
+        """
+        Whether select() has every row of these departments and locations;
+        if not they are to be fetched live
+        """
+        with self._lock:
+            return self.departments.issuperset(departments) and all(
+                location in self._rows for location in locations
+            )
+
+    def select(self, departments: list[str], locations: list[str]) -> list[CensusRow]:
+        """The same rows as live.sql for these departments and locations"""
+        with self._lock:
+            selected = set(locations)
+            for department in departments:
+                selected.update(self._by_department.get(department, ()))
+                selected.update(MISSING_DEPARTMENT_LOCATIONS.get(department, ()))
+            return [
+                self._rows[location]
+                for location in sorted(selected)
+                if location in self._rows
+            ]
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+class SnapshotRefresher:
+    """Refreshes a census snapshot every interval seconds in a thread"""
+
+    def __init__(self, snapshot: CensusSnapshot, interval: float) -> None:
+        self.snapshot = snapshot
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="census-snapshot", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            # a refresh in progress is abandoned (the thread is a daemon)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.snapshot.refresh()
+            except Exception:
+                logger.exception("Failed to refresh the census snapshot")
+            self._stop.wait(self.interval)
+
+
+def _fetch_star_census(departments: list[str], locations: list[str]) -> list[CensusRow]:
+    # imported here as the router serves from this module
+    from api.census.router import LIVE_SQL, _fetch_census
+
+    query = get_query(LIVE_SQL)
+    with Session(get_star_engine()) as session:
+        return _fetch_census(session, query, departments, locations)
+
+
+@lru_cache()
+def get_census_snapshot() -> CensusSnapshot:
+    settings = get_settings()
+    return CensusSnapshot(
+        fetch=_fetch_star_census,
+        feed=StarChangeFeed(get_star_engine()),
+        full_refresh_interval=settings.census_full_refresh_interval,
+    )
+
+
+@lru_cache()
+def get_census_refresher() -> SnapshotRefresher:
+    return SnapshotRefresher(
+        get_census_snapshot(), interval=get_settings().census_refresh_interval
+    )
@@ -1,6 +1,33 @@
 import numpy as np
 import pandas as pd
 import warnings
+from datetime import date, datetime
+from typing import Any, Sequence
+
+from pydantic import BaseModel
+
+# pandas dtypes for the (optional) field types of a flat pydantic model
+_DTYPES = {int: "Int64", float: "float64", bool: "boolean", str: "object"}
+
+
+def typed_frame(
+    records: Sequence[Sequence[Any]], columns: list[str], model: type[BaseModel]
+) -> pd.DataFrame:
+    """
+    Builds a DataFrame from raw rows (e.g. a SQL result) with each column
+    cast to the type of the matching field of the model
+    """
+    df = pd.DataFrame.from_records(records, columns=columns)
+    for name, field in model.__fields__.items():
+        if name not in df.columns:
+            continue
+        if field.type_ is datetime:
+            df[name] = pd.to_datetime(df[name], errors="coerce", utc=True)
+        elif field.type_ is date:
+            df[name] = pd.to_datetime(df[name], errors="coerce")
+        elif field.type_ in _DTYPES:
+            df[name] = df[name].astype(_DTYPES[field.type_])
+    return df
 
 
 def _split_location_string(df: pd.DataFrame) -> pd.DataFrame:
@@ -30,18 +57,35 @@ def _aggregate_by_department(df: pd.DataFrame) -> pd.DataFrame:
     Aggregation from location (bed) level to ward level
     Generates estimates of beds likely to be closed
     """
-    df["cvl_discharge"] = pd.to_datetime(df["cvl_discharge"], errors="coerce", utc=True)
-    if df["modified_at"].dt.tz is None:
-        df["modified_at"] = df["modified_at"].dt.tz_localize("UTC")
+    modified_at = df["modified_at"]
+    if modified_at.dt.tz is None:
+        modified_at = modified_at.dt.tz_localize("UTC")
         warnings.warn("[WARN] Forcing timezone to UTC for 'modified_at'")
 
-    groups = df.groupby("department")
-    # aggregate by dept
-    res = groups.agg(
-        beds=("location_id", "count"),
-        patients=("occupied", "sum"),
-        days_since_last_dc=("cvl_discharge", lambda x: x.max(skipna=True)),
-        modified_at=("modified_at", "max"),
+    # only the columns needed, typed so that every aggregation is vectorised
+    beds = pd.DataFrame(
+        {
+            "department": df["department"].astype("category"),
+            "location_id": df["location_id"],
+            "occupied": df["occupied"].fillna(False).astype(bool),
+            "cvl_discharge": pd.to_datetime(
+                df["cvl_discharge"], errors="coerce", utc=True
+            ),
+            "modified_at": modified_at,
+        }
+    )
+
+    # aggregate by dept (observed categorical groups come out in order of
+    # appearance so are sorted afterwards)
+    res = (
+        beds.groupby("department", observed=True)
+        .agg(
+            beds=("location_id", "count"),
+            patients=("occupied", "sum"),
+            last_dc=("cvl_discharge", "max"),
+            modified_at=("modified_at", "max"),
+        )
+        .sort_index()
     )
 
     # calculate additional numbers
@@ -51,51 +95,26 @@ def _aggregate_by_department(df: pd.DataFrame) -> pd.DataFrame:
     # placeholder: need to subtract closed from empties
     # res["opens"] = res["empties"]
 
-    # Calculate days since last discharge, but handle NaT values in wards by allowing
-    # the quantity to be a float rather than integer
-    res["days_since_last_dc"] = (
-        (res["modified_at"] - res["days_since_last_dc"]).dt.floor("d").dt.days
-    )
-    # Convert remaining NaT values to -999, then convert the Series dtype to int
-    res["days_since_last_dc"] = (
-        res["days_since_last_dc"].replace(np.nan, -999.0).astype(int)
+    # Days since last discharge where wards with no discharges at all (NaT)
+    # are given -999
+    days_since_last_dc = (
+        (res["modified_at"] - res["last_dc"]).dt.floor("d").dt.days.to_numpy()
     )
+    days_since_last_dc = np.where(
+        np.isnan(days_since_last_dc), -999, days_since_last_dc
+    ).astype(int)
+    res["days_since_last_dc"] = days_since_last_dc
 
     # use days since last dc and there being no patients to define if a ward
     # appears to be closed defined closed: temp and perm
-    res["closed_temp"] = pd.DataFrame(
-        [
-            res["days_since_last_dc"] > 2,
-            res["days_since_last_dc"] <= 30,
-            res["patients"] == 0,
-        ]
-    ).T.all(axis="columns")
-
-    def _closed_perm_conditions(row: pd.Series) -> bool:
-        """Calculate permanent closure conditions.
-
-        Handles NaT values of days_since_last_dc, which are
-        converted to -999.
-
-        Args:
-            row (pd.Series): Pandas DataFrame row
-
-        Returns:
-            bool: Is the ward permanently closed?
-        """
-        if row["days_since_last_dc"] > 30 and row["patients"] == 0:
-            closed = True
-        elif row["days_since_last_dc"] < 0:
-            closed = True
-        else:
-            closed = False
-        return closed
-
-    res["closed_perm"] = res.apply(_closed_perm_conditions, axis=1)
-
-    # drop closed perm
-    # mask = ~res["closed_perm"]
-    # res = res[mask]
+    no_patients = res["patients"].to_numpy() == 0
+    res["closed_temp"] = (
+        (days_since_last_dc > 2) & (days_since_last_dc <= 30) & no_patients
+    )
+    # -999 (never discharged) also counts as permanently closed
+    res["closed_perm"] = ((days_since_last_dc > 30) & no_patients) | (
+        days_since_last_dc < 0
+    )
 
     res = res[
         [
@@ -108,7 +127,8 @@ def _aggregate_by_department(df: pd.DataFrame) -> pd.DataFrame:
             "modified_at",
         ]
     ]
-    res.reset_index(inplace=True)
+    res = res.reset_index()
+    res["department"] = res["department"].astype(object)
     return res
 
 
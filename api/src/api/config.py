@@ -1,4 +1,5 @@
 from functools import lru_cache
+from pathlib import Path
 
 from pydantic import BaseSettings, PostgresDsn, AnyUrl, AnyHttpUrl, SecretStr
 
@@ -13,10 +14,65 @@ class Settings(BaseSettings):
     baserow_password: SecretStr
     baserow_application_name: str
     baserow_username: str
+    # Pages of a table that may be requested from baserow at the same time
+    baserow_concurrency: int = 8
+    baserow_timeout: float = 30.0
+    # Attempts (with exponential backoff) at each baserow bootstrap step
+    baserow_retries: int = 10
+    # Seconds before a cached departments/rooms/beds table is refreshed
+    baserow_cache_ttl: int = 300
+
+    # Where discharge statuses wait to be sent to baserow; on the api-data
+    # volume (see compose.yml) so they outlive the container
+    discharge_queue_path: Path = Path("/app/data/discharge_queue.db")
+    # Seconds between sending queued discharge statuses to baserow
+    discharge_flush_interval: float = 5.0
+    # Hours of discharge statuses held for the latest status of each CSN
+    discharge_status_horizon_hours: int = 72
 
     hycastle_url: AnyHttpUrl
+    # Seconds to wait for hycastle to accept a connection and to answer
+    hycastle_connect_timeout: float = 5.0
+    hycastle_timeout: float = 20.0
+    # Seconds before a ward's cached sitrep is refreshed (in the background)
+    hycastle_cache_ttl: int = 60
+    # Seconds after which a cached sitrep is no longer served at all
+    hycastle_max_stale: int = 900
 
     echo_sql: bool = False
+    # Connection pool of each database engine
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    # Seconds to wait for a connection before giving up
+    db_pool_timeout: float = 30
+    # Seconds after which a connection is replaced
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    # Seconds before a query is cancelled (0 for no limit)
+    db_statement_timeout: int = 120
+    # Engines (see api.db.ENGINES) to open pool_size connections for at
+    # startup; the live census routes use star_async
+    db_warm_up: list[str] = ["star_async"]
+    # Re-read .sql files when they change on disk
+    debug: bool = False
+    # PREPARE queries once per postgres connection and EXECUTE them after
+    prepare_statements: bool = True
+    # Check pre-serialised responses against their models (slow; for tests)
+    validate_responses: bool = False
+
+    # Serve the census routes from an incrementally refreshed snapshot
+    census_snapshot: bool = False
+    # Seconds between checks for changed locations
+    census_refresh_interval: float = 60
+    # Seconds before the snapshot is rebuilt from scratch
+    census_full_refresh_interval: float = 3600
+    # Seconds the rows of a department are reused by the census routes when
+    # not serving from the snapshot; off (0, always query) by default as the
+    # rows can then be that much older than the live census
+    census_fragment_ttl: float = 0
+
+    # Seconds the next location of a patient (CSN) is reused
+    next_location_ttl: float = 60
 
     icu_admission_predictions: bool = False
 
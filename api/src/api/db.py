@@ -1,45 +1,235 @@
+"""
+Engines and sessions for the hospital databases
+
+Each engine is created once with a pool sized from the settings (see
+Settings.db_pool_*) and records how long requests wait for a connection
+so pools can be sized against the number of gunicorn workers; pool_stats
+reports these for every engine in use.
+"""
+import asyncio
 import importlib
+import time
+from dataclasses import asdict, dataclass
 from functools import lru_cache
 from pathlib import Path
+from typing import Any, Callable, cast
 
 from fastapi import Depends
-from sqlalchemy import create_engine
-from sqlalchemy.engine import Engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Connection, Engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
 from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from api.config import get_settings
+from api.logger import logger
+from api.queries import get_query_registry
+
+_engines: dict[str, Engine] = {}
+
+
+@dataclass
+class PoolMetrics:
+    checkouts: int = 0
+    # checkouts that gave up after db_pool_timeout
+    timeouts: int = 0
+    total_wait_ms: float = 0.0
+    max_wait_ms: float = 0.0
+
+
+class _TimedPool(QueuePool):
+    """
+    Mixed into a QueuePool to time each checkout; subclassed per engine (see
+    _pool_class) so the metrics survive the pool being recreated
+    """
+
+    metrics: PoolMetrics
+
+    def _do_get(self) -> Any:
+        start = time.perf_counter()
+        try:
+            # _do_get is private so not in the stubs
+            connection = super()._do_get()  # type: ignore[misc]
+        except PoolTimeout:
+            self.metrics.timeouts += 1
+            raise
+        wait_ms = 1000 * (time.perf_counter() - start)
+        self.metrics.checkouts += 1
+        self.metrics.total_wait_ms += wait_ms
+        self.metrics.max_wait_ms = max(self.metrics.max_wait_ms, wait_ms)
+        return connection
+
+
+def _pool_class(name: str, base: type[QueuePool]) -> type[QueuePool]:
+    return type(f"{name.title()}Pool", (_TimedPool, base), {"metrics": PoolMetrics()})
+
+
+def _pool(engine: Engine) -> _TimedPool:
+    """The pool of an engine made here (all of which are timed)"""
+    return cast(_TimedPool, engine.pool)
+
+
+def _pool_args() -> dict[str, Any]:
+    settings = get_settings()
+    return {
+        "echo": settings.echo_sql,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+
+def _create_engine(name: str, dsn: str) -> Engine:
+    settings = get_settings()
+    backend = make_url(dsn).get_backend_name()
+
+    connect_args = {}
+    if backend == "postgresql" and settings.db_statement_timeout:
+        timeout_ms = 1000 * settings.db_statement_timeout
+        connect_args["options"] = f"-c statement_timeout={timeout_ms}"
+
+    engine: Engine = create_engine(
+        dsn,
+        future=True,
+        poolclass=_pool_class(name, QueuePool),
+        connect_args=connect_args,
+        **_pool_args(),
+    )
+
+    if backend == "mssql" and settings.db_statement_timeout:
+        # pyodbc has no connection string option for a query timeout
 
-from api.config import get_settings, Settings
+        @event.listens_for(engine, "connect")
+        def _set_query_timeout(dbapi_connection: Any, _: Any) -> None:
+            dbapi_connection.timeout = settings.db_statement_timeout
+
+    _engines[name] = engine
+    return engine
 
 
 @lru_cache()
-def _caboodle_engine(settings: Settings = Depends(get_settings)) -> Engine:
-    return create_engine(settings.caboodle_dsn, echo=settings.echo_sql, future=True)
+def get_caboodle_engine() -> Engine:
+    return _create_engine("caboodle", get_settings().caboodle_dsn)
 
 
-def get_caboodle_session(engine: Engine = Depends(_caboodle_engine)) -> Session:
+def get_caboodle_session(engine: Engine = Depends(get_caboodle_engine)) -> Session:
     with Session(engine) as session:
         yield session
 
 
 @lru_cache()
-def _star_engine(settings: Settings = Depends(get_settings)) -> Engine:
-    return create_engine(settings.star_dsn, echo=settings.echo_sql, future=True)
+def get_star_engine() -> Engine:
+    return _create_engine("star", get_settings().star_dsn)
 
 
-def get_star_session(engine: Engine = Depends(_star_engine)) -> Session:
+def get_star_session(engine: Engine = Depends(get_star_engine)) -> Session:
     with Session(engine) as session:
         yield session
 
 
+def _create_async_engine(name: str, dsn: str) -> AsyncEngine:
+    """
+    An asyncpg engine for a postgres DSN (whatever its driver); asyncpg
+    prepares and caches statements on each connection by itself
+    """
+    settings = get_settings()
+    url = make_url(dsn)
+
+    connect_args = {}
+    if url.get_backend_name() == "postgresql":
+        url = url.set(drivername="postgresql+asyncpg")
+        if settings.db_statement_timeout:
+            timeout_ms = 1000 * settings.db_statement_timeout
+            connect_args["server_settings"] = {"statement_timeout": str(timeout_ms)}
+
+    engine = create_async_engine(
+        url,
+        poolclass=_pool_class(name, AsyncAdaptedQueuePool),
+        connect_args=connect_args,
+        **_pool_args(),
+    )
+    _engines[name] = engine.sync_engine
+    return engine
+
+
 @lru_cache()
-def _clarity_engine(settings: Settings = Depends(get_settings)) -> Engine:
-    return create_engine(settings.clarity_dsn, echo=settings.echo_sql, future=True)
+def get_star_async_engine() -> AsyncEngine:
+    return _create_async_engine("star_async", get_settings().star_dsn)
+
 
+@lru_cache()
+def get_clarity_engine() -> Engine:
+    return _create_engine("clarity", get_settings().clarity_dsn)
 
-def get_clarity_session(engine: Engine = Depends(_clarity_engine)) -> Session:
+
+def get_clarity_session(engine: Engine = Depends(get_clarity_engine)) -> Session:
     with Session(engine) as session:
         yield session
 
 
+ENGINES: dict[str, Callable[[], Engine | AsyncEngine]] = {
+    "star": get_star_engine,
+    "star_async": get_star_async_engine,
+    "caboodle": get_caboodle_engine,
+    "clarity": get_clarity_engine,
+}
+
+
+def _connect(engine: Engine, connections: list[Connection]) -> None:
+    for _ in range(_pool(engine).size()):
+        connections.append(engine.connect())
+
+
+async def warm_up(name: str) -> int:
+    """
+    Opens the minimum (pool_size) connections of an engine so the first
+    requests do not pay for connecting, returning how many were opened
+    """
+    engine = ENGINES[name]()
+    connections: list[Connection] = []
+    async_connections: list[AsyncConnection] = []
+    try:
+        if isinstance(engine, AsyncEngine):
+            for _ in range(_pool(engine.sync_engine).size()):
+                async_connections.append(await engine.connect().start())
+        else:
+            # in a thread as connecting blocks (and may time out)
+            await asyncio.to_thread(_connect, engine, connections)
+    except Exception as e:
+        # not fatal, requests will connect (and fail) on their own
+        logger.warning(f"Failed to warm up the {name} connection pool: {e!r}")
+    finally:
+        for connection in connections:
+            connection.close()
+        for async_connection in async_connections:
+            await async_connection.close()
+    opened = len(connections) + len(async_connections)
+    logger.info(f"Warmed up {opened} {name} connections")
+    return opened
+
+
+def pool_stats() -> dict[str, dict]:
+    """Current state and checkout wait times of the pool of each engine"""
+    stats = {}
+    for name, engine in _engines.items():
+        pool = _pool(engine)
+        metrics = pool.metrics
+        stats[name] = {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            **asdict(metrics),
+            "mean_wait_ms": metrics.total_wait_ms / metrics.checkouts
+            if metrics.checkouts
+            else None,
+        }
+    return stats
+
+
 # TODO: Remove this function and env.
 def prepare_query(module: str, env: str) -> str:
     """
@@ -64,5 +254,4 @@ def prepare_query(module: str, env: str) -> str:
         )
         raise e
     print(f"--- INFO: running {choice[env]} query")
-    query = Path(q).read_text()
-    return query
+    return get_query_registry().get(Path(q)).sql
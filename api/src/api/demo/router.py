@@ -4,9 +4,9 @@ from pathlib import Path
 import pandas as pd
 from fastapi import APIRouter, Depends
 from sqlmodel import Session
-from sqlalchemy import text
 
 from api.db import get_clarity_session
+from api.queries import get_query
 from models.demo import ClarityOrCase
 
 router = APIRouter(prefix="/demo")
@@ -33,7 +33,7 @@ def get_demo_rows(
     Return mock data by running query in anger
     response_model defines the data type (model) of the response
     """
-    query = text((Path(__file__).parent / "live.sql").read_text())
+    query = get_query(Path(__file__).parent / "live.sql").clause
     params = {"days_ahead": days_ahead}
     df = pd.read_sql(query, session.connection(), params=params)
     return [ClarityOrCase.parse_obj(row) for row in df.to_dict(orient="records")]
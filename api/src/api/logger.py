@@ -1,4 +1,5 @@
 import functools
+import inspect
 import notifiers
 from loguru import logger
 from notifiers.logging import NotificationHandler
@@ -6,8 +7,8 @@ from pathlib import Path
 from api.config import get_settings
 from datetime import datetime
 import time
-from collections.abc import Callable
-from typing import TypeVar, ParamSpec
+from collections.abc import Awaitable, Callable
+from typing import Any, TypeVar, ParamSpec, cast
 
 # Strategy to manage type checking
 # https://stackoverflow.com/a/65602590/992999
@@ -27,6 +28,23 @@ def logger_timeit(*, level: str = "DEBUG") -> Callable:
     def wrapper(func: Callable[P, T]) -> Callable[P, T]:
         name = func.__name__
 
+        if inspect.iscoroutinefunction(func):
+            # FastAPI inspects the wrapped callable to decide whether to run it
+            # on the event loop or the threadpool so keep coroutines as such
+            @functools.wraps(func)
+            async def awrapped(*args: P.args, **kwargs: P.kwargs) -> Any:
+                logger_ = logger.opt(depth=1)
+                start = time.time()
+                result = await cast(Awaitable[Any], func(*args, **kwargs))
+                end = time.time()
+                logger_.log(
+                    level,
+                    f"Function {name} returned in" f" {1000 * (end - start):.1f}ms",
+                )
+                return result
+
+            return awrapped  # type: ignore
+
         @functools.wraps(func)
         def wrapped(*args: P.args, **kwargs: P.kwargs) -> T:
             logger_ = logger.opt(depth=1)
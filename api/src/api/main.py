@@ -2,29 +2,63 @@
 """
 Entry point and main file for the FastAPI backend
 """
+import asyncio
 import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 
 import arrow
 from fastapi import APIRouter, FastAPI
 from fastapi.responses import ORJSONResponse
 
+from api.baserow import get_baserow_session
+from api.beds.discharges import get_discharge_flusher
 from api.beds.router import mock_router as mock_beds_router
 from api.beds.router import router as beds_router
 from api.census.router import mock_router as mock_census_router
 from api.census.router import router as census_router
+from api.census.snapshot import get_census_refresher
+from api.config import get_settings
+from api.db import pool_stats, warm_up
 from api.demo.router import mock_router as mock_demo_router
 from api.demo.router import router as demo_router
 from api.hospital.router import mock_router as mock_hospital_router
 from api.hospital.router import router as hospital_router
 from api.logger import logger
+from api.queries import get_query_registry
+from api.sitrep.hycastle import get_hycastle_client
 from api.sitrep.router import mock_router as mock_sitrep_router
 from api.sitrep.router import router as sitrep_router
 
 
 logger.info("API app starting")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    logger.info(f"Compiled {get_query_registry().preload()} SQL queries")
+    warm_ups = [
+        asyncio.create_task(warm_up(name)) for name in get_settings().db_warm_up
+    ]
+    # bootstrap baserow in the background so requests never wait on it
+    baserow_session = get_baserow_session()
+    await baserow_session.start()
+    get_discharge_flusher().start()
+    if get_settings().census_snapshot:
+        get_census_refresher().start()
+    yield
+    for task in warm_ups:
+        task.cancel()
+    if get_settings().census_snapshot:
+        get_census_refresher().stop()
+    await get_discharge_flusher().stop()
+    await baserow_session.stop()
+    await get_hycastle_client().aclose()
+
+
 app = FastAPI(
     default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 mock_router = APIRouter(
@@ -63,6 +97,11 @@ def pong_slow() -> dict[str, str]:
     return {"request_time": notnow, "response_time": now}
 
 
+@app.get("/db/pools")
+def get_pool_stats() -> dict[str, dict]:
+    return pool_stats()
+
+
 @app.get("/ping/fast")
 def pong_fast() -> dict[str, str]:
     now = arrow.utcnow().format("YYYY-MM-DD HH:mm:ss.SSS")
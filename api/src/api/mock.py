@@ -6,9 +6,10 @@ from typing import Any
 
 import pandas as pd
 from pydantic import BaseModel
-from sqlalchemy import text
 from sqlmodel import Session
 
+from api.queries import get_query
+
 
 def _get_json_rows(this_file: Any, filename: str) -> Any:
     """
@@ -37,6 +38,6 @@ def _parse_query(
     :param model:
     :return:
     """
-    query = text((this_file.parent / query_file).read_text())
+    query = get_query(this_file.parent / query_file).clause
     df = pd.read_sql(query, session.connection(), params=params)
     return [model.parse_obj(row) for row in df.to_dict(orient="records")]
@@ -1,9 +1,40 @@
+import threading
+import time
 from datetime import datetime
+from functools import lru_cache
+from typing import Callable, Iterator
 
 from pydantic import BaseModel
-from sqlalchemy import text
 from sqlalchemy.orm import Session
 
+from api.config import get_settings
+from api.queries import SQLQuery
+
+# CSNs sent to the database at a time
+CHUNK_SIZE = 1000
+
+
+QUERY = SQLQuery(
+    "next_locations",
+    """
+    SELECT DISTINCT ON (hv.encounter) hv.encounter AS csn,
+        l.location_string AS next_location,
+        d.speciality AS next_speciality,
+        pm.event_datetime
+    FROM star.planned_movement pm
+    INNER JOIN star.hospital_visit hv
+        ON hv.hospital_visit_id = pm.hospital_visit_id
+    LEFT JOIN star.location l
+        ON l.location_id = pm.location_id
+    LEFT JOIN star.department d
+        ON d.department_id = l.department_id
+    WHERE NOT pm.cancelled
+    AND pm.event_datetime IS NOT NULL
+    AND hv.encounter = ANY ( :csns )
+    ORDER BY hv.encounter, pm.event_datetime DESC
+    """,
+)
+
 
 class NextLocation(BaseModel):
     csn: str
@@ -12,37 +43,97 @@ class NextLocation(BaseModel):
     event_datetime: datetime
 
 
-def next_locations(star_session: Session, csns: list[str]) -> list[NextLocation]:
+def _chunks(items: list[str], size: int) -> Iterator[list[str]]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def _query_next_locations(star_session: Session, csns: list[str]) -> list[NextLocation]:
+    # bound as an array so the statement (and its plan) is the same however
+    # many CSNs there are, and chunked to keep each array a sensible size
+    next_locations: list[NextLocation] = []
+    for chunk in _chunks(csns, CHUNK_SIZE):
+        results = QUERY.execute(star_session, {"csns": chunk})
+        next_locations.extend(NextLocation.parse_obj(row) for row in results)
+    return next_locations
+
+
+class NextLocationCache:
+    """
+    The next location of each CSN (or that there is none) for ttl seconds so
+    that repeated requests for mostly the same patients only query the CSNs
+    not seen recently
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        # csn -> (fetched at, next location or None if no move is planned)
+        self._entries: dict[str, tuple[float, NextLocation | None]] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self, csns: list[str], fetch: Callable[[list[str]], list[NextLocation]]
+    ) -> list[NextLocation]:
+        found: dict[str, NextLocation | None] = {}
+        missing = []
+        with self._lock:
+            now = time.monotonic()
+            for csn in dict.fromkeys(csns):
+                entry = self._entries.get(csn)
+                if entry is not None and now - entry[0] < self.ttl:
+                    found[csn] = entry[1]
+                else:
+                    missing.append(csn)
+
+        if missing:
+            fetched_at = time.monotonic()
+            fetched = {
+                next_location.csn: next_location for next_location in fetch(missing)
+            }
+            with self._lock:
+                # patients come and go so the expired ones are dropped
+                self._entries = {
+                    csn: entry
+                    for csn, entry in self._entries.items()
+                    if fetched_at - entry[0] < self.ttl
+                }
+                for csn in missing:
+                    found[csn] = fetched.get(csn)
+                    self._entries[csn] = (fetched_at, found[csn])
+
+        return [
+            next_location
+            for _, next_location in sorted(found.items(), key=lambda item: item[0])
+            if next_location is not None
+        ]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+@lru_cache()
+def get_next_location_cache() -> NextLocationCache:
+    return NextLocationCache(ttl=get_settings().next_location_ttl)
+
+
+def next_locations(
+    star_session: Session,
+    csns: list[str],
+    cache: NextLocationCache | None = None,
+) -> list[NextLocation]:
     """
     For each patient CSN return whether a request to move to another bed has
     been made.
 
     :param star_session: Database connection to EMAP star.
     :param csns: A list of patient CSNs to check.
+    :param cache: Recent answers to reuse (by default those shared by every
+        caller); CSNs missing from it are queried in chunks.
     :return: A data frame [csn, next_location, event_time, next_speciality]. No rows
         will be returned for patients that do not have bed requests.
     """
-
-    query = text(
-        """
-        SELECT DISTINCT ON (hv.encounter) hv.encounter AS csn,
-            l.location_string AS next_location,
-            d.speciality AS next_speciality,
-            pm.event_datetime
-        FROM star.planned_movement pm
-        INNER JOIN star.hospital_visit hv
-            ON hv.hospital_visit_id = pm.hospital_visit_id
-        LEFT JOIN star.location l
-            ON l.location_id = pm.location_id
-        LEFT JOIN star.department d
-            ON d.department_id = l.department_id
-        WHERE NOT pm.cancelled
-        AND pm.event_datetime IS NOT NULL
-        AND hv.encounter IN :csns
-        ORDER BY hv.encounter, pm.event_datetime DESC
-        """
+    if cache is None:
+        cache = get_next_location_cache()
+    return cache.get(
+        list(csns), lambda missing: _query_next_locations(star_session, missing)
     )
-
-    results = star_session.execute(query, {"csns": tuple(csns)})
-
-    return [NextLocation.parse_obj(row) for row in results]
@@ -0,0 +1,156 @@
+"""
+Registry of the SQL used by the routes
+
+Each .sql file is read and compiled into a TextClause once (all of them at
+startup, see preload) rather than on every request. With settings.debug
+set a file is re-read whenever it changes on disk.
+
+Parameters written as `= ANY ( :name )` are bound as arrays and those
+written as `IN :name` are expanded, so callers can always pass lists.
+
+On postgres each query run through a (sync) Session is also PREPAREd
+once per connection and then run with EXECUTE so the planner does not
+re-plan (for example) the 20 second census query on every request. The
+statements already prepared on a connection are tracked in its info
+dictionary which is discarded along with the connection.
+"""
+import hashlib
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+from sqlalchemy import String, bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.engine import Connection, Result
+from sqlalchemy.ext.asyncio import AsyncResult, AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import TextClause
+
+from api.config import get_settings
+
+SQL_ROOT = Path(__file__).parent
+
+# the same pattern as sqlalchemy uses for :name parameters in text()
+_BIND_PARAM = re.compile(r"(?<![:\w\\]):(\w+)(?!:)")
+_ARRAY_PARAM = re.compile(r"ANY\s*\(\s*:(\w+)\s*\)", re.IGNORECASE)
+_EXPANDING_PARAM = re.compile(r"\bIN\s+:(\w+)", re.IGNORECASE)
+_NON_WORD = re.compile(r"\W+")
+
+
+class SQLQuery:
+    def __init__(self, name: str, sql: str) -> None:
+        self.name = name
+        self.sql = sql
+
+        self.params: list[str] = list(dict.fromkeys(_BIND_PARAM.findall(sql)))
+        expanding = list(dict.fromkeys(_EXPANDING_PARAM.findall(sql)))
+        binds = [
+            bindparam(param, type_=ARRAY(String))
+            for param in dict.fromkeys(_ARRAY_PARAM.findall(sql))
+        ] + [bindparam(param, expanding=True) for param in expanding]
+        # the number of placeholders an expanded list needs is not known
+        # until it is bound
+        self.preparable = not expanding
+        self.clause: TextClause = text(sql).bindparams(*binds)
+
+        # a new name whenever the text changes so that a hot reloaded query
+        # is prepared again rather than running the old plan
+        digest = hashlib.sha1(sql.encode()).hexdigest()[:8]
+        self.statement_name = f"{_NON_WORD.sub('_', name)}_{digest}"
+        self._execute_clause = text(
+            f"EXECUTE {self.statement_name}"
+            + (f"({', '.join(':' + p for p in self.params)})" if self.params else "")
+        ).bindparams(*binds)
+
+    def _positional_sql(self) -> str:
+        positions = {param: i for i, param in enumerate(self.params, start=1)}
+        sql = self.sql.strip().rstrip(";")
+        return _BIND_PARAM.sub(lambda m: f"${positions[m.group(1)]}", sql)
+
+    def _prepare(self, connection: Connection) -> None:
+        prepared: set[str] = connection.info.setdefault("prepared_statements", set())
+        if self.statement_name not in prepared:
+            connection.exec_driver_sql(
+                f"PREPARE {self.statement_name} AS {self._positional_sql()}"
+            )
+            prepared.add(self.statement_name)
+
+    def execute(
+        self,
+        session: Session,
+        params: dict[str, Any] | None = None,
+        prepare: bool | None = None,
+        **execution_options: Any,
+    ) -> Result:
+        """
+        Runs the query in the session, as a prepared statement on postgres
+        (unless prepare is False or disabled in the settings)
+
+        A prepared statement cannot be read through a server side cursor so
+        stream_results is ignored for those.
+        """
+        connection = session.connection()
+        if prepare is None:
+            prepare = get_settings().prepare_statements
+        if prepare and self.preparable and connection.dialect.name == "postgresql":
+            self._prepare(connection)
+            execution_options.pop("stream_results", None)
+            clause = self._execute_clause
+        else:
+            clause = self.clause
+
+        if execution_options:
+            clause = clause.execution_options(**execution_options)
+        return session.execute(clause, params or {})
+
+    async def execute_async(
+        self, session: AsyncSession, params: dict[str, Any] | None = None
+    ) -> Result:
+        """
+        Runs the query in an async session; asyncpg prepares (and caches)
+        every statement itself so there is no PREPARE/EXECUTE here
+        """
+        return await session.execute(self.clause, params or {})
+
+    async def stream_async(
+        self, session: AsyncSession, params: dict[str, Any] | None = None
+    ) -> AsyncResult:
+        """As execute_async but reading rows from a server side cursor"""
+        return await session.stream(self.clause, params or {})
+
+
+class QueryRegistry:
+    def __init__(self, root: Path = SQL_ROOT, reload: bool = False) -> None:
+        self.root = root
+        self.reload = reload
+        self._queries: dict[Path, tuple[float, SQLQuery]] = {}
+
+    def get(self, path: Path) -> SQLQuery:
+        path = Path(path).resolve()
+        cached = self._queries.get(path)
+        if cached is not None and not self.reload:
+            return cached[1]
+
+        mtime = path.stat().st_mtime
+        if cached is None or cached[0] != mtime:
+            name = path.relative_to(self.root).with_suffix("").as_posix()
+            cached = (mtime, SQLQuery(name, path.read_text()))
+            self._queries[path] = cached
+        return cached[1]
+
+    def preload(self) -> int:
+        """Compile every .sql file under the root, returning how many"""
+        paths = sorted(self.root.rglob("*.sql"))
+        for path in paths:
+            self.get(path)
+        return len(paths)
+
+
+@lru_cache()
+def get_query_registry() -> QueryRegistry:
+    return QueryRegistry(reload=get_settings().debug)
+
+
+def get_query(path: Path) -> SQLQuery:
+    return get_query_registry().get(path)
@@ -0,0 +1,165 @@
+"""
+Stale-while-revalidate caching of slow async loads, and the pooled httpx
+client they usually go through
+
+StaleCache holds the last value loaded for each key. A value older than
+the TTL is still served whilst a new one is loaded in the background, so
+only a key never loaded (or invalidated, or older than max_stale) makes the
+caller wait, and then every caller waiting on the key shares one load.
+
+LoopClient keeps one keep-alive httpx.AsyncClient for the event loop it is
+used on, rebuilding it (and closing the old one) when that loop changes,
+as it does e.g. for every request of the TestClient.
+"""
+import asyncio
+import math
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+import httpx
+
+from api.logger import logger
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+async def _close_quietly(client: httpx.AsyncClient) -> None:
+    """
+    Close a client that was used on another (possibly closed) event loop;
+    connections that can no longer be closed cleanly are just dropped
+    """
+    try:
+        await client.aclose()
+    except Exception as e:
+        logger.debug(f"Discarding client of {client.base_url}: {e!r}")
+
+
+class LoopClient:
+    """
+    A pooled client made by make() for the running event loop
+
+    make() is called again on a new loop so is also the place to build
+    anything else bound to the loop (e.g. a semaphore).
+    """
+
+    def __init__(self, make: Callable[[], httpx.AsyncClient]) -> None:
+        self._make = make
+        self._client: httpx.AsyncClient | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # clients left behind by a previous event loop, being closed
+        self._closing: set[asyncio.Task] = set()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            if self._client is not None and not self._client.is_closed:
+                closing = asyncio.create_task(_close_quietly(self._client))
+                self._closing.add(closing)
+                closing.add_done_callback(self._closing.discard)
+            self._client = self._make()
+            self._loop = loop
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    # served past the TTL whilst a refresh ran in the background
+    stale: int = 0
+    errors: int = 0
+    invalidations: int = 0
+
+
+class StaleCache(Generic[K, V]):
+    def __init__(self, name: str, ttl: float, max_stale: float = math.inf) -> None:
+        self.name = name
+        self.ttl = ttl
+        self.max_stale = max_stale
+        # key -> (loaded at, value)
+        self._values: dict[K, tuple[float, V]] = {}
+        self._inflight: dict[K, asyncio.Task] = {}
+        # bumped by invalidate() so a load started before a write is not kept
+        self._generations: dict[K, int] = defaultdict(int)
+        self._stats: dict[K, CacheStats] = defaultdict(CacheStats)
+
+    async def get(self, key: K, load: Callable[[], Awaitable[V]]) -> V:
+        stats = self._stats[key]
+        cached = self._values.get(key)
+        if cached is None or time.monotonic() - cached[0] > self.max_stale:
+            stats.misses += 1
+            # shield so that a client disconnecting does not cancel the load
+            # for everyone else waiting on it
+            return await asyncio.shield(self._refresh(key, load))
+
+        if time.monotonic() - cached[0] > self.ttl:
+            stats.stale += 1
+            self._refresh(key, load).add_done_callback(_retrieve_exception)
+        else:
+            stats.hits += 1
+        return cached[1]
+
+    def peek(self, key: K) -> V | None:
+        """The value held for a key, of any age, without loading it"""
+        cached = self._values.get(key)
+        return None if cached is None else cached[1]
+
+    def keys(self) -> list[K]:
+        return list(self._values)
+
+    def invalidate(self, key: K) -> None:
+        """Drop a key so the next read waits for a fresh value"""
+        self._values.pop(key, None)
+        # a load already running may have read the value before the write
+        self._inflight.pop(key, None)
+        self._generations[key] += 1
+        self._stats[key].invalidations += 1
+
+    def stats(self) -> dict[K, dict]:
+        return {key: asdict(stats) for key, stats in self._stats.items()}
+
+    async def settle(self) -> None:
+        """Wait for the loads in flight e.g. background refreshes in tests"""
+        await asyncio.gather(*self._inflight.values(), return_exceptions=True)
+
+    def _refresh(self, key: K, load: Callable[[], Awaitable[V]]) -> asyncio.Task:
+        """Start a load unless one is already running on this event loop"""
+        task = self._inflight.get(key)
+        if (
+            task is None
+            or task.done()
+            or task.get_loop() is not asyncio.get_running_loop()
+        ):
+            # the generation is taken now as the task may only start after
+            # an invalidate()
+            task = asyncio.create_task(self._load(key, load, self._generations[key]))
+            self._inflight[key] = task
+        return task
+
+    async def _load(
+        self, key: K, load: Callable[[], Awaitable[V]], generation: int
+    ) -> V:
+        try:
+            value = await load()
+        except Exception:
+            self._stats[key].errors += 1
+            logger.exception(f"Failed to refresh {self.name} {key!r}")
+            raise
+        if self._generations[key] == generation:
+            self._values[key] = (time.monotonic(), value)
+        return value
+
+
+def _retrieve_exception(task: asyncio.Task) -> None:
+    # background refresh failures are already logged in _load
+    if not task.cancelled():
+        task.exception()
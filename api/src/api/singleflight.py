@@ -0,0 +1,51 @@
+"""
+Coalescing of identical concurrent work (single-flight)
+
+The first caller for a key starts the work in a task and any caller with
+the same key arriving before it finishes awaits that same task instead of
+starting its own, so e.g. dozens of browsers opening the sitrep at shift
+change cost one census query rather than dozens. Nothing is kept once the
+task is done; this is not a cache.
+"""
+import asyncio
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Coroutine, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class FlightStats:
+    # calls that started the work
+    executions: int = 0
+    # calls that waited on work started by another
+    coalesced: int = 0
+    errors: int = 0
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._flights: dict[Hashable, asyncio.Task] = {}
+        self._stats = FlightStats()
+
+    async def do(self, key: Hashable, work: Callable[[], Coroutine[Any, Any, T]]) -> T:
+        task = self._flights.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.create_task(work())
+            task.add_done_callback(lambda t: self._land(key, t))
+            self._flights[key] = task
+            self._stats.executions += 1
+        else:
+            self._stats.coalesced += 1
+        # shield so that one caller going away does not cancel the work for
+        # everyone else waiting on it
+        return await asyncio.shield(task)
+
+    def _land(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled() and task.exception() is not None:
+            self._stats.errors += 1
+
+    def stats(self) -> dict:
+        return {**asdict(self._stats), "in_flight": len(self._flights)}
@@ -0,0 +1,96 @@
+"""
+Client for the HyCastle live sitrep and a per-ward cache of its answers
+
+HyCastle can be slow, so every request is bounded by a timeout and goes
+through one pooled keep-alive client. The parsed rows of each ward are
+held in an api.revalidate.StaleCache: a copy older than the TTL is still
+served whilst a new one is fetched in the background, and only a ward
+never fetched (or whose copy is older than max_stale) makes the request
+wait on HyCastle. Only the wards of SITREP_DEPT2WARD_MAPPING are cached.
+"""
+from dataclasses import asdict
+from functools import lru_cache
+
+import httpx
+
+from api.config import Settings, get_settings
+from api.revalidate import CacheStats, LoopClient, StaleCache
+from api.wards import SITREP_DEPT2WARD_MAPPING
+from models.sitrep import SitrepRow
+
+
+class HyCastleException(Exception):
+    pass
+
+
+class HyCastleClient:
+    def __init__(
+        self, settings: Settings, transport: httpx.AsyncBaseTransport | None = None
+    ) -> None:
+        self.url = settings.hycastle_url
+        self.timeout = httpx.Timeout(
+            settings.hycastle_timeout, connect=settings.hycastle_connect_timeout
+        )
+        self._pool = LoopClient(
+            lambda: httpx.AsyncClient(
+                base_url=self.url,
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+                timeout=self.timeout,
+                transport=transport,
+            )
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self._pool.client
+
+    async def aclose(self) -> None:
+        await self._pool.aclose()
+
+    async def get_live_ui(self, ward: str) -> list[SitrepRow]:
+        try:
+            response = await self.client.get(f"/live/icu/{ward}/ui")
+        except httpx.HTTPError as e:
+            raise HyCastleException(f"Failed to get sitrep data for {ward}: {e!r}")
+        if response.status_code != 200:
+            raise HyCastleException(
+                f"Failed to get sitrep data for {ward}: {response.status_code}"
+            )
+
+        body = response.json()
+        rows = body["data"] if isinstance(body, dict) else body
+        return [SitrepRow.parse_obj(row) for row in rows]
+
+
+class SitrepCache:
+    def __init__(self, ttl: float, max_stale: float) -> None:
+        self._wards: StaleCache[str, list[SitrepRow]] = StaleCache(
+            "sitrep", ttl, max_stale
+        )
+
+    async def get(self, ward: str, hycastle: HyCastleClient) -> list[SitrepRow]:
+        # any other ward is passed straight through as caching it would add
+        # an entry for every path asked for
+        if ward not in SITREP_DEPT2WARD_MAPPING.values():
+            return await hycastle.get_live_ui(ward)
+        return await self._wards.get(ward, lambda: hycastle.get_live_ui(ward))
+
+    def stats(self) -> dict:
+        totals = CacheStats()
+        for stats in self._wards.stats().values():
+            for field, value in stats.items():
+                setattr(totals, field, getattr(totals, field) + value)
+        return {**asdict(totals), "wards": sorted(self._wards.keys())}
+
+
+@lru_cache()
+def get_hycastle_client() -> HyCastleClient:
+    return HyCastleClient(get_settings())
+
+
+@lru_cache()
+def get_sitrep_cache() -> SitrepCache:
+    settings = get_settings()
+    return SitrepCache(
+        ttl=settings.hycastle_cache_ttl, max_stale=settings.hycastle_max_stale
+    )
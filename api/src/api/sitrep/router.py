@@ -1,17 +1,23 @@
+import asyncio
 import warnings
 from datetime import date, datetime
 from pathlib import Path
 from urllib.parse import urlencode
 
-import requests
-from fastapi import APIRouter, Depends, Response
+from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import RedirectResponse
 from sqlalchemy import create_engine
 from sqlmodel import Session
 
-from api.config import Settings, get_settings
-
-from api.baserow import BaserowDB, get_baserow_db
+from api.baserow import AsyncBaserowDB, get_async_baserow_db
+from api.beds.snapshot import TableSnapshots, get_table_snapshots
+from api.sitrep.hycastle import (
+    HyCastleClient,
+    SitrepCache,
+    get_hycastle_client,
+    get_sitrep_cache,
+)
+from api.wards import SITREP_DEPT2WARD_MAPPING
 
 # TODO: Give sitrep its own CensusRow model so we do not have interdependencies.
 from models.census import CensusRow
@@ -40,21 +46,13 @@ mock_router = APIRouter(prefix="/sitrep")
 
 
 @router.get("/beds/", response_model=list[BedRow])
-def get_beds(
+async def get_beds(
     department: str,
-    baserow: BaserowDB = Depends(get_baserow_db),
+    baserow: AsyncBaserowDB = Depends(get_async_baserow_db),
+    snapshots: TableSnapshots = Depends(get_table_snapshots),
 ) -> list[BedRow]:
-    field_ids = baserow.get_fields("beds")
-
-    department_field_id = field_ids["department"]
-
-    params = {
-        "size": 200,  # The maximum size of a page.
-        "user_field_names": "true",
-        f"filter__field_{department_field_id}__equal": department,
-    }
-
-    rows = baserow.get_rows("beds", params)
+    snapshot = await snapshots.get("beds", baserow)
+    rows = snapshot.catalogue.select_rows(department=[department])
     return [BedRow.parse_obj(row) for row in rows]
 
 
@@ -106,34 +104,63 @@ def get_mock_live_ui(ward: str) -> list[SitrepRow]:
         return [SitrepRow.parse_obj(row) for row in result]
 
 
-@router.get("/live/{ward}/ui/", response_model=list[SitrepRow])
-def get_live_ui(
-    response: Response, ward: str, settings: Settings = Depends(get_settings)
+@mock_router.get("/live/ui/", response_model=dict[str, list[SitrepRow]])
+def get_mock_live_icus_ui() -> dict[str, list[SitrepRow]]:
+    return {ward: get_mock_live_ui(ward) for ward in SITREP_DEPT2WARD_MAPPING.values()}
+
+
+async def _live_ui(
+    ward: str, hycastle: HyCastleClient, cache: SitrepCache
 ) -> list[SitrepRow]:
-    response = requests.get(f"{settings.hycastle_url}/live/icu/{ward}/ui")
-    if response.status_code != 200:
+    try:
+        return await cache.get(ward, hycastle)
+    except Exception:
+        # already logged by the cache
         warnings.warn(f"Failed to get sitrep data for {ward}")
-        print(repr(response))
         return []
-    try:
-        rows = response.json()["data"]
-    except KeyError:
-        rows = response.json()
-    return [SitrepRow.parse_obj(row) for row in rows]
+
+
+@router.get("/live/{ward}/ui/", response_model=list[SitrepRow])
+async def get_live_ui(
+    ward: str,
+    hycastle: HyCastleClient = Depends(get_hycastle_client),
+    cache: SitrepCache = Depends(get_sitrep_cache),
+) -> list[SitrepRow]:
+    return await _live_ui(ward, hycastle, cache)
+
+
+@router.get("/live/ui/", response_model=dict[str, list[SitrepRow]])
+async def get_live_icus_ui(
+    hycastle: HyCastleClient = Depends(get_hycastle_client),
+    cache: SitrepCache = Depends(get_sitrep_cache),
+) -> dict[str, list[SitrepRow]]:
+    """The live sitrep of every ICU (by hycastle ward) fetched concurrently"""
+    wards = list(SITREP_DEPT2WARD_MAPPING.values())
+    rows = await asyncio.gather(*(_live_ui(ward, hycastle, cache) for ward in wards))
+    return dict(zip(wards, rows))
+
+
+@router.get("/live/stats/")
+def get_live_stats(cache: SitrepCache = Depends(get_sitrep_cache)) -> dict:
+    return cache.stats()
 
 
 @router.patch("/beds")
-def update_bed_row(
-    table_id: int, row_id: int, data: dict, settings: Settings = Depends(get_settings)
-) -> None:
-    url = f"{settings.baserow_url}/api/database/rows/table/{table_id}/"
-
-    # TODO: Need to get working.
-    requests.patch(
-        url=f"{url}{row_id}/?user_field_names=true",
-        headers={
-            "Authorization": f"Token {settings.BASEROW_READWRITE_TOKEN}",
-            "Content-Type": "application/json",
-        },
-        json=data,
-    )
+async def update_bed_row(
+    row_id: int,
+    data: dict,
+    table_id: int | None = None,
+    baserow: AsyncBaserowDB = Depends(get_async_baserow_db),
+    snapshots: TableSnapshots = Depends(get_table_snapshots),
+) -> dict:
+    """
+    Updates a row of the beds table; table_id, which callers used to have to
+    pass, is still accepted but must be that of the beds table
+    """
+    if table_id is not None and table_id != baserow.schema.table_id("beds"):
+        raise HTTPException(
+            status_code=422, detail=f"Table {table_id} is not the beds table"
+        )
+    row: dict = await baserow.patch_row("beds", row_id, data)
+    snapshots.invalidate("beds")
+    return row
@@ -0,0 +1,151 @@
+"""
+Streamed alternatives to returning a list of models from a route
+
+Rows are serialised as they are produced so neither the full list of
+models nor the full response body is ever held in memory. Clients opt in
+with ?format=ndjson (one JSON object per line) or ?format=arrow (an Arrow
+IPC stream of record batches).
+"""
+import io
+from datetime import date, datetime
+from enum import Enum
+from itertools import islice
+from typing import AsyncIterable, AsyncIterator, Generator, Iterable, Iterator
+
+import orjson
+import pyarrow as pa
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+# rows serialised per chunk written to the response
+BATCH_SIZE = 1000
+
+_ARROW_TYPES = {
+    bool: pa.bool_(),
+    int: pa.int64(),
+    float: pa.float64(),
+    str: pa.string(),
+    datetime: pa.timestamp("us", tz="UTC"),
+    date: pa.date32(),
+}
+
+
+class ResponseFormat(str, Enum):
+    json = "json"
+    ndjson = "ndjson"
+    arrow = "arrow"
+
+
+def _batches(rows: Iterable[BaseModel], size: int) -> Iterator[list[dict]]:
+    iterator = iter(rows)
+    while batch := [row.dict() for row in islice(iterator, size)]:
+        yield batch
+
+
+async def _abatches(
+    rows: AsyncIterable[BaseModel], size: int
+) -> AsyncIterator[list[dict]]:
+    batch = []
+    async for row in rows:
+        batch.append(row.dict())
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def arrow_schema(model: type[BaseModel]) -> pa.Schema:
+    """Map the fields of a (flat) pydantic model onto an arrow schema"""
+    return pa.schema(
+        [
+            pa.field(name, _ARROW_TYPES.get(field.type_, pa.string()))
+            for name, field in model.__fields__.items()
+        ]
+    )
+
+
+def _ndjson_chunk(batch: list[dict]) -> bytes:
+    return b"".join(orjson.dumps(row) + b"\n" for row in batch)
+
+
+class _ArrowWriter:
+    """Writes batches to an Arrow IPC stream, handing back the bytes of each"""
+
+    def __init__(self, model: type[BaseModel]) -> None:
+        self.schema = arrow_schema(model)
+        self.sink = io.BytesIO()
+        self.writer = pa.ipc.new_stream(self.sink, self.schema)
+
+    def _flush(self) -> bytes:
+        chunk = self.sink.getvalue()
+        self.sink.seek(0)
+        self.sink.truncate()
+        return chunk
+
+    def write(self, batch: list[dict]) -> bytes:
+        self.writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=self.schema))
+        return self._flush()
+
+    def close(self) -> bytes:
+        # end of stream marker
+        self.writer.close()
+        return self._flush()
+
+
+def iter_ndjson(
+    rows: Iterable[BaseModel], batch_size: int = BATCH_SIZE
+) -> Generator[bytes, None, None]:
+    for batch in _batches(rows, batch_size):
+        yield _ndjson_chunk(batch)
+
+
+async def aiter_ndjson(
+    rows: AsyncIterable[BaseModel], batch_size: int = BATCH_SIZE
+) -> AsyncIterator[bytes]:
+    async for batch in _abatches(rows, batch_size):
+        yield _ndjson_chunk(batch)
+
+
+def iter_arrow(
+    rows: Iterable[BaseModel],
+    model: type[BaseModel],
+    batch_size: int = BATCH_SIZE,
+) -> Generator[bytes, None, None]:
+    writer = _ArrowWriter(model)
+    for batch in _batches(rows, batch_size):
+        yield writer.write(batch)
+    yield writer.close()
+
+
+async def aiter_arrow(
+    rows: AsyncIterable[BaseModel],
+    model: type[BaseModel],
+    batch_size: int = BATCH_SIZE,
+) -> AsyncIterator[bytes]:
+    writer = _ArrowWriter(model)
+    async for batch in _abatches(rows, batch_size):
+        yield writer.write(batch)
+    yield writer.close()
+
+
+def stream_rows(
+    rows: Iterable[BaseModel] | AsyncIterable[BaseModel],
+    model: type[BaseModel],
+    format: ResponseFormat,
+) -> StreamingResponse:
+    """Stream rows from either a plain or an async iterable"""
+    chunks: Iterator[bytes] | AsyncIterator[bytes]
+    if format == ResponseFormat.arrow:
+        media_type = "application/vnd.apache.arrow.stream"
+        if isinstance(rows, AsyncIterable):
+            chunks = aiter_arrow(rows, model)
+        else:
+            chunks = iter_arrow(rows, model)
+    else:
+        media_type = "application/x-ndjson"
+        if isinstance(rows, AsyncIterable):
+            chunks = aiter_ndjson(rows)
+        else:
+            chunks = iter_ndjson(rows)
+    return StreamingResponse(chunks, media_type=media_type)
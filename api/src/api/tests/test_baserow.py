@@ -0,0 +1,526 @@
+# type: ignore
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi import HTTPException, Request, Response
+
+from api.baserow import AsyncBaserowDB, BaserowException, BaserowSession
+from api.beds.router import get_beds, get_campus, get_closed_beds, patch_beds
+from api.beds.snapshot import TableSnapshots
+from api.config import get_settings
+from api.sitrep.router import update_bed_row
+from api.wards import CAMPUSES
+from models.beds import BedUpdate
+
+TABLES = {
+    "beds": {
+        "id": 1,
+        "name": "beds",
+        "fields": {"department": 10, "location_string": 11},
+    }
+}
+FIELD_NAMES = {f"field_{v}": k for k, v in TABLES["beds"]["fields"].items()}
+
+
+def _filter_rows(rows: list[dict], params: httpx.QueryParams) -> list[dict]:
+    """Apply baserow style filter__field_{id}__equal params"""
+    filters = [
+        (FIELD_NAMES[key.split("__")[1]], value)
+        for key, value in params.multi_items()
+        if key.startswith("filter__")
+    ]
+    if not filters:
+        return rows
+    match = any if params.get("filter_type") == "OR" else all
+    return [row for row in rows if match(row.get(f) == v for f, v in filters)]
+
+
+def _stub_baserow(rows: list[dict], calls: list[httpx.Request]) -> httpx.MockTransport:
+    """A minimal stand in for the baserow list rows endpoint"""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        matched = _filter_rows(rows, request.url.params)
+        page = int(request.url.params.get("page", 1))
+        size = int(request.url.params.get("size", 100))
+        start = (page - 1) * size
+        results = matched[start : start + size]
+        more = start + size < len(matched)
+        body = {
+            "count": len(matched),
+            "next": f"{request.url}&page={page + 1}" if more else None,
+            "previous": None,
+            "results": results,
+        }
+        return httpx.Response(200, content=json.dumps(body))
+
+    return httpx.MockTransport(handler)
+
+
+def _request(headers: dict[str, str] | None = None) -> Request:
+    raw = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    return Request({"type": "http", "headers": raw})
+
+
+def _baserow(rows: list[dict], calls: list) -> AsyncBaserowDB:
+    return AsyncBaserowDB(
+        settings=get_settings(),
+        database_token="token",
+        tables_dict=TABLES,
+        transport=_stub_baserow(rows, calls),
+    )
+
+
+def test_async_get_rows_fetches_all_pages() -> None:
+    rows = [{"id": i, "order": i} for i in range(450)]
+    calls: list = []
+
+    result = asyncio.run(_baserow(rows, calls).get_rows("beds", {"size": 200}))
+
+    assert [row["id"] for row in result] == list(range(450))
+    assert sorted(int(call.url.params["page"]) for call in calls) == [1, 2, 3]
+
+
+def test_async_get_rows_single_page() -> None:
+    rows = [{"id": i, "order": i} for i in range(20)]
+    calls: list = []
+
+    result = asyncio.run(_baserow(rows, calls).get_rows("beds", {"size": 200}))
+
+    assert len(result) == 20
+    assert len(calls) == 1
+
+
+def test_async_client_is_closed_when_the_loop_changes() -> None:
+    baserow = _baserow([{"id": 1, "order": 1}], [])
+
+    async def _request() -> object:
+        await baserow.get_rows("beds", {"size": 200})
+        return baserow._pool._client
+
+    first = asyncio.run(_request())
+
+    async def _request_and_settle() -> object:
+        await baserow.get_rows("beds", {"size": 200})
+        await asyncio.gather(*baserow._pool._closing)
+        return baserow._pool._client
+
+    second = asyncio.run(_request_and_settle())
+
+    assert second is not first
+    assert first.is_closed and not second.is_closed
+
+
+def _beds(n_per_department: int) -> list[dict]:
+    departments = CAMPUSES["UCH"] + CAMPUSES["GWB"]
+    return [
+        {
+            "id": i * n_per_department + j,
+            "order": 1,
+            "department": department,
+            "location_string": f"{department}^ROOM^{j}",
+        }
+        for i, department in enumerate(departments)
+        for j in range(n_per_department)
+    ] + [
+        # a bed missing its department (see wards.MISSING_DEPARTMENT_LOCATIONS)
+        {
+            "id": -1,
+            "order": 1,
+            "department": None,
+            "location_string": "T06C^T06C BY08^BY08-36",
+        }
+    ]
+
+
+def test_get_campus_is_one_scan() -> None:
+    calls: list = []
+    baserow = _baserow(_beds(2), calls)
+
+    beds = asyncio.run(
+        get_campus(
+            _request(),
+            Response(),
+            campuses=["UCH"],
+            baserow=baserow,
+            snapshots=TableSnapshots(300),
+        )
+    )
+
+    assert len(calls) == 1
+    assert len(beds) == 2 * len(CAMPUSES["UCH"]) + 1
+    assert {bed.department for bed in beds} == set(CAMPUSES["UCH"]) | {None}
+
+
+def test_get_beds_departments_and_locations_is_one_scan() -> None:
+    calls: list = []
+    baserow = _baserow(_beds(2), calls)
+    departments = list(CAMPUSES["GWB"][:3])
+    locations = [f"{CAMPUSES['UCH'][0]}^ROOM^0"]
+
+    beds = asyncio.run(
+        get_beds(
+            _request(),
+            Response(),
+            departments=departments,
+            locations=locations,
+            baserow=baserow,
+            snapshots=TableSnapshots(300),
+        )
+    )
+
+    assert len(calls) == 1
+    assert len(beds) == 2 * len(departments) + 1
+
+
+def test_get_beds_without_filters_returns_everything() -> None:
+    calls: list = []
+    rows = _beds(2)
+    baserow = _baserow(rows, calls)
+
+    beds = asyncio.run(
+        get_beds(
+            _request(),
+            Response(),
+            departments=[],
+            locations=[],
+            baserow=baserow,
+            snapshots=TableSnapshots(300),
+        )
+    )
+
+    assert len(beds) == len(rows)
+    assert "filter_type" not in calls[0].url.params
+
+
+def test_unchanged_beds_are_not_sent_again() -> None:
+    rows = _beds(2)
+    baserow = _baserow(rows, [])
+    snapshots = TableSnapshots(ttl=300)
+
+    async def _get_closed_beds(headers: dict[str, str]) -> tuple:
+        response = Response()
+        beds = await get_closed_beds(
+            _request(headers), response, baserow=baserow, snapshots=snapshots
+        )
+        return beds, response
+
+    async def _requests() -> tuple:
+        _, first = await _get_closed_beds({})
+        etag = first.headers["ETag"]
+        not_modified, _ = await _get_closed_beds({"If-None-Match": etag})
+
+        rows[0]["closed"] = True
+        snapshots.invalidate("beds")
+        changed, response = await _get_closed_beds({"If-None-Match": etag})
+        return etag, not_modified, changed, response
+
+    etag, not_modified, changed, response = asyncio.run(_requests())
+
+    assert not_modified.status_code == 304
+    assert not_modified.headers["ETag"] == etag
+    assert [bed.id for bed in changed] == [rows[0]["id"]]
+    assert response.headers["ETag"] != etag
+
+
+def test_snapshot_serves_filters_from_one_load() -> None:
+    calls: list = []
+    baserow = _baserow(_beds(2), calls)
+    snapshots = TableSnapshots(ttl=300)
+
+    async def _requests() -> None:
+        for campus in ("UCH", "GWB", "UCH"):
+            await get_campus(
+                _request(),
+                Response(),
+                campuses=[campus],
+                baserow=baserow,
+                snapshots=snapshots,
+            )
+
+    asyncio.run(_requests())
+
+    assert len(calls) == 1
+    stats = snapshots.stats()["beds"]
+    assert (stats["misses"], stats["hits"], stats["refreshes"]) == (1, 2, 1)
+
+
+def test_snapshot_invalidate_forces_reload() -> None:
+    calls: list = []
+    baserow = _baserow(_beds(2), calls)
+    snapshots = TableSnapshots(ttl=300)
+
+    async def _requests() -> None:
+        await snapshots.get("beds", baserow)
+        snapshots.invalidate("beds")
+        await snapshots.get("beds", baserow)
+
+    asyncio.run(_requests())
+
+    assert len(calls) == 2
+    assert snapshots.stats()["beds"]["version"] == 2
+
+
+def test_snapshot_invalidate_during_load_starts_a_new_load() -> None:
+    calls: list = []
+    baserow = _baserow(_beds(2), calls)
+    snapshots = TableSnapshots(ttl=300)
+
+    async def _requests() -> tuple:
+        before = asyncio.create_task(snapshots.get("beds", baserow))
+        await asyncio.sleep(0)  # the first load is now in flight
+        snapshots.invalidate("beds")
+        after = await snapshots.get("beds", baserow)
+        return await before, after
+
+    before, after = asyncio.run(_requests())
+
+    assert len(calls) == 2
+    assert after.version > before.version
+
+
+def test_update_bed_row_patches_and_invalidates_beds() -> None:
+    calls: list = []
+    rows = _beds(2)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        if request.method == "PATCH":
+            return httpx.Response(200, content=json.dumps({"id": 3, "closed": True}))
+        return _stub_baserow(rows, []).handle_request(request)
+
+    baserow = AsyncBaserowDB(
+        settings=get_settings(),
+        database_token="token",
+        tables_dict=TABLES,
+        transport=httpx.MockTransport(handler),
+    )
+    snapshots = TableSnapshots(ttl=300)
+
+    async def _requests() -> dict:
+        await snapshots.get("beds", baserow)
+        # table_id as older callers still pass it
+        row = await update_bed_row(
+            row_id=3,
+            data={"closed": True},
+            table_id=1,
+            baserow=baserow,
+            snapshots=snapshots,
+        )
+        await snapshots.get("beds", baserow)
+        return row
+
+    row = asyncio.run(_requests())
+
+    assert row == {"id": 3, "closed": True}
+    patch = calls[1]
+    assert (patch.method, patch.url.path) == ("PATCH", "/api/database/rows/table/1/3/")
+    assert patch.url.params["user_field_names"] == "true"
+    assert json.loads(patch.content) == {"closed": True}
+    # the next read reloads rather than serving the pre-write snapshot
+    assert [call.method for call in calls] == ["GET", "PATCH", "GET"]
+    assert snapshots.stats()["beds"]["invalidations"] == 1
+
+
+def test_update_bed_row_rejects_other_tables() -> None:
+    baserow = _baserow(_beds(2), [])
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(
+            update_bed_row(
+                row_id=3,
+                data={"closed": True},
+                table_id=2,
+                baserow=baserow,
+                snapshots=TableSnapshots(ttl=300),
+            )
+        )
+
+    assert e.value.status_code == 422
+
+
+def test_patch_beds_batches_and_invalidates_once() -> None:
+    calls: list = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        items = json.loads(request.content)["items"]
+        return httpx.Response(200, content=json.dumps({"items": items}))
+
+    baserow = AsyncBaserowDB(
+        settings=get_settings(),
+        database_token="token",
+        tables_dict=TABLES,
+        transport=httpx.MockTransport(handler),
+    )
+    snapshots = TableSnapshots(ttl=300)
+    updates = [BedUpdate(id=i, closed=True) for i in range(450)]
+
+    rows = asyncio.run(patch_beds(updates, baserow=baserow, snapshots=snapshots))
+
+    assert rows == [{"id": i, "closed": True} for i in range(450)]
+    assert {(call.method, call.url.path) for call in calls} == {
+        ("PATCH", "/api/database/rows/table/1/batch/")
+    }
+    assert sorted(len(json.loads(call.content)["items"]) for call in calls) == [
+        50,
+        200,
+        200,
+    ]
+    assert snapshots.stats()["beds"]["invalidations"] == 1
+
+
+def test_snapshot_serves_stale_while_refreshing() -> None:
+    calls: list = []
+    baserow = _baserow(_beds(2), calls)
+    snapshots = TableSnapshots(ttl=0)
+
+    async def _requests() -> tuple:
+        first = await snapshots.get("beds", baserow)
+        stale = await snapshots.get("beds", baserow)
+        await asyncio.sleep(0.01)  # let the background refresh finish
+        return first, stale
+
+    first, stale = asyncio.run(_requests())
+
+    assert stale is first
+    assert len(calls) == 2
+    assert snapshots.stats()["beds"]["stale"] == 1
+
+
+def _stub_baserow_admin(calls: list[httpx.Request]) -> httpx.MockTransport:
+    """Just enough of the baserow admin API to bootstrap a session"""
+    responses = {
+        "/api/user/token-auth/": {"access_token": "a1", "refresh_token": "r1"},
+        "/api/user/token-refresh/": {"access_token": "a2"},
+        "/api/groups/": [{"id": 7, "name": "hyui"}],
+        "/api/database/tokens/": [{"group": 7, "key": "db-token"}],
+        "/api/applications/": [
+            {"id": 3, "name": get_settings().baserow_application_name}
+        ],
+        "/api/database/tables/database/3/": [
+            {"id": 1, "name": "beds"},
+            {"id": 2, "name": "rooms"},
+        ],
+        "/api/database/fields/table/1/": [{"id": 10, "name": "department"}],
+        "/api/database/fields/table/2/": [{"id": 20, "name": "hl7_room"}],
+    }
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(200, content=json.dumps(responses[request.url.path]))
+
+    return httpx.MockTransport(handler)
+
+
+def test_baserow_session_bootstrap_and_refresh() -> None:
+    calls: list = []
+    session = BaserowSession(get_settings(), transport=_stub_baserow_admin(calls))
+
+    async def _bootstrap() -> None:
+        await session.ready()
+        # the access token is refreshed, not re-fetched by logging in again
+        async with httpx.AsyncClient(
+            base_url="http://baserow", transport=session._transport
+        ) as client:
+            await session._refresh_access_token(client)
+        await session.stop()
+
+    asyncio.run(_bootstrap())
+
+    assert session.database.database_token == "db-token"
+    assert session.database.tables_dict["beds"]["fields"] == {"department": 10}
+    assert session.database.tables_dict["rooms"]["id"] == 2
+    assert session.access_token == "a2"
+    paths = [call.url.path for call in calls]
+    assert paths.count("/api/user/token-auth/") == 1
+    assert paths[-1] == "/api/user/token-refresh/"
+
+
+def test_baserow_session_bootstrap_failure_is_raised_by_ready() -> None:
+    settings = get_settings().copy(update={"baserow_retries": 1})
+    session = BaserowSession(
+        settings, transport=httpx.MockTransport(lambda _: httpx.Response(503))
+    )
+
+    async def _bootstrap() -> asyncio.Task:
+        with pytest.raises(BaserowException):
+            await session.ready()
+        await asyncio.sleep(0)
+        return session._task
+
+    task = asyncio.run(_bootstrap())
+
+    # the failure is only surfaced to the waiters, not left on the task
+    assert task.done() and task.exception() is None
+
+
+def test_baserow_session_survives_failed_refresh() -> None:
+    calls: list = []
+    healthy = _stub_baserow_admin(calls)
+    down = False
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if down:
+            calls.append(request)
+            return httpx.Response(503)
+        return healthy.handle_request(request)
+
+    settings = get_settings().copy(update={"baserow_retries": 1})
+    session = BaserowSession(settings, transport=httpx.MockTransport(handler))
+    session.access_token_lifetime = 0.01
+    session.refresh_margin = 0
+
+    async def _bootstrap_then_fail() -> bool:
+        nonlocal down
+        await session.ready()
+        down = True
+        await asyncio.sleep(0.1)
+        alive = not session._task.done()
+        await session.stop()
+        return alive
+
+    assert asyncio.run(_bootstrap_then_fail())
+    assert session.database.database_token == "db-token"
+    assert "/api/user/token-refresh/" in [call.url.path for call in calls]
+
+
+def test_renamed_field_refreshes_schema_and_retries() -> None:
+    calls: list = []
+    # the department field was recreated in baserow so has a new id
+    current_fields = [{"id": 99, "name": "department"}]
+    rows = [{"id": 1, "order": 1, "department": "A"}, {"id": 2, "department": "B"}]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        if request.url.path == "/api/database/fields/table/1/":
+            return httpx.Response(200, content=json.dumps(current_fields))
+        if "filter__field_10__equal" in request.url.params:
+            error = {"error": "ERROR_FILTER_FIELD_NOT_FOUND", "detail": "field 10"}
+            return httpx.Response(400, content=json.dumps(error))
+        value = request.url.params["filter__field_99__equal"]
+        results = [row for row in rows if row["department"] == value]
+        body = {"count": len(results), "next": None, "results": results}
+        return httpx.Response(200, content=json.dumps(body))
+
+    baserow = AsyncBaserowDB(
+        settings=get_settings(),
+        database_token="token",
+        tables_dict={"beds": {"id": 1, "name": "beds", "fields": {"department": 10}}},
+        transport=httpx.MockTransport(handler),
+    )
+
+    async def _requests() -> tuple:
+        filters = [("department", "equal", "B")]
+        first = await baserow.get_rows("beds", {"size": 200}, filters=filters)
+        second = await baserow.get_rows("beds", {"size": 200}, filters=filters)
+        return first, second
+
+    first, second = asyncio.run(_requests())
+
+    assert [row["id"] for row in first] == [row["id"] for row in second] == [2]
+    assert baserow.schema.get("beds") == {"department": 99}
+    # failed query, fields, retried query then the second query straight away
+    assert len(calls) == 4
@@ -1,7 +1,9 @@
 # type: ignore
 from fastapi.testclient import TestClient
 
+from api.beds.catalogue import BedCatalogue
 from api.main import app
+from api.wards import CAMPUSES
 from models.beds import Bed
 
 client = TestClient(app)
@@ -22,3 +24,32 @@ def test_get_mock_beds() -> None:
     assert response.status_code == 200
     beds = [Bed.parse_obj(row) for row in response.json()]
     assert len(beds) > 0
+
+
+def test_get_mock_campus() -> None:
+    response = client.get(url="/mock/baserow/campus/", params={"campuses": "UCH"})
+    assert response.status_code == 200
+    beds = [Bed.parse_obj(row) for row in response.json()]
+    assert len(beds) > 0
+    assert {bed.department for bed in beds} <= set(CAMPUSES["UCH"])
+
+
+def test_bed_catalogue_select() -> None:
+    rows = [
+        {"id": 1, "department": "A", "location_string": "A^1", "hl7_room": "R1"},
+        {"id": 2, "department": "B", "location_string": "B^1", "hl7_room": "R1"},
+        {"id": 3, "department": None, "location_string": "T06C^T06C BY08^BY08-36"},
+        {"id": 4, "department": "UCH T06 CENTRAL (T06C)", "location_string": "C^1"},
+    ]
+    catalogue = BedCatalogue(rows)
+
+    def ids(beds: list) -> list:
+        return [bed.id for bed in beds]
+
+    assert ids(catalogue.select()) == [1, 2, 3, 4]
+    assert ids(catalogue.select(department=["B", "A"])) == [1, 2]
+    assert ids(catalogue.select(department=["A"], location_string=["B^1"])) == [1, 2]
+    assert ids(catalogue.select(hl7_room=["R1"])) == [1, 2]
+    assert ids(catalogue.select(department=["Z"])) == []
+    # campus includes the location missing its department
+    assert ids(catalogue.select(campus=["UCH"])) == [3, 4]
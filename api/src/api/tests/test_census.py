@@ -1,16 +1,38 @@
 # type: ignore
+import asyncio
+from datetime import datetime, timedelta
+
+import orjson
 import pandas as pd
+import pyarrow as pa
 
 from api import wards
-from api.census.router import _fetch_mock_census
+from api.census.router import (
+    MOCK_DB,
+    MOCK_QUERY,
+    _aiter_census,
+    _fetch_mock_census,
+    _models_frame,
+    _read_census_frame,
+    _shared_census,
+)
+from api.census.fragments import CensusFragments
+from api.census.snapshot import CensusSnapshot
+from api.config import get_settings
+from api.singleflight import SingleFlight
+from api.streaming import aiter_ndjson
 from api.census.wrangle import (
     aggregate_by_department,
     _aggregate_by_department,
     _split_location_string,
     _remove_non_beds,
+    typed_frame,
 )
 from api.main import app
 from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import Session
 
 from models.census import CensusDepartment, CensusRow
 
@@ -22,6 +44,98 @@ def test_fetch_mock_census() -> None:
     assert len(census_rows) > 0
 
 
+def test_aiter_census_streams_from_the_cursor() -> None:
+    departments = ["UCH T03 INTENSIVE CARE"]
+
+    async def stream() -> bytes:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{MOCK_DB}")
+        try:
+            rows = _aiter_census(engine, MOCK_QUERY, departments, [])
+            return b"".join([chunk async for chunk in aiter_ndjson(rows)])
+        finally:
+            await engine.dispose()
+
+    ndjson = asyncio.run(stream())
+
+    assert [
+        CensusRow.parse_obj(orjson.loads(line)) for line in ndjson.splitlines()
+    ] == (_fetch_mock_census(departments, []))
+
+
+def _reversed(items: list) -> list:
+    return items[::-1]
+
+
+def test_shared_census_coalesces_identical_requests() -> None:
+    departments = ["UCH T03 INTENSIVE CARE", "UCH T06 CENTRAL (T06C)"]
+    flights, fragments = SingleFlight(), CensusFragments(ttl=60)
+
+    async def fetch_concurrently() -> list[list[CensusRow]]:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{MOCK_DB}")
+        try:
+            return await asyncio.gather(
+                *(
+                    _shared_census(
+                        flights, fragments, engine, MOCK_QUERY, order(departments), []
+                    )
+                    for order in (list, _reversed, list, sorted)
+                )
+            )
+        finally:
+            await engine.dispose()
+
+    results = asyncio.run(fetch_concurrently())
+
+    expected = sorted(
+        _fetch_mock_census(departments, []), key=lambda row: row.location_string
+    )
+    assert all(rows == expected for rows in results)
+    assert flights.stats() == {
+        "executions": 1,
+        "coalesced": 3,
+        "errors": 0,
+        "in_flight": 0,
+    }
+
+
+def test_census_fragments_fetch_only_missing_departments() -> None:
+    flights, fragments = SingleFlight(), CensusFragments(ttl=60)
+    icu, campus = ["UCH T03 INTENSIVE CARE"], list(wards.TOWER)
+    location = "T06C^T06C BY08^BY08-36"
+
+    async def fetch(departments, locations) -> list[CensusRow]:
+        return await _shared_census(
+            flights, fragments, engine, MOCK_QUERY, departments, locations
+        )
+
+    async def fetch_overlapping() -> list[list[CensusRow]]:
+        nonlocal engine
+        engine = create_async_engine(f"sqlite+aiosqlite:///{MOCK_DB}")
+        try:
+            return [
+                await fetch(icu, []),
+                await fetch(campus, []),
+                await fetch(list(wards.ALL), []),
+                await fetch(icu, [location]),
+            ]
+        finally:
+            await engine.dispose()
+
+    engine = None
+    results = asyncio.run(fetch_overlapping())
+
+    for (departments, locations), rows in zip(
+        [(icu, []), (campus, []), (list(wards.ALL), []), (icu, [location])], results
+    ):
+        expected = _fetch_mock_census(departments, locations)
+        assert rows == sorted(expected, key=lambda row: row.location_string)
+    # the ICU is fetched once, then the rest of the tower, then the other
+    # campuses and finally the one location not yet asked for on its own
+    assert flights.stats()["executions"] == 4
+    assert fragments.stats()["misses"] == len(wards.ALL) + 1
+    assert fragments.stats()["hits"] == 1 + len(wards.TOWER) + 1
+
+
 def test_aggregate_by_department() -> None:
     census_rows = _fetch_mock_census(list(wards.ALL), [])
 
@@ -52,6 +166,42 @@ def test_get_mock_departments() -> None:
     assert len(census_departments) > 0
 
 
+def test_get_mock_departments_validates_when_asked() -> None:
+    fast = client.get("/mock/census/departments").json()
+
+    settings = get_settings().copy(update={"validate_responses": True})
+    app.dependency_overrides[get_settings] = lambda: settings
+    try:
+        validated = client.get("/mock/census/departments").json()
+    finally:
+        app.dependency_overrides.clear()
+
+    assert fast == validated
+
+
+def test_typed_frame_uses_model_types() -> None:
+    df = typed_frame(
+        [(1, "2022-07-18 12:00:00", None, 1), (2, None, 3, 0)],
+        ["location_id", "modified_at", "open_visits_n", "occupied"],
+        CensusRow,
+    )
+
+    assert str(df["modified_at"].dtype) == "datetime64[ns, UTC]"
+    assert str(df["open_visits_n"].dtype) == "Int64"
+    assert df["occupied"].tolist() == [True, False]
+
+
+def test_models_frame_matches_the_sql_frame() -> None:
+    engine = create_engine(f"sqlite:///{MOCK_DB}", future=True)
+    with Session(engine) as session:
+        sql_df = _read_census_frame(session, MOCK_QUERY, list(wards.ALL), [])
+    models_df = _models_frame(_fetch_mock_census(list(wards.ALL), []))
+
+    columns = [name for name in CensusRow.__fields__ if name in sql_df.columns]
+    assert models_df[columns].dtypes.equals(sql_df[columns].dtypes)
+    assert len(models_df) == len(sql_df)
+
+
 def test_get_mock_census() -> None:
     response = client.get(
         "/mock/census/", params={"departments": "UCH T03 INTENSIVE CARE"}
@@ -60,3 +210,126 @@ def test_get_mock_census() -> None:
 
     census_rows = [CensusRow.parse_obj(row) for row in response.json()]
     assert len(census_rows) > 0
+
+
+def test_get_mock_census_ndjson_matches_json() -> None:
+    params = {"departments": "UCH T03 INTENSIVE CARE"}
+    json_rows = client.get("/mock/census/", params=params).json()
+
+    response = client.get("/mock/census/", params={**params, "format": "ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    ndjson_rows = [orjson.loads(line) for line in response.content.splitlines()]
+    assert [CensusRow.parse_obj(row) for row in ndjson_rows] == [
+        CensusRow.parse_obj(row) for row in json_rows
+    ]
+
+
+def test_get_mock_census_arrow() -> None:
+    params = {"departments": list(wards.ALL), "format": "arrow"}
+    response = client.get("/mock/census/", params=params)
+    assert response.status_code == 200
+
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.num_rows == len(_fetch_mock_census(list(wards.ALL), []))
+    assert table.schema.names == list(CensusRow.__fields__)
+
+
+class _SyntheticFeed:
+    """A change feed replaying locations pushed onto it"""
+
+    def __init__(self) -> None:
+        self.mark = datetime(2022, 7, 18)
+        self.pending: set[str] = set()
+
+    def high_water_mark(self) -> datetime:
+        return self.mark
+
+    def changes(self, since: datetime) -> tuple[set[str], datetime]:
+        assert since == self.mark
+        changed, self.pending = self.pending, set()
+        if changed:
+            self.mark += timedelta(minutes=1)
+        return changed, self.mark
+
+
+def test_census_snapshot_refreshes_only_changed_locations() -> None:
+    discharged: set[str] = set()
+    calls = []
+
+    def fetch(departments: list[str], locations: list[str]) -> list[CensusRow]:
+        calls.append((departments, locations))
+        rows = _fetch_mock_census(departments, locations)
+        for row in rows:
+            if row.location_string in discharged:
+                row.occupied = False
+                row.mrn = None
+        return rows
+
+    feed = _SyntheticFeed()
+    snapshot = CensusSnapshot(fetch, feed)
+    snapshot.refresh()
+
+    expected = _fetch_mock_census(list(wards.ALL), [])
+    assert len(snapshot) == len(expected)
+    assert [row.location_string for row in snapshot.select(list(wards.ALL), [])] == (
+        sorted(row.location_string for row in expected)
+    )
+
+    # nothing has changed so nothing is fetched
+    assert snapshot.refresh() == 0
+    assert len(calls) == 1
+
+    department = "UCH T03 INTENSIVE CARE"
+    location = next(
+        row.location_string for row in snapshot.select([department], []) if row.occupied
+    )
+    discharged.add(location)
+    feed.pending.add(location)
+
+    assert snapshot.refresh() == 1
+    assert calls[-1] == ([], [location])
+    assert snapshot.high_water_mark == feed.mark
+
+    (row,) = snapshot.select([], [location])
+    assert not row.occupied and row.mrn is None
+    assert len(snapshot.select([department], [])) == len(
+        _fetch_mock_census([department], [])
+    )
+    # every row is reported as of the latest refresh
+    assert {r.modified_at for r in snapshot.select(list(wards.ALL), [])} == {
+        snapshot.as_of
+    }
+
+
+def test_census_snapshot_ignores_locations_outside_its_departments() -> None:
+    department = "UCH T03 INTENSIVE CARE"
+    feed = _SyntheticFeed()
+    snapshot = CensusSnapshot(_fetch_mock_census, feed, departments=[department])
+    snapshot.refresh()
+    size = len(snapshot)
+
+    other = _fetch_mock_census(["UCH T07 NORTH (T07N)"], [])[0].location_string
+    feed.pending.add(other)
+    snapshot.refresh()
+
+    assert len(snapshot) == size
+    assert snapshot.select([], [other]) == []
+    # so those are to be fetched live
+    assert snapshot.covers([department], [])
+    assert not snapshot.covers(["UCH T07 NORTH (T07N)"], [])
+    assert not snapshot.covers([], [other])
+
+
+def test_census_snapshot_refresh_leaves_rows_already_read_alone() -> None:
+    feed = _SyntheticFeed()
+    snapshot = CensusSnapshot(_fetch_mock_census, feed)
+    snapshot.refresh()
+    before = snapshot.select(list(wards.ALL), [])
+    as_of = snapshot.as_of
+
+    snapshot.refresh()
+
+    assert snapshot.as_of > as_of
+    assert {row.modified_at for row in before} == {as_of}
@@ -0,0 +1,77 @@
+# type: ignore
+import numpy as np
+import pandas as pd
+import pytest
+
+from api.census.wrangle import _aggregate_by_department, aggregate_by_department
+
+MODIFIED_AT = pd.Timestamp("2022-07-18 12:00", tz="UTC")
+
+
+def _synthetic_census(beds: int, departments: int = 500) -> pd.DataFrame:
+    """A bed level census shaped like the output of live.sql"""
+    rng = np.random.default_rng(42)
+    department = rng.choice([f"UCH T{i:03d} WARD" for i in range(departments)], beds)
+    last_dc = MODIFIED_AT - pd.to_timedelta(
+        rng.integers(0, 60 * 24 * 3600, beds), unit="s"
+    )
+    df = pd.DataFrame(
+        {
+            "department": department,
+            "location_id": np.arange(beds),
+            "occupied": rng.choice(np.array([True, False, None]), beds),
+            "cvl_discharge": pd.Series(last_dc).where(rng.random(beds) > 0.3),
+            "modified_at": MODIFIED_AT,
+        }
+    )
+    df["location_string"] = (
+        df["department"] + "^ROOM^BED-" + df["location_id"].astype(str)
+    )
+    return df
+
+
+def test__aggregate_by_department_flags_closed_wards() -> None:
+    df = pd.DataFrame(
+        {
+            "department": ["OPEN", "TEMP", "PERM", "NEVER", "NEVER"],
+            "location_id": [1, 2, 3, 4, 5],
+            "occupied": [True, False, None, False, False],
+            "cvl_discharge": [
+                MODIFIED_AT - pd.Timedelta(days=1),
+                MODIFIED_AT - pd.Timedelta(days=5),
+                MODIFIED_AT - pd.Timedelta(days=40),
+                None,
+                None,
+            ],
+            "modified_at": MODIFIED_AT,
+        }
+    )
+
+    res = _aggregate_by_department(df).set_index("department")
+
+    assert res.index.tolist() == ["NEVER", "OPEN", "PERM", "TEMP"]
+    assert res["beds"].tolist() == [2, 1, 1, 1]
+    assert res["patients"].tolist() == [0, 1, 0, 0]
+    assert res["days_since_last_dc"].tolist() == [-999, 1, 40, 5]
+    assert res["closed_temp"].tolist() == [False, False, False, True]
+    assert res["closed_perm"].tolist() == [True, False, True, False]
+
+
+@pytest.mark.parametrize("beds", [10_000, 100_000])
+def test_benchmark__aggregate_by_department(benchmark, beds: int) -> None:
+    benchmark.group = "aggregate_by_department"
+    df = _synthetic_census(beds)
+
+    res = benchmark(_aggregate_by_department, df)
+
+    assert res["beds"].sum() == beds
+
+
+@pytest.mark.parametrize("beds", [10_000, 100_000])
+def test_benchmark_aggregate_by_department(benchmark, beds: int) -> None:
+    benchmark.group = "aggregate_by_department (with location split)"
+    df = _synthetic_census(beds)
+
+    res = benchmark(aggregate_by_department, df)
+
+    assert res["beds"].sum() == beds
@@ -0,0 +1,64 @@
+# type: ignore
+import asyncio
+
+from api import db
+from api.main import app
+from fastapi.testclient import TestClient
+
+client = TestClient(app)
+
+
+def test_pool_stats_records_checkouts(tmp_path, monkeypatch) -> None:
+    engine = db._create_engine("scratch", f"sqlite:///{tmp_path / 'scratch.db'}")
+    monkeypatch.setitem(db.ENGINES, "scratch", lambda: engine)
+    try:
+        assert asyncio.run(db.warm_up("scratch")) == engine.pool.size()
+        with engine.connect():
+            stats = db.pool_stats()["scratch"]
+
+        assert stats["checked_out"] == 1
+        assert stats["checkouts"] == engine.pool.size() + 1
+        assert stats["timeouts"] == 0
+        assert stats["mean_wait_ms"] >= 0
+
+        response = client.get("/db/pools")
+        assert response.status_code == 200
+        assert response.json()["scratch"]["checked_out"] == 0
+    finally:
+        db._engines.pop("scratch")
+        engine.dispose()
+
+
+def test_engine_metrics_survive_dispose(tmp_path) -> None:
+    engine = db._create_engine("scratch", f"sqlite:///{tmp_path / 'scratch.db'}")
+    try:
+        with engine.connect():
+            pass
+        engine.dispose()
+        with engine.connect():
+            pass
+
+        assert engine.pool.metrics.checkouts == 2
+    finally:
+        db._engines.pop("scratch")
+        engine.dispose()
+
+
+def test_warm_up_opens_async_connections(tmp_path, monkeypatch) -> None:
+    engine = db._create_async_engine(
+        "scratch_async", f"sqlite+aiosqlite:///{tmp_path / 'scratch.db'}"
+    )
+    pool = engine.sync_engine.pool
+    monkeypatch.setitem(db.ENGINES, "scratch_async", lambda: engine)
+
+    async def warm_up() -> int:
+        try:
+            return await db.warm_up("scratch_async")
+        finally:
+            await engine.dispose()
+
+    try:
+        assert asyncio.run(warm_up()) == pool.size()
+        assert pool.metrics.checkouts == pool.size()
+    finally:
+        db._engines.pop("scratch_async")
@@ -0,0 +1,152 @@
+# type: ignore
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+from api.baserow import AsyncBaserowDB, BaserowException
+from api.beds.discharges import DischargeIndex, DischargeQueue
+from api.config import get_settings
+
+TABLES = {"discharge_statuses": {"id": 7, "name": "discharge_statuses"}}
+HOUR = timedelta(hours=1)
+
+
+def _baserow(handler) -> AsyncBaserowDB:
+    return AsyncBaserowDB(
+        settings=get_settings(),
+        database_token="token",
+        tables_dict=TABLES,
+        transport=httpx.MockTransport(handler),
+    )
+
+
+def test_queue_keeps_the_latest_status_of_each_csn(tmp_path) -> None:
+    queue = DischargeQueue(tmp_path / "queue.db")
+    queue.put(1, "review")
+    queue.put(2, "ready")
+    latest = queue.put(1, "discharged")
+
+    pending = DischargeQueue(tmp_path / "queue.db").pending()
+
+    assert [(s.csn, s.status) for s in pending] == [(2, "ready"), (1, "discharged")]
+    assert pending[-1] == latest
+
+
+def test_flush_posts_a_batch_and_keeps_statuses_queued_meanwhile(tmp_path) -> None:
+    queue = DischargeQueue(tmp_path / "queue.db")
+    queue.put(1, "review")
+    queue.put(2, "ready")
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        # the user changes their mind whilst the batch is in flight
+        queue.put(2, "review")
+        items = json.loads(request.content)["items"]
+        return httpx.Response(200, content=json.dumps({"items": items}))
+
+    assert asyncio.run(queue.flush(_baserow(handler))) == 2
+
+    (call,) = calls
+    assert (call.method, call.url.path) == (
+        "POST",
+        "/api/database/rows/table/7/batch/",
+    )
+    assert [item["csn"] for item in json.loads(call.content)["items"]] == [1, 2]
+    assert [(s.csn, s.status) for s in queue.pending()] == [(2, "review")]
+
+
+def test_failed_flush_leaves_the_queue(tmp_path) -> None:
+    queue = DischargeQueue(tmp_path / "queue.db")
+    queue.put(1, "review")
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(500)
+
+    with pytest.raises(BaserowException):
+        asyncio.run(queue.flush(_baserow(handler)))
+
+    assert [s.csn for s in queue.pending()] == [1]
+
+
+def test_flush_removes_each_batch_baserow_has_taken(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr("api.beds.discharges.BATCH_SIZE", 2)
+    queue = DischargeQueue(tmp_path / "queue.db")
+    for csn in range(1, 6):
+        queue.put(csn, "review")
+    posted = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if posted:
+            return httpx.Response(500)
+        items = json.loads(request.content)["items"]
+        posted.extend(item["csn"] for item in items)
+        return httpx.Response(200, content=json.dumps({"items": items}))
+
+    with pytest.raises(BaserowException):
+        asyncio.run(queue.flush(_baserow(handler)))
+
+    # the first batch is not sent again next time
+    assert posted == [1, 2]
+    assert [s.csn for s in queue.pending()] == [3, 4, 5]
+
+
+class _StubBaserowDB:
+    def __init__(self, rows: list[dict]) -> None:
+        self.rows = rows
+        self.calls = 0
+
+    def get_rows(self, table_name: str, params: dict, filters: list) -> list[dict]:
+        self.calls += 1
+        ((field, operator, value),) = filters
+        assert (field, operator) == ("modified_at", "date_after")
+        after = datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+        return [row for row in self.rows if row["modified_at"] > after]
+
+
+def test_index_keeps_the_latest_status_of_each_csn(tmp_path) -> None:
+    now = datetime.now(timezone.utc)
+    baserow = _StubBaserowDB(
+        [
+            {"id": 1, "csn": 1, "status": "review", "modified_at": now - HOUR * 3},
+            {"id": 2, "csn": 1, "status": "ready", "modified_at": now - HOUR * 2},
+            {"id": 3, "csn": 2, "status": "review", "modified_at": now - HOUR * 2},
+        ]
+    )
+    queue = DischargeQueue(tmp_path / "queue.db")
+    index = DischargeIndex(queue, ttl=60, horizon_hours=72)
+
+    latest = index.latest(baserow)
+    assert [(s.csn, s.status) for s in latest] == [(1, "ready"), (2, "review")]
+
+    cursor = latest[-1].modified_at
+    posted = queue.put(2, "discharged")
+    index.update(posted)
+
+    assert [(s.csn, s.status) for s in index.latest(baserow, since=cursor)] == [
+        (2, "discharged")
+    ]
+    assert index.latest(baserow, since=posted.modified_at) == []
+    assert [s.csn for s in index.latest(baserow, delta_hours=1)] == [2]
+    # loaded once then kept up to date by the posts
+    assert baserow.calls == 1
+
+
+def test_index_reads_past_its_horizon_when_asked(tmp_path) -> None:
+    now = datetime.now(timezone.utc)
+    baserow = _StubBaserowDB(
+        [
+            {"id": 1, "csn": 1, "status": "review", "modified_at": now - HOUR * 100},
+            {"id": 2, "csn": 2, "status": "ready", "modified_at": now - HOUR},
+        ]
+    )
+    index = DischargeIndex(DischargeQueue(tmp_path / "queue.db"), 60, 72)
+
+    assert [s.csn for s in index.latest(baserow, delta_hours=72)] == [2]
+    assert [s.csn for s in index.latest(baserow, delta_hours=120)] == [1, 2]
+    # without widening what the index holds
+    assert [s.csn for s in index.latest(baserow)] == [2]
+    assert baserow.calls == 2
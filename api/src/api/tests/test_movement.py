@@ -0,0 +1,70 @@
+# type: ignore
+from datetime import datetime
+
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from api import movement
+from api.movement import NextLocation, NextLocationCache, next_locations
+
+EVENT_DATETIME = datetime(2022, 7, 18, 12)
+
+
+def _next_location(csn: str) -> NextLocation:
+    return NextLocation(
+        csn=csn, next_location=f"T03^BED-{csn}", event_datetime=EVENT_DATETIME
+    )
+
+
+def test_query_binds_csns_as_an_array() -> None:
+    assert movement.QUERY.preparable
+    assert isinstance(movement.QUERY.clause._bindparams["csns"].type, ARRAY)
+
+
+def test_next_locations_queries_in_chunks(monkeypatch) -> None:
+    chunks = []
+
+    def execute(session, params):
+        chunks.append(params["csns"])
+        return [_next_location(csn).dict() for csn in params["csns"][::2]]
+
+    monkeypatch.setattr(movement.QUERY, "execute", execute)
+    monkeypatch.setattr(movement, "CHUNK_SIZE", 4)
+    csns = [str(csn) for csn in range(10)]
+
+    res = next_locations(None, csns, cache=NextLocationCache(ttl=60))
+
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    assert {location.csn for location in res} == {"0", "2", "4", "6", "8"}
+
+
+def test_next_location_cache_only_fetches_the_delta() -> None:
+    fetched = []
+
+    def fetch(csns: list[str]) -> list[NextLocation]:
+        fetched.append(csns)
+        # only odd CSNs have a planned move
+        return [_next_location(csn) for csn in csns if int(csn) % 2]
+
+    cache = NextLocationCache(ttl=60)
+    first = cache.get(["1", "2", "3"], fetch)
+    second = cache.get(["3", "2", "1", "4", "5", "5"], fetch)
+
+    assert [location.csn for location in first] == ["1", "3"]
+    assert [location.csn for location in second] == ["1", "3", "5"]
+    # CSNs without a move are remembered too
+    assert fetched == [["1", "2", "3"], ["4", "5"]]
+
+
+def test_next_location_cache_expires() -> None:
+    fetched = []
+
+    def fetch(csns: list[str]) -> list[NextLocation]:
+        fetched.append(csns)
+        return []
+
+    cache = NextLocationCache(ttl=0)
+    cache.get(["1"], fetch)
+    cache.get(["2"], fetch)
+
+    assert fetched == [["1"], ["2"]]
+    assert len(cache) == 1
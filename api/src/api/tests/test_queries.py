@@ -0,0 +1,51 @@
+# type: ignore
+import os
+
+from sqlalchemy import create_engine
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Session
+
+from api.census.router import LIVE_SQL
+from api.queries import SQLQuery, QueryRegistry, get_query
+
+
+def test_get_query_compiles_once() -> None:
+    assert get_query(LIVE_SQL) is get_query(LIVE_SQL)
+
+
+def test_query_binds_arrays_and_positions() -> None:
+    query = get_query(LIVE_SQL)
+
+    assert query.params == ["departments", "locations"]
+    assert isinstance(query.clause._bindparams["departments"].type, ARRAY)
+    assert "ANY ( $1 )" in query._positional_sql()
+    assert "ANY ( $2 )" in query._positional_sql()
+    assert str(query._execute_clause) == (
+        f"EXECUTE {query.statement_name}(:departments, :locations)"
+    )
+
+
+def test_query_expands_in_lists() -> None:
+    engine = create_engine("sqlite://", future=True)
+    query = SQLQuery("in_list", "SELECT :n AS n WHERE 'b' IN :letters")
+
+    with Session(engine) as session:
+        assert query.execute(session, {"n": 1, "letters": ["a", "b"]}).all() == [(1,)]
+        assert query.execute(session, {"n": 1, "letters": ["a"]}).all() == []
+    assert "prepared_statements" not in engine.raw_connection().info
+
+
+def test_registry_reloads_changed_files(tmp_path) -> None:
+    path = tmp_path / "q.sql"
+    path.write_text("SELECT 1")
+
+    static, reloading = QueryRegistry(tmp_path), QueryRegistry(tmp_path, reload=True)
+    first, first_reloading = static.get(path), reloading.get(path)
+
+    path.write_text("SELECT 2")
+    os.utime(path, (0, 0))
+
+    assert static.get(path) is first
+    changed = reloading.get(path)
+    assert changed.sql == "SELECT 2"
+    assert changed.statement_name != first_reloading.statement_name
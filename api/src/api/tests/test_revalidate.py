@@ -0,0 +1,45 @@
+import asyncio
+
+from api.revalidate import StaleCache
+
+
+def test_stale_cache_shares_one_load_and_serves_stale_whilst_refreshing() -> None:
+    loads: list[int] = []
+
+    async def load() -> int:
+        loads.append(1)
+        await asyncio.sleep(0)
+        return len(loads)
+
+    cache: StaleCache[str, int] = StaleCache("test", ttl=0)
+
+    async def _requests() -> tuple:
+        first = await asyncio.gather(cache.get("key", load), cache.get("key", load))
+        stale = await cache.get("key", load)
+        await cache.settle()
+        return first, stale, cache.peek("key")
+
+    first, stale, refreshed = asyncio.run(_requests())
+
+    assert first == [1, 1]
+    assert stale == 1
+    assert refreshed == 2
+    assert cache.stats()["key"]["stale"] == 1
+
+
+def test_stale_cache_does_not_keep_a_load_started_before_invalidate() -> None:
+    async def load() -> str:
+        await asyncio.sleep(0)
+        return "before"
+
+    cache: StaleCache[str, str] = StaleCache("test", ttl=300)
+
+    async def _requests() -> None:
+        before = asyncio.create_task(cache.get("key", load))
+        await asyncio.sleep(0)  # the load is now in flight
+        cache.invalidate("key")
+        await before
+
+    asyncio.run(_requests())
+
+    assert cache.peek("key") is None
@@ -1,7 +1,18 @@
 # type: ignore
-from api.main import app
+import asyncio
+
+import httpx
 from fastapi.testclient import TestClient
 
+from api.config import get_settings
+from api.main import app
+from api.sitrep.hycastle import (
+    HyCastleClient,
+    SitrepCache,
+    get_hycastle_client,
+    get_sitrep_cache,
+)
+from api.wards import SITREP_DEPT2WARD_MAPPING
 from models.sitrep import SitrepRow
 
 client = TestClient(app)
@@ -13,3 +24,91 @@ def test_get_mock_live_ui():
 
     rows = [SitrepRow.parse_obj(row) for row in response.json()]
     assert len(rows) > 0
+
+
+def _sitrep_row(csn: str) -> dict:
+    return {
+        "csn": csn,
+        "episode_slice_id": 1,
+        "n_inotropes_1_4h": 0,
+        "had_rrt_1_4h": False,
+        "vent_type_1_4h": "Room air",
+        "wim_1": 2,
+        "discharge_ready_1_4h": None,
+        "is_agitated_1_8h": False,
+    }
+
+
+def _hycastle(handler) -> HyCastleClient:
+    return HyCastleClient(get_settings(), transport=httpx.MockTransport(handler))
+
+
+def test_sitrep_cache_serves_stale_whilst_refreshing() -> None:
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.path)
+        return httpx.Response(200, json={"data": [_sitrep_row(str(len(calls)))]})
+
+    hycastle, cache = _hycastle(handler), SitrepCache(ttl=0, max_stale=60)
+
+    async def get_twice() -> tuple[list[SitrepRow], list[SitrepRow]]:
+        first = await cache.get("T03", hycastle)
+        stale = await cache.get("T03", hycastle)
+        # let the background refresh finish
+        await cache._wards.settle()
+        await hycastle.aclose()
+        return first, stale
+
+    first, stale = asyncio.run(get_twice())
+
+    assert calls == ["/live/icu/T03/ui", "/live/icu/T03/ui"]
+    assert first == stale == [SitrepRow.parse_obj(_sitrep_row("1"))]
+    assert cache._wards.peek("T03") == [SitrepRow.parse_obj(_sitrep_row("2"))]
+    assert cache.stats()["stale"] == 1
+
+
+def test_get_live_icus_ui_fetches_every_icu() -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        ward = request.url.path.split("/")[3]
+        if ward == "WMS":
+            return httpx.Response(503)
+        # hycastle answers either with or without a data envelope
+        return httpx.Response(200, json=[_sitrep_row(ward)])
+
+    hycastle, cache = _hycastle(handler), SitrepCache(ttl=60, max_stale=60)
+    app.dependency_overrides[get_hycastle_client] = lambda: hycastle
+    app.dependency_overrides[get_sitrep_cache] = lambda: cache
+    try:
+        response = client.get("/sitrep/live/ui")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    body = response.json()
+    assert list(body) == list(SITREP_DEPT2WARD_MAPPING.values())
+    assert body["WMS"] == []
+    assert body["T03"] == [_sitrep_row("T03")]
+    assert cache.stats()["errors"] == 1
+
+
+def test_get_live_ui_passes_other_wards_through_uncached() -> None:
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.path)
+        return httpx.Response(200, json=[_sitrep_row("1")])
+
+    hycastle, cache = _hycastle(handler), SitrepCache(ttl=60, max_stale=60)
+    app.dependency_overrides[get_hycastle_client] = lambda: hycastle
+    app.dependency_overrides[get_sitrep_cache] = lambda: cache
+    try:
+        for _ in range(2):
+            response = client.get("/sitrep/live/NOTAWARD/ui")
+            assert response.status_code == 200
+            assert response.json() == [_sitrep_row("1")]
+    finally:
+        app.dependency_overrides.clear()
+
+    assert calls == ["/live/icu/NOTAWARD/ui"] * 2
+    assert cache.stats()["wards"] == []
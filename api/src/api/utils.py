@@ -1,7 +1,11 @@
+import functools
+import inspect
 import time
 from contextlib import ContextDecorator
-from dataclasses import dataclass, field
-from typing import Any, Callable, ClassVar, Dict, Optional
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, ClassVar, Dict, Optional, TypeVar, cast
+
+F = TypeVar("F", bound=Callable[..., Any])
 
 
 class TimerError(Exception):
@@ -49,6 +53,19 @@ class Timer(ContextDecorator):
 
         return elapsed_time
 
+    def __call__(self, func: F) -> F:
+        """Decorate a function, which may be a coroutine function"""
+        if not inspect.iscoroutinefunction(func):
+            return super().__call__(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            # a timer per call as calls may overlap on the event loop
+            with replace(self):
+                return await func(*args, **kwargs)
+
+        return cast(F, wrapper)
+
     def __enter__(self) -> "Timer":
         """Start a new timer as a context manager"""
         self.start()
@@ -96,6 +96,18 @@ NHNN = (
 
 ALL = TOWER + GWB + WMS + NHNN
 
+# The ICUs with a live sitrep in hycastle (department: hycastle ward)
+SITREP_DEPT2WARD_MAPPING = MappingProxyType(
+    {
+        "UCH T03 INTENSIVE CARE": "T03",
+        "UCH T06 SOUTH PACU": "T06",
+        "GWB L01 CRITICAL CARE": "GWB",
+        "WMS W01 CRITICAL CARE": "WMS",
+        "NHNN C0 NCCU": "NHNNC0",
+        "NHNN C1 NCCU": "NHNNC1",
+    }
+)
+
 CAMPUSES = {
     "UCH": TOWER,
     "WMS": WMS,
@@ -33,6 +33,15 @@ class Bed(BaseModel):
     ypos: int | None
 
 
+class BedUpdate(BaseModel):
+    """The id of a bed row and the fields (by name) to change"""
+
+    id: int
+
+    class Config:
+        extra = "allow"
+
+
 class Department(BaseModel):
     department: str | None
     hl7_department: str | None
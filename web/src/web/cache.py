@@ -0,0 +1,363 @@
+"""
+Stale-while-revalidate reads of the redis cache filled by the celery tasks
+
+Every value stored under a key is also kept under a "stale" key for
+STALE_EXPIRES beyond its expiry. Once the key has expired readers are
+served the stale copy whilst one refresh (guarded by a SET NX lock shared
+by every worker) is queued in the background; a reader only waits when
+there is no copy of any age, e.g. on a brand new redis.
+
+get_or_fetch is the synchronous equivalent for callers that fetch in the
+request (requests_try_cache): one worker fetches a key whilst the others
+serve the previous value or wait briefly for it. A hot key is also
+refreshed a little before it expires with a probability that rises as the
+expiry nears and with how long the last fetch took ("XFetch", Vattani et
+al. 2015), so that it is not every reader that finds it missing at once.
+
+How often each case happens is counted in the STATS_KEY hash.
+
+A value stored again unchanged (its digest, kept under the version key,
+is the same) only has its expiry extended, as does one the API reports
+unchanged (renew(), given the ETag kept under the etag key), so nothing
+made from it needs making again.
+
+LocalCache sits in front of redis in each web process and holds what the
+callbacks made of a value (e.g. the validated rows of a store) so that a
+warm callback neither goes to redis nor parses anything. Its entries are
+stamped with the version of the value (a digest kept under the version
+key), live no longer than the key unless it is renewed unchanged, and are
+dropped when store() announces a new value on INVALIDATE_CHANNEL.
+"""
+import hashlib
+import math
+import random
+import secrets
+import threading
+import time
+from typing import Any, Callable, Generic, Optional, Protocol, TypeVar, cast
+
+from redis import Redis
+
+from web import codec
+from web.logger import logger
+
+# How long the last value of a key is kept after the key itself expires
+STALE_EXPIRES = 7 * 24 * 3600
+# Seconds a refresh may take before another worker is allowed to start one
+LOCK_EXPIRES = 60
+# Deletes the lock only if it still holds the token of whoever releases it
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+STATS_KEY = "web_cache_stats"
+# >1 refreshes earlier, <1 later (see expires_early)
+EARLY_EXPIRY_BETA = 1.0
+# Redis pub/sub channel on which the keys given new values are announced
+INVALIDATE_CHANNEL = "web_cache_invalidate"
+
+T = TypeVar("T")
+
+
+class PendingResult(Protocol):
+    """A queued refresh e.g. a celery AsyncResult"""
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        ...
+
+
+def stale_key(cache_key: str) -> str:
+    return f"{cache_key}_stale"
+
+
+def lock_key(cache_key: str) -> str:
+    return f"{cache_key}_lock"
+
+
+def version_key(cache_key: str) -> str:
+    return f"{cache_key}_version"
+
+
+def etag_key(cache_key: str) -> str:
+    return f"{cache_key}_etag"
+
+
+def _extend(redis: Redis, cache_key: str, payload: bytes, expires: int) -> None:
+    """Keep the current value of a key for another expires seconds"""
+    # the key itself may have expired already (which is what prompted the
+    # refresh) in which case it is put back
+    if not redis.expire(cache_key, expires):
+        redis.set(cache_key, payload, ex=expires)
+    with redis.pipeline() as pipeline:
+        for key in (stale_key(cache_key), version_key(cache_key), etag_key(cache_key)):
+            pipeline.expire(key, expires + STALE_EXPIRES)
+        pipeline.execute()
+
+
+def store(
+    redis: Redis,
+    cache_key: str,
+    data: Any,
+    expires: int,
+    etag: Optional[str] = None,
+) -> bool:
+    """
+    Cache data under the key for expires seconds (and the stale key) and
+    tell every LocalCache to drop what it made of the previous value;
+    False (and only the expiry extended) if data is the value already held
+    """
+    payload = codec.encode(data)
+    version = hashlib.blake2b(payload, digest_size=16).digest()
+    if redis.get(version_key(cache_key)) == version:
+        if etag is not None:
+            redis.set(etag_key(cache_key), etag, ex=expires + STALE_EXPIRES)
+        _extend(redis, cache_key, payload, expires)
+        return False
+
+    with redis.pipeline() as pipeline:
+        pipeline.set(cache_key, payload, ex=expires)
+        pipeline.set(stale_key(cache_key), payload, ex=expires + STALE_EXPIRES)
+        pipeline.set(version_key(cache_key), version, ex=expires + STALE_EXPIRES)
+        if etag is not None:
+            pipeline.set(etag_key(cache_key), etag, ex=expires + STALE_EXPIRES)
+        else:
+            pipeline.delete(etag_key(cache_key))
+        pipeline.publish(INVALIDATE_CHANNEL, cache_key)
+        pipeline.execute()
+    return True
+
+
+def renew(redis: Redis, cache_key: str, expires: int) -> Any:
+    """
+    The value held for a key, kept for another expires seconds (e.g. the
+    API answered 304 to its ETag); None if there is no copy of any age
+    """
+    payload = redis.get(stale_key(cache_key))
+    if payload is None:
+        return None
+    _extend(redis, cache_key, payload, expires)
+    return codec.decode(payload)
+
+
+def delta_key(cache_key: str) -> str:
+    return f"{cache_key}_delta"
+
+
+def acquire(redis: Redis, cache_key: str, expires: int = LOCK_EXPIRES) -> Optional[str]:
+    """
+    Take the refresh lock of a key; the token to release it with, or None
+    if another worker holds it
+    """
+    token = secrets.token_hex(16)
+    if redis.set(lock_key(cache_key), token, nx=True, ex=expires):
+        return token
+    return None
+
+
+def release(redis: Redis, cache_key: str, token: str) -> bool:
+    """
+    Give up the refresh lock of a key taken with acquire(); False (and the
+    lock left alone) if it has expired and been taken by another worker
+    """
+    return bool(redis.eval(_RELEASE_SCRIPT, 1, lock_key(cache_key), token))
+
+
+def count(redis: Redis, event: str) -> None:
+    redis.hincrby(STATS_KEY, event, 1)
+
+
+def stats(redis: Redis) -> dict[str, int]:
+    """Reads served fresh or stale and those that had to wait (cold)"""
+    return {key.decode(): int(value) for key, value in redis.hgetall(STATS_KEY).items()}
+
+
+def _wait_for(redis: Redis, cache_key: str, timeout: float) -> Optional[bytes]:
+    """Poll for a key being filled by a refresh started elsewhere"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if (cached := redis.get(cache_key)) is not None:
+            return cast(bytes, cached)
+        time.sleep(0.1)
+    return None
+
+
+def get_or_refresh(
+    redis: Redis,
+    cache_key: str,
+    refresh: Callable[[], PendingResult],
+    timeout: float = LOCK_EXPIRES,
+) -> Any:
+    """
+    The cached value of a key, or the stale one whilst refresh() (which
+    should queue the work and return straight away) fills the key again
+
+    The lock is left to expire rather than released as the refresh runs
+    elsewhere; by then it has filled the key so no other is needed.
+    """
+    cached = redis.get(cache_key)
+    if cached is not None:
+        count(redis, "fresh")
+        return codec.decode(cached)
+
+    pending = refresh() if acquire(redis, cache_key) else None
+
+    stale = redis.get(stale_key(cache_key))
+    if stale is not None:
+        count(redis, "stale")
+        logger.info(f"Serving stale {cache_key} whilst it is refreshed")
+        return codec.decode(stale)
+
+    count(redis, "cold")
+    logger.info(f"Waiting for {cache_key} to be fetched")
+    if pending is not None:
+        return pending.get(timeout=timeout)
+    cached = _wait_for(redis, cache_key, timeout)
+    if cached is None:
+        raise TimeoutError(f"Timed out waiting for {cache_key}")
+    return codec.decode(cached)
+
+
+def expires_early(
+    redis: Redis, cache_key: str, beta: float = EARLY_EXPIRY_BETA
+) -> bool:
+    """
+    Whether to treat a key as expired ahead of time: true once
+    -delta * beta * ln(random) reaches the time left, delta being how long
+    the last fetch of the key took
+    """
+    delta = redis.get(delta_key(cache_key))
+    ttl_ms: int = redis.pttl(cache_key)
+    if delta is None or ttl_ms < 0:
+        return False
+    return -float(delta) * beta * math.log(1.0 - random.random()) >= ttl_ms / 1000
+
+
+def get_or_fetch(
+    redis: Redis,
+    cache_key: str,
+    fetch: Callable[[], Any],
+    timeout: float = 10,
+    beta: float = EARLY_EXPIRY_BETA,
+) -> Any:
+    """
+    The cached value of a key or that returned by fetch(), which must also
+    store it (e.g. get_response); only one worker fetches a key at a time
+    """
+    cached = redis.get(cache_key)
+    if cached is not None and not expires_early(redis, cache_key, beta):
+        count(redis, "fresh")
+        return codec.decode(cached)
+
+    if (token := acquire(redis, cache_key)) is not None:
+        count(redis, "early" if cached is not None else "fetched")
+        start = time.monotonic()
+        try:
+            data = fetch()
+        finally:
+            release(redis, cache_key, token)
+        redis.set(delta_key(cache_key), time.monotonic() - start, ex=STALE_EXPIRES)
+        return data
+
+    # another worker is fetching
+    if cached is None:
+        cached = redis.get(stale_key(cache_key))
+    if cached is not None:
+        count(redis, "stale")
+        return codec.decode(cached)
+
+    count(redis, "cold")
+    cached = _wait_for(redis, cache_key, timeout)
+    if cached is None:
+        logger.warning(f"Gave up waiting for {cache_key}: fetching it here")
+        return fetch()
+    return codec.decode(cached)
+
+
+class LocalCache(Generic[T]):
+    """
+    Values made from cached keys, held in this process (see module docs)
+
+    Whilst listen() is running a warm get costs a dict lookup; without it
+    (or should the subscription drop) each get first compares the version
+    key with the version the entry was made from.
+    """
+
+    def __init__(self) -> None:
+        # cache key -> (expires at, version, value)
+        self._entries: dict[str, tuple[float, bytes, T]] = {}
+        # bumped on every invalidation so that what was made from a value
+        # replaced in the meantime is not kept
+        self._invalidations = 0
+        self._lock = threading.Lock()
+        self._listener: Optional[threading.Thread] = None
+
+    @property
+    def listening(self) -> bool:
+        return self._listener is not None and self._listener.is_alive()
+
+    def listen(self, redis: Redis) -> None:
+        """Drop entries as new values are stored, from a background thread"""
+        if self.listening:
+            return
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{INVALIDATE_CHANNEL: self._on_invalidate})
+        # anything stored whilst not subscribed went unannounced
+        self.clear()
+        self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def _on_invalidate(self, message: dict) -> None:
+        self.invalidate(message["data"].decode())
+
+    def invalidate(self, cache_key: str) -> None:
+        with self._lock:
+            self._entries.pop(cache_key, None)
+            self._invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._invalidations += 1
+
+    def get(
+        self,
+        redis: Redis,
+        cache_key: str,
+        load: Callable[[], Any],
+        make: Callable[[Any], T],
+    ) -> T:
+        """
+        make(load()) or what it returned last time if the value of the key
+        has not changed since; load is e.g. a get_or_refresh of the key
+        """
+        invalidations = self._invalidations
+        entry = self._entries.get(cache_key)
+        live = entry is not None and time.monotonic() < entry[0]
+        if entry is not None and live and self.listening:
+            return entry[2]
+
+        # read before the value so that a value stored in between is only
+        # ever stamped with an older version (and made again next time)
+        version = redis.get(version_key(cache_key))
+        if entry is not None and live and version == entry[1]:
+            return entry[2]
+
+        data = load()
+        if entry is not None and version is not None and version == entry[1]:
+            # the key was renewed or stored again unchanged
+            value = entry[2]
+        else:
+            value = make(data)
+        ttl_ms: int = redis.pttl(cache_key)
+        # stale values are not kept so the next get goes to redis again
+        # (and finds the refreshed value)
+        if version is not None and ttl_ms > 0:
+            with self._lock:
+                if self._invalidations == invalidations:
+                    self._entries[cache_key] = (
+                        time.monotonic() + ttl_ms / 1000,
+                        version,
+                        value,
+                    )
+        return value
@@ -3,10 +3,10 @@
 import hashlib
 import re
 
-import orjson
 import requests
-from typing import Optional, Any
+from typing import Optional, Any, cast
 
+from web import cache
 from web.celery import celery_app, redis_client
 from web.logger import logger
 
@@ -26,11 +26,24 @@ def get_response(
         logger.error(f"Invalid URL: {url} - {e}")
         return None, 400
 
+    # ask the API to skip the body if it has not changed since the last fetch
+    headers: dict[str, str] = {}
+    if (etag := redis_client.get(cache.etag_key(cache_key))) is not None:
+        headers["If-None-Match"] = etag.decode()
+
     if params is None:
         logger.info(f"Fetching {url} - no parameters provided")
-        response = requests.get(url)
+        response = requests.get(url, headers=headers)
     else:
         logger.info(f"Fetching {url} - params {str(params)[:16]} ...")
+        response = requests.get(url, params=params, headers=headers)
+
+    if response.status_code == 304:
+        cached = cache.renew(redis_client, cache_key, expires)
+        if cached is not None:
+            logger.info(f"{url} unchanged: keeping {cache_key}")
+            return cast(tuple[object, int], cached)
+        # the cached copy has gone since: fetch it all again
         response = requests.get(url, params=params)
 
     if response.status_code != 200:
@@ -38,9 +51,11 @@ def get_response(
         return None, response.status_code
 
     data = response.json()  # type: tuple[object, int]
-    redis_client.set(cache_key, orjson.dumps(data))
     # Remember to expire the cache just after the task refresh interval
-    redis_client.expire(cache_key, expires)
+    if not cache.store(
+        redis_client, cache_key, data, expires, etag=response.headers.get("ETag")
+    ):
+        logger.info(f"{url} unchanged: keeping {cache_key}")
 
     return data
 
@@ -77,15 +92,11 @@ def requests_try_cache(
             cache_key = cache_key + params_suffix
     expires = 3600 if expires is None else expires
 
-    cached_data = redis_client.get(cache_key)
-
-    if cached_data is None:
+    def fetch() -> Any:
         logger.info(f"Cache miss for {url} ... requesting")
         # Do not use the apply_async method from the celery_app.task decorator
         # because the function will return with nothing
-        data = get_response(url, cache_key, params=params, expires=expires)
-    else:
-        logger.info(f"Cache hit for {url}")
-        data = orjson.loads(cached_data)
+        return get_response(url, cache_key, params=params, expires=expires)
 
-    return data
+    # one worker fetches at a time (see web.cache.get_or_fetch)
+    return cache.get_or_fetch(redis_client, cache_key, fetch)
@@ -0,0 +1,92 @@
+"""
+Encoding of the values held in the redis cache
+
+Every value starts with a small header (MAGIC, a format version and the id
+of the codec that wrote it) so that the codec can be changed without
+flushing redis: a value is always decoded with the codec that encoded it,
+and values written before the header existed (plain orjson) still decode.
+
+The beds and census payloads are lists of dicts repeating the same keys so
+compress well; they are written as zstd compressed msgpack by default.
+See tests/test_codec_benchmark.py for the encode/decode times and sizes of
+each codec.
+"""
+import zlib
+from dataclasses import dataclass
+from typing import Any, Callable, cast
+
+import msgpack
+import orjson
+import zstandard
+
+from web.config import get_settings
+
+MAGIC = b"\x00HY"
+VERSION = 1
+
+
+@dataclass(frozen=True)
+class Codec:
+    id: int
+    name: str
+    encode: Callable[[Any], bytes]
+    decode: Callable[[bytes], Any]
+
+
+CODECS: dict[str, Codec] = {}
+
+
+def register(codec: Codec) -> None:
+    CODECS[codec.name] = codec
+
+
+register(Codec(1, "orjson", orjson.dumps, orjson.loads))
+register(
+    Codec(
+        2,
+        "orjson+zlib",
+        lambda data: zlib.compress(orjson.dumps(data), 6),
+        lambda payload: orjson.loads(zlib.decompress(payload)),
+    )
+)
+
+register(
+    Codec(
+        3,
+        "orjson+zstd",
+        lambda data: cast(bytes, zstandard.compress(orjson.dumps(data), 3)),
+        lambda payload: orjson.loads(zstandard.decompress(payload)),
+    )
+)
+register(
+    Codec(
+        4,
+        "msgpack+zstd",
+        lambda data: cast(bytes, zstandard.compress(msgpack.packb(data), 3)),
+        lambda payload: msgpack.unpackb(zstandard.decompress(payload)),
+    )
+)
+
+_BY_ID = {codec.id: codec for codec in CODECS.values()}
+_HEADER_LENGTH = len(MAGIC) + 2
+
+
+def encode(data: Any, codec: str | None = None) -> bytes:
+    """Encode data with the named codec (by default that in the settings)"""
+    chosen = CODECS[codec or get_settings().cache_codec]
+    return MAGIC + bytes((VERSION, chosen.id)) + chosen.encode(data)
+
+
+def decode(value: bytes) -> Any:
+    if not value.startswith(MAGIC):
+        # written before values had a header
+        return orjson.loads(value)
+
+    version, codec_id = value[len(MAGIC) : _HEADER_LENGTH]
+    if version != VERSION:
+        raise ValueError(f"Unknown cache value version {version}")
+    try:
+        codec = _BY_ID[codec_id]
+    except KeyError:
+        raise ValueError(f"Cache value written by unavailable codec {codec_id}")
+    return codec.decode(value[_HEADER_LENGTH:])
@@ -17,6 +17,8 @@ class Settings(BaseSettings):
     celery_dash_broker_url: AnyUrl
     celery_dash_result_backend: AnyUrl
     redis_cache: AnyUrl
+    # How values are encoded in the redis cache (see web.codec)
+    cache_codec: str = "msgpack+zstd"
 
     hyui_user: str
     hyui_password: SecretStr
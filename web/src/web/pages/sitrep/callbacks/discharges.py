@@ -2,13 +2,13 @@
 Module to manage the CRUD of discharge status
 """
 import dash
-import pandas as pd
 import warnings
+from datetime import datetime, timedelta, timezone
 
 import requests
-from dash import Input, Output, callback
-from loguru import logger
+from dash import Input, Output, State, callback
 from pydantic import BaseModel
+from pydantic.datetime_parse import parse_datetime
 from typing import Tuple
 
 from models.beds import DischargeStatus
@@ -17,6 +17,8 @@ from web.convert import parse_to_data_frame
 from web.logger import logger_timeit
 from web.pages.sitrep import ids
 
+DELTA_HOURS = 36
+
 
 def post_discharge_status(csn: int, status: str) -> Tuple[int, DischargeStatus]:
     status = status.lower()
@@ -37,39 +39,69 @@ def _most_recent_row_only(
     return df.to_dict(orient="records")  # type: ignore
 
 
-def _get_discharge_updates(delta_hours: int = 48) -> list[dict]:
+def _get_discharge_updates(
+    delta_hours: int = 48, since: str | None = None
+) -> list[dict] | None:
+    """
+    The latest status of each CSN (already deduplicated by the API), or only
+    those changed after since
+    """
+    params: dict = {"delta_hours": delta_hours}
+    if since:
+        params["since"] = since
     response = requests.get(
-        f"{get_settings().api_url}/baserow/discharge_status",
-        params={"delta_hours": delta_hours},
+        f"{get_settings().api_url}/baserow/discharge_status/latest",
+        params=params,
     )
     if response.status_code == 200:
         return response.json()  # type: ignore
     else:
         warnings.warn("No data found for discharge statues (from Baserow " "store)")
-        return [{}]
+        return None
+
+
+def _modified_at(row: dict) -> datetime:
+    return parse_datetime(row["modified_at"])
+
+
+def _merge_discharge_updates(
+    discharges: list[dict], updates: list[dict], delta_hours: int = 48
+) -> list[dict]:
+    """
+    Replace the status of any CSN that has been updated, dropping those not
+    modified within delta_hours (as the API would no longer return them)
+    """
+    by_csn = {row["csn"]: row for row in discharges if "csn" in row}
+    by_csn.update((row["csn"], row) for row in updates)
+    horizon = datetime.now(timezone.utc) - timedelta(hours=delta_hours)
+    return sorted(
+        (row for row in by_csn.values() if _modified_at(row) >= horizon),
+        key=lambda row: row["csn"],
+    )
 
 
 @callback(
     Output(ids.DISCHARGES_STORE, "data"),
     Input(ids.DEPT_SELECTOR, "value"),
+    State(ids.DISCHARGES_STORE, "data"),
 )
 @logger_timeit(level="DEBUG")
-def store_discharge_status(dept: str) -> list[dict]:
+def store_discharge_status(dept: str, discharges: list[dict] | None) -> list[dict]:
     """
     Get discharge status
-    Deduplicate to most recent only
+    Only the changes since the newest status already held are fetched
     Refreshes on ward update
     """
     if not dept:
         return dash.no_update  # type: ignore
-    discharges = _get_discharge_updates(delta_hours=36)
-    if not discharges or not len(discharges):
+    discharges = discharges or []
+    # parsed as the timestamps need not share a UTC offset or format
+    newest = max((_modified_at(row) for row in discharges if row), default=None)
+    since = newest.isoformat() if newest else None
+    updates = _get_discharge_updates(delta_hours=DELTA_HOURS, since=since)
+    if updates is None:
         return dash.no_update  # type: ignore
-    df = pd.DataFrame.from_records(discharges)
-    try:
-        df.sort_values(["csn", "modified_at"], ascending=[True, False], inplace=True)
-        df.drop_duplicates(["csn"], inplace=True)
-    except KeyError as e:
-        logger.warning("Unable to sort: is the dataframe empty?")
-        logger.exception(e)
-    return df.to_dict(orient="records")  # type: ignore
+    merged = _merge_discharge_updates(discharges, updates, delta_hours=DELTA_HOURS)
+    if merged == discharges:
+        return dash.no_update  # type: ignore
+    return merged
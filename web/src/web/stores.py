@@ -3,13 +3,13 @@ Use for slowly updating API calls that can be shared between pages and
 applications
 """
 
-import orjson
+from celery.result import AsyncResult
 from dash import Input, Output, callback, dcc, html
-from typing import Optional
+from typing import Callable, Optional
 
 from models.beds import Bed, Department, Room
 from models.sitrep import SitrepRow
-from web import ids, SITREP_DEPT2WARD_MAPPING
+from web import cache, ids, SITREP_DEPT2WARD_MAPPING
 from web.logger import logger, logger_timeit
 
 from web.celery import redis_client
@@ -20,6 +20,9 @@ from web.celery_config import beat_schedule  # single source of truth for tasks
 #  baserow so that changes from baserow edits can be brought through (
 #  although a page refresh may do the same thing?)
 
+# the validated rows of the stores that only change daily
+local_cache = cache.LocalCache[list[dict]]()
+
 
 def _get_or_refresh_cache(
     task: str, url: Optional[str] = None, expires: Optional[int] = None
@@ -27,6 +30,10 @@ def _get_or_refresh_cache(
     """
     Get or refresh a store using the task defined in beat_schedule
 
+    Once the cached copy has expired the previous one is returned whilst the
+    task refreshes it in the background; only a store that has never been
+    cached waits for the task (see web.cache)
+
     Parameters
     ----------
     task : str - as defined in beat_schedule
@@ -47,17 +54,40 @@ def _get_or_refresh_cache(
     if not expires:
         expires = beat_schedule.get(task).get("kwargs").get("expires")  # type: ignore
 
-    cached_data = redis_client.get(cache_key)
-
-    if cached_data is None:
+    def refresh() -> AsyncResult:
         logger.info(f"Fetching {task} from API")
-        fetch_data_task = get_response.delay(url, cache_key, expires)
-        data = fetch_data_task.get()  # type: list[dict]
-    else:
-        logger.info(f"Fetching {task} from cached data")
-        data = orjson.loads(cached_data)  # type: ignore
+        return get_response.delay(url, cache_key, expires=expires)
 
-    return data
+    return cache.get_or_refresh(redis_client, cache_key, refresh)  # type: ignore
+
+
+def _get_local_or_refresh_cache(
+    task: str, make: Callable[[list[dict]], list[dict]]
+) -> list[dict]:
+    """
+    make() of the rows of a store, remade only once the task has stored new
+    rows so that warm callbacks skip both redis and the parsing (see
+    web.cache.LocalCache)
+    """
+    _, cache_key = beat_schedule[task]["args"]  # tuple unpacking
+    local_cache.listen(redis_client)
+    return local_cache.get(
+        redis_client, cache_key, lambda: _get_or_refresh_cache(task), make
+    )
+
+
+def _make_departments(data: list[dict]) -> list[dict]:
+    depts = [Department.parse_obj(row).dict() for row in data]
+    return [d for d in depts if not d.get("closed_perm_01")]
+
+
+def _make_rooms(data: list[dict]) -> list[dict]:
+    rooms = [Room.parse_obj(row).dict() for row in data]
+    return [r for r in rooms if r.get("has_beds")]
+
+
+def _make_beds(data: list[dict]) -> list[dict]:
+    return [Bed.parse_obj(row).dict() for row in data]
 
 
 @callback(
@@ -67,10 +97,7 @@ def _get_or_refresh_cache(
 @logger_timeit()
 def _store_departments(_: int) -> list[dict]:
     """Store all open departments"""
-    task = ids.DEPT_STORE
-    data = _get_or_refresh_cache(task)
-    depts = [Department.parse_obj(row).dict() for row in data]
-    return [d for d in depts if not d.get("closed_perm_01")]
+    return _get_local_or_refresh_cache(ids.DEPT_STORE, _make_departments)
 
 
 @callback(
@@ -80,10 +107,7 @@ def _store_departments(_: int) -> list[dict]:
 @logger_timeit()
 def _store_rooms(_: int) -> list[dict]:
     """Store all rooms with beds"""
-    task = ids.ROOM_STORE
-    data = _get_or_refresh_cache(task)
-    rooms = [Room.parse_obj(row).dict() for row in data]
-    return [r for r in rooms if r.get("has_beds")]
+    return _get_local_or_refresh_cache(ids.ROOM_STORE, _make_rooms)
 
 
 @callback(
@@ -92,9 +116,7 @@ def _store_rooms(_: int) -> list[dict]:
 )
 @logger_timeit()
 def _store_beds(_: int) -> list[dict]:
-    task = ids.BEDS_STORE
-    data = _get_or_refresh_cache(task)
-    return [Bed.parse_obj(row).dict() for row in data]
+    return _get_local_or_refresh_cache(ids.BEDS_STORE, _make_beds)
 
 
 @callback(
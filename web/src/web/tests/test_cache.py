@@ -0,0 +1,286 @@
+import time
+from typing import Any, Optional
+
+from web import cache
+
+
+class FakeRedis:
+    """The handful of redis commands the cache uses, in memory"""
+
+    def __init__(self) -> None:
+        self.values: dict[str, tuple[Any, Optional[float]]] = {}
+        self.hashes: dict[str, dict[bytes, int]] = {}
+        self.published: list[tuple[str, str]] = []
+
+    def get(self, key: str) -> Any:
+        value, expires_at = self.values.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.values[key]
+            return None
+        return value
+
+    def set(
+        self, key: str, value: Any, ex: Optional[int] = None, nx: bool = False
+    ) -> bool:
+        if nx and self.get(key) is not None:
+            return False
+        expires_at = time.monotonic() + ex if ex is not None else None
+        self.values[key] = (value, expires_at)
+        return True
+
+    def pttl(self, key: str) -> int:
+        if self.get(key) is None:
+            return -2
+        _, expires_at = self.values[key]
+        if expires_at is None:
+            return -1
+        return int(1000 * (expires_at - time.monotonic()))
+
+    def expire(self, key: str, seconds: int) -> bool:
+        value = self.get(key)
+        if value is None:
+            return False
+        self.values[key] = (value, time.monotonic() + seconds)
+        return True
+
+    def delete(self, key: str) -> None:
+        self.values.pop(key, None)
+
+    def eval(self, script: str, numkeys: int, key: str, token: str) -> int:
+        # only the compare-and-delete of cache.release
+        assert script == cache._RELEASE_SCRIPT
+        if self.get(key) != token:
+            return 0
+        self.delete(key)
+        return 1
+
+    def hincrby(self, key: str, field: str, amount: int) -> None:
+        counts = self.hashes.setdefault(key, {})
+        counts[field.encode()] = counts.get(field.encode(), 0) + amount
+
+    def hgetall(self, key: str) -> dict:
+        return self.hashes.get(key, {})
+
+    def publish(self, channel: str, message: str) -> None:
+        self.published.append((channel, message))
+
+    def pipeline(self) -> "FakeRedis":
+        return self
+
+    def execute(self) -> None:
+        pass
+
+    def __enter__(self) -> "FakeRedis":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+
+class Refresh:
+    """Stands in for queueing get_response, filling the cache when run"""
+
+    def __init__(self, redis: FakeRedis, data: Any) -> None:
+        self.redis = redis
+        self.data = data
+        self.queued = 0
+
+    def __call__(self) -> "Refresh":
+        self.queued += 1
+        return self
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        cache.store(self.redis, "key", self.data, expires=60)
+        return self.data
+
+
+def test_cold_cache_waits_for_the_refresh() -> None:
+    redis = FakeRedis()
+    refresh = Refresh(redis, [1])
+
+    assert cache.get_or_refresh(redis, "key", refresh) == [1]
+    assert cache.get_or_refresh(redis, "key", refresh) == [1]
+
+    assert refresh.queued == 1
+    assert cache.stats(redis) == {"cold": 1, "fresh": 1}
+
+
+def test_expired_key_serves_stale_and_refreshes_once() -> None:
+    redis = FakeRedis()
+    cache.store(redis, "key", [1], expires=60)
+    redis.delete("key")
+    refresh = Refresh(redis, [2])
+
+    # the refresh is queued but has not run yet
+    assert cache.get_or_refresh(redis, "key", refresh) == [1]
+    assert cache.get_or_refresh(redis, "key", refresh) == [1]
+    assert refresh.queued == 1
+
+    refresh.get()
+    assert cache.get_or_refresh(redis, "key", refresh) == [2]
+    assert cache.stats(redis) == {"stale": 2, "fresh": 1}
+
+
+def test_get_or_fetch_fetches_once_and_others_serve_the_old_value() -> None:
+    redis = FakeRedis()
+    fetched = []
+
+    def fetch() -> Any:
+        fetched.append(1)
+        cache.store(redis, "key", [len(fetched)], expires=60)
+        return [len(fetched)]
+
+    assert cache.get_or_fetch(redis, "key", fetch) == [1]
+    assert cache.get_or_fetch(redis, "key", fetch) == [1]
+    assert fetched == [1]
+
+    # the key expires whilst another worker is already fetching it
+    redis.delete("key")
+    assert cache.acquire(redis, "key")
+    assert cache.get_or_fetch(redis, "key", fetch) == [1]
+    assert fetched == [1]
+    assert cache.stats(redis) == {"fetched": 1, "fresh": 1, "stale": 1}
+
+
+def test_a_late_release_does_not_free_another_workers_lock() -> None:
+    redis = FakeRedis()
+    token_a = cache.acquire(redis, "key", expires=60)
+    assert token_a is not None
+    assert cache.acquire(redis, "key") is None
+
+    # worker A overran its lock which worker B has since taken
+    redis.delete(cache.lock_key("key"))
+    token_b = cache.acquire(redis, "key")
+    assert token_b is not None
+
+    assert not cache.release(redis, "key", token_a)
+    assert cache.acquire(redis, "key") is None
+
+    assert cache.release(redis, "key", token_b)
+    assert cache.acquire(redis, "key") is not None
+
+
+def test_get_or_fetch_releases_only_its_own_lock() -> None:
+    redis = FakeRedis()
+
+    def fetch() -> Any:
+        # the lock expires mid-fetch and another worker takes it
+        redis.delete(cache.lock_key("key"))
+        assert cache.acquire(redis, "key") is not None
+        cache.store(redis, "key", [1], expires=60)
+        return [1]
+
+    assert cache.get_or_fetch(redis, "key", fetch) == [1]
+    assert cache.acquire(redis, "key") is None
+
+
+def test_expires_early_as_the_expiry_nears() -> None:
+    redis = FakeRedis()
+    redis.set("key", b"[]", ex=3600)
+    # never before the key has been fetched through get_or_fetch
+    assert not cache.expires_early(redis, "key")
+
+    redis.set(cache.delta_key("key"), 1.0)
+    assert not cache.expires_early(redis, "key")
+
+    # a second left of a key that took a second to fetch
+    redis.set("key", b"[]", ex=1)
+    assert cache.expires_early(redis, "key", beta=10**6)
+
+
+class Make:
+    """Counts how often a LocalCache makes a value"""
+
+    def __init__(self) -> None:
+        self.made = 0
+
+    def __call__(self, data: list[int]) -> list[int]:
+        self.made += 1
+        return [i * 2 for i in data]
+
+
+def test_local_cache_keeps_what_was_made_until_a_new_value_is_stored() -> None:
+    redis = FakeRedis()
+    local: cache.LocalCache[list[int]] = cache.LocalCache()
+    make = Make()
+
+    def load() -> Any:
+        return cache.get_or_refresh(redis, "key", Refresh(redis, [1]))
+
+    cache.store(redis, "key", [1, 2], expires=60)
+    assert local.get(redis, "key", load, make) == [2, 4]
+    assert local.get(redis, "key", load, make) == [2, 4]
+    assert make.made == 1
+
+    cache.store(redis, "key", [3], expires=60)
+    assert redis.published[-1] == (cache.INVALIDATE_CHANNEL, "key")
+    assert local.get(redis, "key", load, make) == [6]
+    assert make.made == 2
+
+    local.invalidate("key")
+    assert local.get(redis, "key", load, make) == [6]
+    assert make.made == 3
+
+
+def test_local_cache_does_not_keep_stale_values() -> None:
+    redis = FakeRedis()
+    local: cache.LocalCache[list[int]] = cache.LocalCache()
+    make = Make()
+    refresh = Refresh(redis, [2])
+    cache.store(redis, "key", [1], expires=60)
+    redis.delete("key")
+
+    def load() -> Any:
+        return cache.get_or_refresh(redis, "key", refresh)
+
+    assert local.get(redis, "key", load, make) == [2]
+    assert refresh.queued == 1
+
+    refresh.get()
+    assert local.get(redis, "key", load, make) == [4]
+    assert local.get(redis, "key", load, make) == [4]
+    assert make.made == 2
+
+
+def test_storing_the_same_value_only_extends_it() -> None:
+    redis = FakeRedis()
+    assert cache.store(redis, "key", [1], expires=60, etag='"a"')
+    published = len(redis.published)
+
+    assert not cache.store(redis, "key", [1], expires=120)
+    assert len(redis.published) == published
+    assert 60_000 < redis.pttl("key") <= 120_000
+    assert redis.get(cache.etag_key("key")) == '"a"'
+
+    assert cache.store(redis, "key", [2], expires=60)
+    assert redis.get(cache.etag_key("key")) is None
+    assert len(redis.published) == published + 1
+
+
+def test_renew_puts_back_an_expired_key() -> None:
+    redis = FakeRedis()
+    assert cache.renew(redis, "key", expires=60) is None
+
+    cache.store(redis, "key", [1], expires=60)
+    redis.delete("key")
+    assert cache.renew(redis, "key", expires=60) == [1]
+    assert cache.codec.decode(redis.get("key")) == [1]
+
+
+def test_local_cache_does_not_remake_a_renewed_value() -> None:
+    redis = FakeRedis()
+    local: cache.LocalCache[list[int]] = cache.LocalCache()
+    make = Make()
+    refresh = Refresh(redis, [1])
+    cache.store(redis, "key", [1], expires=60)
+
+    def load() -> Any:
+        return cache.get_or_refresh(redis, "key", refresh)
+
+    assert local.get(redis, "key", load, make) == [2]
+    # the key expires and the refresh finds the same value
+    redis.delete("key")
+    assert local.get(redis, "key", load, make) == [2]
+    refresh.get()
+    assert local.get(redis, "key", load, make) == [2]
+    assert make.made == 1
@@ -0,0 +1,35 @@
+import orjson
+import pytest
+
+from web import codec
+
+
+@pytest.mark.parametrize("name", list(codec.CODECS))
+def test_codecs_round_trip(name: str) -> None:
+    data = [{"id": 1, "department": "UCH T03 INTENSIVE CARE", "closed": None}]
+
+    value = codec.encode(data, name)
+
+    assert value.startswith(codec.MAGIC)
+    assert codec.decode(value) == data
+
+
+def test_values_are_zstd_compressed_msgpack_by_default() -> None:
+    data = [{"id": i, "department": "UCH T03 INTENSIVE CARE"} for i in range(50)]
+
+    value = codec.encode(data)
+
+    assert value[len(codec.MAGIC) + 1] == codec.CODECS["msgpack+zstd"].id
+    assert len(value) < len(orjson.dumps(data))
+    assert codec.decode(value) == data
+
+
+def test_values_without_a_header_are_orjson() -> None:
+    assert codec.decode(orjson.dumps([{"id": 1}])) == [{"id": 1}]
+
+
+def test_unknown_codec_is_an_error() -> None:
+    value = codec.MAGIC + bytes((codec.VERSION, 255)) + b"[]"
+
+    with pytest.raises(ValueError):
+        codec.decode(value)
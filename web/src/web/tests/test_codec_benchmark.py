@@ -0,0 +1,72 @@
+"""
+Time to encode/decode and size in redis of each store with each codec
+
+    pytest -o addopts="" --benchmark-only src/web/tests/test_codec_benchmark.py
+"""
+from datetime import date, datetime, timedelta
+from typing import Any
+
+import pytest
+from pydantic import BaseModel
+
+from models.beds import Bed, Department, Room
+from models.census import CensusRow
+from models.sitrep import SitrepRow
+from web import codec
+
+# (model, rows) roughly the size of each store
+STORES = {
+    "beds": (Bed, 2000),
+    "rooms": (Room, 600),
+    "departments": (Department, 120),
+    "census": (CensusRow, 1500),
+    "sitrep": (SitrepRow, 40),
+}
+MODIFIED_AT = datetime(2022, 7, 18, 12)
+
+
+def _value(field: Any, i: int) -> Any:
+    """A plausible (and plausibly repetitive) value for a model field"""
+    if field.type_ is bool:
+        return i % 3 == 0
+    if field.type_ is int:
+        return i
+    if field.type_ is float:
+        return i / 7
+    if field.type_ is datetime:
+        return (MODIFIED_AT - timedelta(minutes=i)).isoformat()
+    if field.type_ is date:
+        return (date(1950, 1, 1) + timedelta(days=i)).isoformat()
+    if field.name in ("department", "hl7_department", "pm_dept"):
+        return f"UCH T{i % 40:02d} WARD"
+    return f"{field.name}-{i}"
+
+
+def _store(model: type[BaseModel], rows: int) -> list[dict]:
+    return [
+        {name: _value(field, i) for name, field in model.__fields__.items()}
+        for i in range(rows)
+    ]
+
+
+@pytest.mark.parametrize("name", list(codec.CODECS))
+@pytest.mark.parametrize("store", list(STORES))
+def test_benchmark_encode(benchmark: Any, store: str, name: str) -> None:
+    benchmark.group = f"encode {store}"
+    data = _store(*STORES[store])
+
+    value = benchmark(codec.encode, data, name)
+
+    benchmark.extra_info["bytes"] = len(value)
+    assert codec.decode(value) == data
+
+
+@pytest.mark.parametrize("name", list(codec.CODECS))
+@pytest.mark.parametrize("store", list(STORES))
+def test_benchmark_decode(benchmark: Any, store: str, name: str) -> None:
+    benchmark.group = f"decode {store}"
+    data = _store(*STORES[store])
+    value = codec.encode(data, name)
+
+    assert benchmark(codec.decode, value) == data
+    benchmark.extra_info["bytes"] = len(value)
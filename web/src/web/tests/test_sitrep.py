@@ -1,4 +1,8 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
 import pandas as pd
+import pytest
 
 
 def test_flatten_data_frame_dict() -> None:
@@ -17,3 +21,70 @@ def test_flatten_data_frame_dict() -> None:
     )
 
     assert df.iloc[0]["flattened_column"] == "valueA1|valueA2"
+
+
+def _hours_ago(hours: float) -> str:
+    return (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat()
+
+
+def test_merge_discharge_updates_replaces_updated_csns() -> None:
+    from web.pages.sitrep.callbacks.discharges import _merge_discharge_updates
+
+    discharges = [
+        {"csn": 2, "status": "ready", "modified_at": _hours_ago(3)},
+        {"csn": 1, "status": "review", "modified_at": _hours_ago(4)},
+    ]
+    updates = [
+        {"csn": 1, "status": "discharged", "modified_at": _hours_ago(2)},
+        {"csn": 3, "status": "review", "modified_at": _hours_ago(1)},
+    ]
+
+    merged = _merge_discharge_updates(discharges, updates)
+
+    assert [(row["csn"], row["status"]) for row in merged] == [
+        (1, "discharged"),
+        (2, "ready"),
+        (3, "review"),
+    ]
+
+
+def test_merge_discharge_updates_drops_statuses_past_delta_hours() -> None:
+    from web.pages.sitrep.callbacks.discharges import _merge_discharge_updates
+
+    discharges = [
+        {"csn": 1, "status": "ready", "modified_at": _hours_ago(40)},
+        {"csn": 2, "status": "review", "modified_at": _hours_ago(30)},
+    ]
+
+    merged = _merge_discharge_updates(discharges, [], delta_hours=36)
+
+    assert [row["csn"] for row in merged] == [2]
+
+
+def test_store_discharge_status_asks_for_changes_since_newest_status(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    from web.pages.sitrep.callbacks import discharges as module
+
+    asked: dict[str, Any] = {}
+
+    def _get_discharge_updates(delta_hours: int, since: str | None) -> list[dict]:
+        asked["since"] = since
+        return []
+
+    monkeypatch.setattr(module, "_get_discharge_updates", _get_discharge_updates)
+    newest = datetime.now(timezone.utc) - timedelta(hours=1)
+    older = newest - timedelta(hours=1)
+    discharges = [
+        # an hour older but the greater string, being ahead of UTC
+        {
+            "csn": 1,
+            "status": "ready",
+            "modified_at": older.astimezone(timezone(timedelta(hours=5))).isoformat(),
+        },
+        {"csn": 2, "status": "review", "modified_at": newest.isoformat()},
+    ]
+
+    module.store_discharge_status("T03", discharges)
+
+    assert datetime.fromisoformat(asked["since"]) == newest